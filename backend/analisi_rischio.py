@@ -0,0 +1,100 @@
+"""
+Quadro del rischio per azienda e reparto
+Legge solo analisi_rischio_mensile (migrazione 017), mantenuta dai trigger
+sulle valutazioni: una query con GROUPING SETS restituisce insieme il totale,
+i reparti e l'andamento mensile, con un costo che dipende dal numero di
+(reparto, mese) e non dal numero di valutazioni.
+"""
+from datetime import date
+from typing import Optional
+import math
+
+from noise_calculations import PROTEZIONE_CLASSI, RISCHIO_CLASSI
+
+# Colonne di conteggio nell'ordine di RISCHIO_CLASSI e PROTEZIONE_CLASSI
+_COLONNE_RISCHIO = ("n_minimo", "n_medio", "n_rilevante", "n_alto")
+_COLONNE_PROTEZIONE = ("n_eccessiva", "n_buona", "n_ottimale", "n_accettabile", "n_insufficiente")
+
+_SOMME = ", ".join(
+    f"COALESCE(SUM({colonna}), 0) AS {colonna}"
+    for colonna in ("n_esposizione", *_COLONNE_RISCHIO, "somma_lex", "somma_energia",
+                    "n_dpi", *_COLONNE_PROTEZIONE, "somma_leff")
+)
+
+
+def _mese(giorno: Optional[date]) -> Optional[date]:
+    return giorno.replace(day=1) if giorno else None
+
+
+def _riepilogo(row: dict) -> dict:
+    """Conteggi per classe e medie di un gruppo di righe aggregate"""
+    n_lex = sum(int(row[c]) for c in _COLONNE_RISCHIO)
+    n_leff = sum(int(row[c]) for c in _COLONNE_PROTEZIONE)
+    return {
+        "valutazioni": int(row["n_esposizione"]),
+        "classi_rischio": {classe: int(row[c]) for classe, c in zip(RISCHIO_CLASSI, _COLONNE_RISCHIO)},
+        "lex_medio": round(row["somma_lex"] / n_lex, 1) if n_lex else None,
+        # Media energetica: il livello equivalente dell'insieme delle esposizioni
+        "lex_medio_energetico": (
+            round(10 * math.log10(row["somma_energia"] / n_lex), 1)
+            if n_lex and row["somma_energia"] > 0 else None
+        ),
+        "lex_max": float(row["lex_max"]) if row["lex_max"] is not None else None,
+        "dpi": {
+            "valutazioni": int(row["n_dpi"]),
+            "classi_protezione": {classe: int(row[c]) for classe, c in zip(PROTEZIONE_CLASSI, _COLONNE_PROTEZIONE)},
+            "leff_medio": round(row["somma_leff"] / n_leff, 1) if n_leff else None,
+        },
+    }
+
+
+def load_analisi_azienda(cursor, user_id: int, azienda_id: int, da: Optional[date] = None,
+                         a: Optional[date] = None) -> dict:
+    """
+    Totale, reparti e andamento mensile di un'azienda (azienda_id 0 = senza azienda)
+    da/a delimitano i mesi inclusi (si considera il mese della data)
+    """
+    cursor.execute(f"""
+        SELECT reparto, mese, GROUPING(reparto) AS per_mese, GROUPING(mese) AS per_reparto,
+               {_SOMME}, MAX(lex_max) AS lex_max
+        FROM analisi_rischio_mensile
+        WHERE user_id = %s AND azienda_id = %s
+          AND (%s::date IS NULL OR mese >= %s::date)
+          AND (%s::date IS NULL OR mese <= %s::date)
+        GROUP BY GROUPING SETS ((reparto), (mese), ())
+        ORDER BY reparto NULLS LAST, mese NULLS LAST
+    """, (user_id, azienda_id, _mese(da), _mese(da), _mese(a), _mese(a)))
+
+    totale, reparti, andamento = None, [], []
+    for row in cursor.fetchall():
+        if not (row["n_esposizione"] or row["n_dpi"] or (row["per_mese"] and row["per_reparto"])):
+            continue
+        if row["per_mese"] and row["per_reparto"]:
+            totale = _riepilogo(row)
+        elif row["per_mese"]:
+            andamento.append({"mese": row["mese"].strftime("%Y-%m"), **_riepilogo(row)})
+        else:
+            reparti.append({"reparto": row["reparto"], **_riepilogo(row)})
+    return {"totale": totale, "reparti": reparti, "andamento": andamento}
+
+
+def load_analisi_utente(cursor, user_id: int, da: Optional[date] = None, a: Optional[date] = None) -> list:
+    """Riepilogo per azienda di tutte le valutazioni dell'utente"""
+    cursor.execute(f"""
+        SELECT r.*, az.ragione_sociale
+        FROM (
+            SELECT azienda_id, {_SOMME}, MAX(lex_max) AS lex_max
+            FROM analisi_rischio_mensile
+            WHERE user_id = %s
+              AND (%s::date IS NULL OR mese >= %s::date)
+              AND (%s::date IS NULL OR mese <= %s::date)
+            GROUP BY azienda_id
+        ) r
+        LEFT JOIN aziende az ON az.id = r.azienda_id
+        ORDER BY az.ragione_sociale NULLS LAST
+    """, (user_id, _mese(da), _mese(da), _mese(a), _mese(a)))
+    return [
+        {"azienda_id": row["azienda_id"] or None, "ragione_sociale": row["ragione_sociale"], **_riepilogo(row)}
+        for row in cursor.fetchall()
+        if row["n_esposizione"] or row["n_dpi"]
+    ]
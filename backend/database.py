@@ -0,0 +1,168 @@
+"""
+Connessione al database PostgreSQL
+Connessione e cursori strumentati condivisi da main, subscriptions e stripe_webhooks
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+import time
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Query più lente di questa soglia vengono loggate con SQL normalizzato e punto di chiamata
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# I/O sincrono sull'event loop: 'warn' (log), 'raise' (errore, per i test) oppure 'off'
+ASYNC_BLOCKING_CHECK = os.getenv("ASYNC_BLOCKING_CHECK", "warn").lower()
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+# Frame da saltare per risalire al codice applicativo che ha eseguito la query
+_SKIP_FILES = (os.path.abspath(__file__), os.path.dirname(psycopg2.__file__))
+
+
+def normalize_sql(query) -> str:
+    """SQL su una riga con letterali sostituiti da '?' (raggruppa statement equivalenti)"""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)
+    query = _STRING_LITERAL.sub("?", query)
+    query = _NUMBER_LITERAL.sub("?", query)
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+def _callsite():
+    """(modulo:funzione, riga) del primo frame fuori da database.py e psycopg2"""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename.startswith(_SKIP_FILES):
+        frame = frame.f_back
+    if frame is None:
+        return "unknown", 0
+    module = os.path.basename(frame.f_code.co_filename)
+    return f"{module}:{frame.f_code.co_name}", frame.f_lineno
+
+
+def check_not_on_event_loop():
+    """
+    Segnala psycopg2 usato dal thread dell'event loop (handler async def o task):
+    ogni query bloccherebbe tutte le richieste in corso
+    """
+    if ASYNC_BLOCKING_CHECK == "off" or asyncio._get_running_loop() is None:
+        return
+    callsite, lineno = _callsite()
+    message = f"Accesso sincrono al database nell'event loop ({callsite}:{lineno})"
+    if ASYNC_BLOCKING_CHECK == "raise":
+        raise RuntimeError(message)
+    logger.error(message)
+
+
+class InstrumentedCursorMixin:
+    """Misura ogni statement: tempo, righe, punto di chiamata e conteggio per richiesta"""
+
+    def execute(self, query, vars=None):
+        check_not_on_event_loop()
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        check_not_on_event_loop()
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        check_not_on_event_loop()
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._record(sql, time.perf_counter() - start)
+
+    def _record(self, query, duration):
+        callsite, lineno = _callsite()
+        metrics.DB_QUERY_LATENCY.labels(callsite).observe(duration)
+        stats = metrics.record_query(duration)
+
+        slow = duration * 1000 >= SLOW_QUERY_MS
+        if not slow and (stats is None or stats.statements is None):
+            return
+
+        statement = normalize_sql(query)
+        if stats is not None and stats.statements is not None:
+            stats.statements[statement] = stats.statements.get(statement, 0) + 1
+        if slow:
+            logger.warning("Query lenta", extra={
+                "duration_ms": round(duration * 1000, 1),
+                "rows": self.rowcount,
+                "callsite": f"{callsite}:{lineno}",
+                "sql": statement,
+            })
+
+
+_instrumented_cursor_classes = {}
+
+def _instrumented(cursor_class):
+    """Sottoclasse strumentata (memorizzata) di una classe cursore psycopg2"""
+    instrumented = _instrumented_cursor_classes.get(cursor_class)
+    if instrumented is None:
+        instrumented = type(
+            f"Instrumented{cursor_class.__name__}",
+            (InstrumentedCursorMixin, cursor_class),
+            {},
+        )
+        _instrumented_cursor_classes[cursor_class] = instrumented
+    return instrumented
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """
+    Connessione che strumenta ogni cursore, anche quando il chiamante passa
+    un cursor_factory esplicito (es. conn.cursor(cursor_factory=RealDictCursor))
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        metrics.DB_CONNECTIONS_IN_USE.inc()
+
+    def cursor(self, *args, **kwargs):
+        cursor_class = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _instrumented(cursor_class)
+        return super().cursor(*args, **kwargs)
+
+    def close(self):
+        if not self.closed:
+            metrics.DB_CONNECTIONS_IN_USE.dec()
+        super().close()
+
+
+def connect(cursor_factory=RealDictCursor):
+    """
+    Apre una connessione strumentata verso DATABASE_URL
+
+    Args:
+        cursor_factory: Classe cursore di default (None per cursori a tuple)
+    """
+    check_not_on_event_loop()
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is not set")
+    return psycopg2.connect(
+        database_url,
+        connection_factory=InstrumentedConnection,
+        cursor_factory=cursor_factory,
+    )
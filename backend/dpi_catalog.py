@@ -0,0 +1,309 @@
+"""
+Catalogo DPI uditivi (tabella dpi_catalog)
+Il catalogo è tenuto in memoria in ogni worker: un indice dei token per la
+ricerca per prefisso, i trigrammi per la ricerca tollerante agli errori di
+battitura e array NumPy per i filtri su SNR/H/M/L. La ricerca non accede al
+database; l'indice viene ricostruito quando il catalogo cambia (controllo
+al massimo ogni DPI_CATALOG_REFRESH_SECONDS).
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Optional
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+import database
+from noise_calculations import (
+    LEFF_OTTIMALE, OTTAVE_HZ, PROTEZIONE_CLASSI, HML_COEFFICIENTI, HML_FASCE, classe_protezione, pnr_hml,
+)
+
+logger = logging.getLogger(__name__)
+
+# Intervallo minimo tra due controlli di versione del catalogo sul database
+DPI_CATALOG_REFRESH_SECONDS = float(os.getenv("DPI_CATALOG_REFRESH_SECONDS", "60"))
+
+# Somiglianza minima (coefficiente di Dice sui trigrammi) per la ricerca fuzzy
+_SOGLIA_FUZZY = 0.5
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalizza(text: str) -> str:
+    """Minuscolo e senza accenti"""
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokens(text: str) -> list:
+    return _TOKEN_RE.findall(normalizza(text))
+
+
+def _trigrammi(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CatalogIndex:
+    """Indice immutabile dei prodotti attivi (ordinati per nome)"""
+
+    def __init__(self, rows: list, version=None):
+        self.version = version
+        self.products = [self._prodotto(row) for row in rows]
+        self.posizione = {p["codice"]: pos for pos, p in enumerate(self.products)}
+
+        self.snr = np.array([p["snr"] for p in self.products], dtype=np.float64)
+        self.h = np.array([p["h"] for p in self.products], dtype=np.float64)
+        self.m = np.array([p["m"] for p in self.products], dtype=np.float64)
+        self.l = np.array([p["l"] for p in self.products], dtype=np.float64)
+        self.hml = np.column_stack([self.h, self.m, self.l]).reshape(-1, 3)
+        # Dati per banda d'ottava (NaN se il produttore non li dichiara)
+        vuoto = {"mf": [np.nan] * len(OTTAVE_HZ), "sf": [np.nan] * len(OTTAVE_HZ)}
+        self.ottave_mf = np.array([(p["ottave"] or vuoto)["mf"] for p in self.products], dtype=np.float64).reshape(-1, len(OTTAVE_HZ))
+        self.ottave_sf = np.array([(p["ottave"] or vuoto)["sf"] for p in self.products], dtype=np.float64).reshape(-1, len(OTTAVE_HZ))
+        self.ha_ottave = ~np.isnan(self.ottave_mf).any(axis=1)
+        # Maschere precalcolate per i filtri per categoria
+        self._per_tipo = self._maschere([normalizza(p["tipo"]) for p in self.products])
+        self._per_produttore = self._maschere([normalizza(p["produttore"]) for p in self.products])
+
+        # token -> posizioni dei prodotti (nome, produttore e tipo), in formato
+        # CSR: i token sono ordinati, quindi quelli con lo stesso prefisso
+        # occupano un intervallo contiguo di _flat
+        postings = defaultdict(set)
+        for pos, p in enumerate(self.products):
+            for token in tokens(f"{p['nome']} {p['produttore'] or ''} {p['tipo'] or ''} {p['codice']}"):
+                postings[token].add(pos)
+        self._tokens = sorted(postings)
+        self._offsets = np.zeros(len(self._tokens) + 1, dtype=np.int64)
+        self._offsets[1:] = np.cumsum([len(postings[token]) for token in self._tokens])
+        self._flat = np.fromiter(
+            (pos for token in self._tokens for pos in sorted(postings[token])),
+            dtype=np.int64, count=int(self._offsets[-1])
+        )
+
+        # trigramma -> indici in self._tokens
+        self._trigram_postings = defaultdict(list)
+        for i, token in enumerate(self._tokens):
+            for trigram in _trigrammi(token):
+                self._trigram_postings[trigram].append(i)
+
+    @staticmethod
+    def _maschere(valori: list) -> dict:
+        valori = np.array(valori, dtype=object)
+        return {valore: valori == valore for valore in set(valori)}
+
+    @staticmethod
+    def _prodotto(row: dict) -> dict:
+        ottave = None
+        if row.get("ottave_mf") and row.get("ottave_sf"):
+            ottave = {"mf": list(row["ottave_mf"]), "sf": list(row["ottave_sf"])}
+        return {
+            "id": row["id"],
+            "codice": row["codice"],
+            "nome": row["nome"],
+            "produttore": row["produttore"],
+            "tipo": row["tipo"],
+            "snr": float(row["snr"]),
+            "h": float(row["h"]),
+            "m": float(row["m"]),
+            "l": float(row["l"]),
+            "ottave": ottave,
+        }
+
+    def __len__(self):
+        return len(self.products)
+
+    def mask(self, tipo: Optional[str] = None, produttore: Optional[str] = None, **intervalli) -> np.ndarray:
+        """
+        Maschera booleana dei prodotti che rispettano i filtri
+        intervalli: snr_min, snr_max, h_min, ... l_max (None = nessun limite)
+        """
+        mask = np.ones(len(self.products), dtype=bool)
+        for nome, valore in intervalli.items():
+            if valore is None:
+                continue
+            colonna, limite = nome.rsplit("_", 1)
+            valori = getattr(self, colonna)
+            mask &= valori >= valore if limite == "min" else valori <= valore
+        if tipo:
+            mask &= self._per_tipo.get(normalizza(tipo), False)
+        if produttore:
+            mask &= self._per_produttore.get(normalizza(produttore), False)
+        return mask
+
+    def _posizioni(self, start: int, end: int) -> np.ndarray:
+        """Prodotti dei token self._tokens[start:end]"""
+        return self._flat[self._offsets[start]:self._offsets[end]]
+
+    def _match_token(self, query_token: str, fuzzy_sotto: int) -> np.ndarray:
+        """
+        Punteggio di ogni prodotto per una parola della ricerca: 2 token
+        uguale, 1 prefisso, somiglianza < 1 se fuzzy, 0 nessuna corrispondenza
+        """
+        scores = np.zeros(len(self.products))
+        start = bisect_left(self._tokens, query_token)
+        end = bisect_left(self._tokens, query_token + "{")  # '{' segue 'z' e le cifre
+        scores[self._posizioni(start, end)] = 1.0
+        if start < end and self._tokens[start] == query_token:
+            scores[self._posizioni(start, start + 1)] = 2.0
+
+        # Errori di battitura: solo se pochi token hanno questo prefisso
+        if end - start < fuzzy_sotto and len(query_token) >= 3:
+            query_trigrams = _trigrammi(query_token)
+            comuni = defaultdict(int)
+            for trigram in query_trigrams:
+                for i in self._trigram_postings.get(trigram, ()):
+                    comuni[i] += 1
+            for i, n in comuni.items():
+                similarity = 2 * n / (len(query_trigrams) + len(_trigrammi(self._tokens[i])))
+                if similarity >= _SOGLIA_FUZZY:
+                    posizioni = self._posizioni(i, i + 1)
+                    scores[posizioni] = np.maximum(scores[posizioni], similarity)
+        return scores
+
+    def search(self, q: str = "", limit: int = 20, **filtri) -> list:
+        """
+        Ricerca per prefisso/fuzzy su nome, produttore e tipo con i filtri di mask()
+        Ogni parola della ricerca deve corrispondere ad almeno un token del prodotto
+        """
+        mask = self.mask(**filtri)
+        query_tokens = tokens(q)
+        if not query_tokens:
+            return [self.products[pos] for pos in np.flatnonzero(mask)[:limit]]
+
+        totali = np.where(mask, 0.0, -np.inf)
+        for query_token in query_tokens:
+            scores = self._match_token(query_token, fuzzy_sotto=limit)
+            totali += np.where(scores > 0, scores, -np.inf)
+
+        # Punteggio decrescente, poi ordine alfabetico (posizione nell'indice)
+        candidati = np.flatnonzero(totali > 0)
+        candidati = candidati[np.lexsort((candidati, -totali[candidati]))[:limit]]
+        return [self.products[pos] for pos in candidati]
+
+    def raccomanda(self, lex, top: int = 10, **filtri) -> list:
+        """
+        DPI del catalogo che portano L'eff più vicino alla fascia OTTIMALE
+        (70-80 dB(A)) per uno o più lavoratori, con il metodo HML
+
+        Ordine: lavoratori con protezione insufficiente (L'eff > 85), poi
+        distanza media dalla fascia ottimale. Nessuna matrice lavoratori x
+        prodotti: dentro una fascia di LEX la PNR di un prodotto è costante,
+        quindi con i LEX ordinati e le loro somme prefisse i conteggi e le
+        distanze di tutti i prodotti si ottengono con searchsorted.
+        """
+        lex = np.asarray(lex, dtype=np.float64)
+        lex = lex[lex > 0]
+        posizioni = np.flatnonzero(self.mask(**filtri))
+        if not len(lex) or not len(posizioni):
+            return []
+
+        valori, conteggi = np.unique(lex, return_counts=True)
+        hml = self.hml[posizioni].astype(np.float64)
+        basso, alto = LEFF_OTTIMALE
+
+        distanza = np.zeros(len(posizioni))
+        insufficienti = np.zeros(len(posizioni))
+        # I LEX ordinati occupano fasce HML contigue
+        fasce = np.searchsorted(HML_FASCE, valori, side="left")
+        for fascia in np.unique(fasce):
+            lo, hi = np.searchsorted(fasce, [fascia, fascia + 1])
+            v, c = valori[lo:hi], conteggi[lo:hi]
+            n_cum = np.concatenate(([0], np.cumsum(c)))
+            s_cum = np.concatenate(([0], np.cumsum(c * v)))
+            pnr = hml @ HML_COEFFICIENTI[fascia]
+
+            # L'eff < 70  <=>  LEX < 70 + PNR
+            soglia = basso + pnr
+            k = np.searchsorted(v, soglia, side="left")
+            distanza += soglia * n_cum[k] - s_cum[k]
+            # L'eff > 80  <=>  LEX > 80 + PNR
+            soglia = alto + pnr
+            k = np.searchsorted(v, soglia, side="right")
+            distanza += (s_cum[-1] - s_cum[k]) - soglia * (n_cum[-1] - n_cum[k])
+            k = np.searchsorted(v, 85 + pnr, side="right")
+            insufficienti += n_cum[-1] - n_cum[k]
+        distanza /= conteggi.sum()
+
+        migliori = np.lexsort((posizioni, distanza, insufficienti))[:top]
+
+        # Dettaglio solo per i prodotti restituiti
+        leff = valori[:, None] - pnr_hml(valori, hml[migliori])
+        classi = classe_protezione(leff)
+        risultati = []
+        for j, i in enumerate(migliori):
+            item = {
+                **self.products[posizioni[i]],
+                "leff_min": round(float(leff[:, j].min()), 1),
+                "leff_max": round(float(leff[:, j].max()), 1),
+                "distanza_media": round(float(distanza[i]), 2),
+                "lavoratori": {
+                    classe.split(" - ")[0]: int(conteggi[classi[:, j] == k].sum())
+                    for k, classe in enumerate(PROTEZIONE_CLASSI)
+                },
+            }
+            if len(valori) == 1:
+                item["pnr"] = round(float(valori[0] - leff[0, j]), 1)
+                item["leff"] = round(float(leff[0, j]), 1)
+                item["protezione_adeguata"] = PROTEZIONE_CLASSI[classi[0, j]]
+            risultati.append(item)
+        return risultati
+
+_index = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _version(cursor):
+    cursor.execute("SELECT COUNT(*) AS n, MAX(updated_at) AS updated_at FROM dpi_catalog")
+    row = cursor.fetchone()
+    return (row["n"], row["updated_at"])
+
+
+def _load(cursor, version) -> CatalogIndex:
+    cursor.execute("""
+        SELECT id, codice, nome, produttore, tipo, snr, h, m, l, ottave_mf, ottave_sf
+        FROM dpi_catalog
+        WHERE attivo
+        ORDER BY lower(nome), id
+    """)
+    index = CatalogIndex(cursor.fetchall(), version)
+    logger.info("Indice catalogo DPI costruito", extra={"prodotti": len(index)})
+    return index
+
+
+def get_index() -> CatalogIndex:
+    """
+    Indice corrente; ricostruito se il catalogo è cambiato dall'ultimo
+    controllo (al massimo uno ogni DPI_CATALOG_REFRESH_SECONDS)
+    """
+    global _index, _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < DPI_CATALOG_REFRESH_SECONDS:
+        return _index
+
+    with _lock:
+        if _index is not None and time.monotonic() - _checked_at < DPI_CATALOG_REFRESH_SECONDS:
+            return _index
+        conn = database.connect()
+        cursor = conn.cursor()
+        try:
+            version = _version(cursor)
+            if _index is None or _index.version != version:
+                _index = _load(cursor, version)
+            _checked_at = time.monotonic()
+        finally:
+            cursor.close()
+            conn.close()
+    return _index
+
+
+def invalidate():
+    """Forza il controllo della versione alla prossima ricerca (dopo un import)"""
+    global _checked_at
+    _checked_at = 0.0
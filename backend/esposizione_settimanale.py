@@ -0,0 +1,167 @@
+"""
+Livello di esposizione settimanale LEX,w (D.Lgs. 81/2008 art. 189, ISO 1999)
+LEX,w = 10 log10(1/5 Σ 10^(0.1 LEX,8h,d)) sui giorni lavorati della
+settimana. Le valutazioni sono raggruppate per (azienda, mansione, reparto)
+e datate con data_misura; più valutazioni dello stesso giorno sono mediate
+in energia. Il risultato di ogni gruppo resta in memoria finché il gruppo
+non cambia (versione = numero di righe e ultima transazione di scrittura).
+"""
+from collections import OrderedDict
+from datetime import date, timedelta
+import os
+import threading
+
+import numpy as np
+
+# Gruppi tenuti in memoria per worker (i meno recenti escono per primi)
+LEXW_CACHE_MAX_GRUPPI = int(os.getenv("LEXW_CACHE_MAX_GRUPPI", "10000"))
+
+# Giorni lavorativi della settimana di riferimento
+GIORNI_SETTIMANA = 5
+
+# Lunedì di riferimento: (data - _LUNEDI) // 7 è la settimana
+_LUNEDI = date(2000, 1, 3)
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _filtri(user_id: int, azienda_id=None, mansione=None, reparto=None):
+    clausole, params = ["user_id = %s"], [user_id]
+    for colonna, valore in (("azienda_id", azienda_id), ("mansione", mansione), ("reparto", reparto)):
+        if valore is not None:
+            clausole.append(f"{colonna} = %s")
+            params.append(valore)
+    return " AND ".join(clausole), params
+
+
+def aggrega(giorno, gruppo, lex, n_gruppi: int) -> list:
+    """
+    LEX,w di tutte le settimane di tutti i gruppi in una passata
+
+    Args:
+        giorno: Giorni dal lunedì di riferimento, forma (N,)
+        gruppo: Indice del gruppo di ogni valutazione, forma (N,)
+        lex: LEX,8h delle valutazioni, forma (N,)
+        n_gruppi: Numero di gruppi
+
+    Returns:
+        Per ogni gruppo la lista di (settimana, giorni, lex_w) in ordine di data
+    """
+    giorno = np.asarray(giorno, dtype=np.int64)
+    gruppo = np.asarray(gruppo, dtype=np.int64)
+    energia = 10 ** (0.1 * np.asarray(lex, dtype=np.float64))
+    risultati = [[] for _ in range(n_gruppi)]
+    if not len(giorno):
+        return risultati
+
+    # Giorni relativi al lunedì della prima settimana: chiave unica (gruppo, giorno)
+    base = giorno.min() // 7 * 7
+    relativo = giorno - base
+    ampiezza = int(relativo.max()) + 1
+
+    # Media energetica per (gruppo, giorno)
+    giorni, inverso = np.unique(gruppo * ampiezza + relativo, return_inverse=True)
+    energia_giorno = np.bincount(inverso, weights=energia) / np.bincount(inverso)
+
+    # Somma per (gruppo, settimana) sui giorni distinti
+    gruppo_giorno, relativo_giorno = np.divmod(giorni, ampiezza)
+    settimane, inverso, giorni_lavorati = np.unique(
+        gruppo_giorno * ampiezza + relativo_giorno // 7, return_inverse=True, return_counts=True
+    )
+    lex_w = 10 * np.log10(np.bincount(inverso, weights=energia_giorno) / GIORNI_SETTIMANA)
+
+    gruppo_settimana, settimana = np.divmod(settimane, ampiezza)
+    for g, w, n, valore in zip(gruppo_settimana.tolist(), (settimana + base // 7).tolist(),
+                               giorni_lavorati.tolist(), lex_w.tolist()):
+        risultati[g].append((w, n, valore))
+    return risultati
+
+
+def _riepilogo(settimane: list) -> dict:
+    """Formato di risposta di un gruppo"""
+    voci = [
+        {
+            "settimana": (_LUNEDI + timedelta(weeks=settimana)).isoformat(),
+            "giorni": giorni,
+            "lex_w": round(lex_w, 1),
+        }
+        for settimana, giorni, lex_w in settimane
+    ]
+    peggiore = max(voci, key=lambda v: v["lex_w"], default=None)
+    return {
+        "settimane": voci,
+        "lex_w_max": peggiore["lex_w"] if peggiore else None,
+        "settimana_max": peggiore["settimana"] if peggiore else None,
+    }
+
+
+def load_esposizione_settimanale(cursor, user_id: int, azienda_id=None, mansione=None, reparto=None) -> list:
+    """
+    LEX,w per gruppo (azienda, mansione, reparto) dell'utente
+
+    Una query legge le versioni dei gruppi selezionati; solo i gruppi
+    cambiati dall'ultima richiesta vengono riletti e ricalcolati.
+    """
+    where, params = _filtri(user_id, azienda_id, mansione, reparto)
+    cursor.execute(f"""
+        SELECT azienda_id, mansione, reparto,
+               COUNT(*) AS n, MAX(sync_xid) AS sync_xid, MAX(updated_at) AS updated_at
+        FROM valutazioni_esposizione
+        WHERE {where}
+        GROUP BY azienda_id, mansione, reparto
+        ORDER BY azienda_id NULLS FIRST, mansione, reparto
+    """, params)
+    gruppi = [
+        ((user_id, row["azienda_id"], row["mansione"], row["reparto"]),
+         (row["n"], row["sync_xid"], row["updated_at"]))
+        for row in cursor.fetchall()
+    ]
+
+    riepiloghi = {}
+    with _lock:
+        for chiave, versione in gruppi:
+            voce = _cache.get(chiave)
+            if voce is not None and voce[0] == versione:
+                riepiloghi[chiave] = voce[1]
+                _cache.move_to_end(chiave)
+    scaduti = [chiave for chiave, _ in gruppi if chiave not in riepiloghi]
+
+    if scaduti:
+        cursor.execute("""
+            SELECT g.indice - 1 AS gruppo, (v.data_misura - %s)::int AS giorno, v.lex::float8 AS lex
+            FROM unnest(%s::int[], %s::text[], %s::text[]) WITH ORDINALITY
+                 AS g(azienda_id, mansione, reparto, indice)
+            JOIN valutazioni_esposizione v
+              ON v.user_id = %s
+             AND v.azienda_id IS NOT DISTINCT FROM g.azienda_id
+             AND v.mansione = g.mansione
+             AND v.reparto IS NOT DISTINCT FROM g.reparto
+            WHERE v.lex IS NOT NULL AND v.data_misura IS NOT NULL
+        """, (
+            _LUNEDI,
+            [chiave[1] for chiave in scaduti],
+            [chiave[2] for chiave in scaduti],
+            [chiave[3] for chiave in scaduti],
+            user_id,
+        ))
+        rows = cursor.fetchall()
+        settimane = aggrega(
+            [row["giorno"] for row in rows],
+            [row["gruppo"] for row in rows],
+            [row["lex"] for row in rows],
+            len(scaduti),
+        )
+        versioni = dict(gruppi)
+        with _lock:
+            for chiave, settimane_gruppo in zip(scaduti, settimane):
+                riepiloghi[chiave] = _riepilogo(settimane_gruppo)
+                _cache[chiave] = (versioni[chiave], riepiloghi[chiave])
+                _cache.move_to_end(chiave)
+            while len(_cache) > LEXW_CACHE_MAX_GRUPPI:
+                _cache.popitem(last=False)
+
+    return [
+        {"azienda_id": chiave[1], "mansione": chiave[2], "reparto": chiave[3], **riepiloghi[chiave]}
+        for chiave, _ in gruppi
+    ]
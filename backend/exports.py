@@ -0,0 +1,291 @@
+"""
+Esportazioni in streaming
+Generatori di byte per StreamingResponse: l'output viene prodotto e inviato a
+pezzi, senza mai tenere in memoria (o su disco temporaneo) l'intero file.
+I generatori aprono la propria connessione al database, perché la dipendenza
+get_db viene chiusa prima che la risposta in streaming inizi.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from functools import partial
+import csv
+import io
+import json
+import logging
+import os
+import uuid
+import zipfile
+
+from psycopg2.extras import RealDictCursor
+
+import database
+import reports
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Download B2 (e rendering report) avviati in anticipo rispetto alla scrittura
+EXPORT_B2_CONCURRENCY = int(os.getenv("EXPORT_B2_CONCURRENCY", "4"))
+
+CHUNK_SIZE = 64 * 1024
+
+# Righe lette dal cursore server-side per ogni blocco inviato al client
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+
+# ==================== ZIP ====================
+
+class _StreamSink:
+    """
+    Destinazione non seekable per ZipFile: accumula i byte scritti finché il
+    generatore non li preleva con take(). zipfile usa i data descriptor, quindi
+    non deve mai tornare indietro nel flusso.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _open_report(data: dict):
+    path, _ = reports.render_report(data, "pdf")
+    return open(path, "rb")
+
+
+def _load_export_entries(azienda_id: int, user_id: int) -> list:
+    """(nome nell'archivio, funzione che apre il contenuto) per report e documenti"""
+    conn = database.connect()
+    cursor = conn.cursor()
+    try:
+        datasets = reports.load_azienda_report_data(cursor, azienda_id, user_id=user_id)
+
+        ids = {"esposizione": [], "dpi": []}
+        entries = []
+        for data in datasets:
+            ids[data["tipo"]].append(data["valutazione"]["id"])
+            entries.append((f"{data['tipo']}/{reports.report_filename(data, 'pdf')}", partial(_open_report, data)))
+
+        cursor.execute("""
+            SELECT id, valutazione_esposizione_id, valutazione_dpi_id, nome_file, url
+            FROM documenti
+            WHERE valutazione_esposizione_id = ANY(%s) OR valutazione_dpi_id = ANY(%s)
+            ORDER BY id
+        """, (ids["esposizione"], ids["dpi"]))
+        for doc in cursor.fetchall():
+            if doc["valutazione_esposizione_id"]:
+                cartella = f"esposizione/documenti_{doc['valutazione_esposizione_id']}"
+            else:
+                cartella = f"dpi/documenti_{doc['valutazione_dpi_id']}"
+            nome = os.path.basename(doc["nome_file"]) or "documento"
+            file_key = doc["url"].split('/')[-1]
+            entries.append((f"{cartella}/{doc['id']}_{nome}", partial(storage.open_object, file_key)))
+        return entries
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def stream_azienda_zip(azienda_id: int, user_id: int):
+    """
+    Genera lo ZIP con i report PDF e i documenti di tutte le valutazioni
+    dell'azienda. Al massimo EXPORT_B2_CONCURRENCY contenuti vengono aperti in
+    anticipo; ognuno è copiato nell'archivio a blocchi di CHUNK_SIZE.
+    Gli elementi non recuperabili sono elencati in ERRORI.txt.
+    """
+    entries = _load_export_entries(azienda_id, user_id)
+    sink = _StreamSink()
+    errori = []
+    window = deque()
+
+    with ThreadPoolExecutor(max_workers=EXPORT_B2_CONCURRENCY) as executor:
+        pending = iter(entries)
+        try:
+            with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+                while True:
+                    while len(window) < EXPORT_B2_CONCURRENCY:
+                        entry = next(pending, None)
+                        if entry is None:
+                            break
+                        name, opener = entry
+                        window.append((name, executor.submit(opener)))
+                    if not window:
+                        break
+
+                    name, future = window.popleft()
+                    try:
+                        source = future.result()
+                    except Exception as e:
+                        logger.warning("Elemento export non disponibile", extra={"azienda_id": azienda_id, "entry": name, "error": str(e)})
+                        errori.append(f"{name}: {e}")
+                        continue
+
+                    try:
+                        with archive.open(name, "w", force_zip64=True) as target:
+                            while True:
+                                chunk = source.read(CHUNK_SIZE)
+                                if not chunk:
+                                    break
+                                target.write(chunk)
+                                data = sink.take()
+                                if data:
+                                    yield data
+                    finally:
+                        source.close()
+
+                if errori:
+                    archive.writestr("ERRORI.txt", "\n".join(errori) + "\n")
+            yield sink.take()
+        finally:
+            # Client disconnesso o errore: chiude i contenuti già aperti
+            for _, future in window:
+                future.cancel()
+            executor.shutdown(wait=True)
+            for _, future in window:
+                if not future.cancelled() and future.exception() is None:
+                    future.result().close()
+
+# ==================== CSV / NDJSON ====================
+
+_MISURAZIONI_JSON = """
+    COALESCE((
+        SELECT json_agg(json_build_object(
+            'ordine', m.ordine, 'attivita', m.attivita,
+            'leq', m.leq, 'durata', m.durata, 'lpicco', m.lpicco
+        ) ORDER BY m.ordine, m.id)
+        FROM misurazioni m WHERE m.valutazione_id = v.id
+    ), '[]'::json)
+"""
+
+# Risorsa -> (query con filtro utente, colonne CSV)
+# Ordinate per id (PK): il cursore inizia a restituire righe senza ordinamenti
+EXPORT_RESOURCES = {
+    "aziende": ("""
+        SELECT id, ragione_sociale, partita_iva, codice_fiscale, indirizzo, citta,
+               cap, provincia, telefono, email, rappresentante_legale, created_at, updated_at
+        FROM aziende
+        WHERE user_id = %s
+        ORDER BY id
+    """, [
+        "id", "ragione_sociale", "partita_iva", "codice_fiscale", "indirizzo", "citta",
+        "cap", "provincia", "telefono", "email", "rappresentante_legale", "created_at", "updated_at",
+    ]),
+    "esposizione": (f"""
+        SELECT v.id, v.azienda_id, a.ragione_sociale, v.mansione, v.reparto,
+               v.lex, v.lpicco, v.classe_rischio, v.created_at,
+               {_MISURAZIONI_JSON} AS misurazioni
+        FROM valutazioni_esposizione v
+        LEFT JOIN aziende a ON a.id = v.azienda_id
+        WHERE v.user_id = %s
+        ORDER BY v.id
+    """, [
+        "id", "azienda_id", "ragione_sociale", "mansione", "reparto",
+        "lex", "lpicco", "classe_rischio", "created_at",
+        "misurazione_ordine", "attivita", "leq", "durata", "misurazione_lpicco",
+    ]),
+    "dpi": ("""
+        SELECT v.id, v.azienda_id, a.ragione_sociale, v.mansione, v.reparto,
+               v.dpi_selezionato, v.h, v.m, v.l, v.lex_per_dpi, v.pnr, v.leff,
+               v.protezione_adeguata, v.created_at
+        FROM valutazioni_dpi v
+        LEFT JOIN aziende a ON a.id = v.azienda_id
+        WHERE v.user_id = %s
+        ORDER BY v.id
+    """, [
+        "id", "azienda_id", "ragione_sociale", "mansione", "reparto",
+        "dpi_selezionato", "h", "m", "l", "lex_per_dpi", "pnr", "leff",
+        "protezione_adeguata", "created_at",
+    ]),
+}
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_rows(risorsa: str, row: dict):
+    """Righe CSV di un record: le valutazioni esposizione hanno una riga per misurazione"""
+    if risorsa != "esposizione":
+        yield [_csv_value(value) for value in row.values()]
+        return
+
+    base = [_csv_value(row[key]) for key in row if key != "misurazioni"]
+    misurazioni = row["misurazioni"] or [{}]
+    for m in misurazioni:
+        yield base + [
+            _csv_value(m.get("ordine")), _csv_value(m.get("attivita")), _csv_value(m.get("leq")),
+            _csv_value(m.get("durata")), _csv_value(m.get("lpicco")),
+        ]
+
+
+def stream_export(risorsa: str, formato: str, user_id: int):
+    """
+    Esporta tutti i record dell'utente per la risorsa in CSV o NDJSON
+
+    Un cursore server-side (named cursor) legge EXPORT_BATCH_ROWS righe alla
+    volta: la memoria resta costante e il primo blocco parte subito.
+    """
+    query, columns = EXPORT_RESOURCES[risorsa]
+    conn = database.connect()
+    # Il cursore con nome vive solo dentro una transazione: readonly evita lock inutili
+    conn.set_session(readonly=True)
+    cursor = conn.cursor(name=f"export_{risorsa}_{uuid.uuid4().hex[:8]}", cursor_factory=RealDictCursor)
+    cursor.itersize = EXPORT_BATCH_ROWS
+    try:
+        cursor.execute(query, (user_id,))
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if formato == "csv" else None
+        if writer:
+            buffer.write("\ufeff")  # BOM: Excel riconosce l'UTF-8 (come esportaCSVEsposizione)
+            writer.writerow(columns)
+
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_ROWS)
+            if not rows:
+                break
+            for row in rows:
+                if writer:
+                    writer.writerows(_csv_rows(risorsa, row))
+                else:
+                    buffer.write(json.dumps(row, default=_json_default, ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+        remaining = buffer.getvalue()
+        if remaining:
+            yield remaining.encode("utf-8")
+    finally:
+        cursor.close()
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,67 @@
+"""
+Chiavi di idempotenza (header Idempotency-Key)
+La chiave viene registrata nella stessa transazione delle scritture: se la
+transazione fallisce la chiave sparisce e il client può riprovare; se va a
+buon fine un nuovo invio riceve la risposta salvata. Due invii concorrenti
+con la stessa chiave si serializzano sulla chiave primaria.
+"""
+from typing import Optional
+import hashlib
+import json
+import os
+
+from fastapi import HTTPException
+
+# Dopo questo intervallo la chiave può essere riutilizzata
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+
+
+def request_hash(payload) -> str:
+    """sha256 del payload in JSON canonico (stesso contenuto -> stesso hash)"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def begin(cursor, user_id: int, key: str, endpoint: str, payload_hash: str) -> Optional[dict]:
+    """
+    Registra la chiave nella transazione del chiamante
+
+    Returns:
+        None se la richiesta va eseguita, altrimenti la risposta già salvata
+
+    Raises:
+        HTTPException 422 se la chiave è stata usata per un'altra richiesta
+    """
+    cursor.execute("""
+        DELETE FROM idempotency_keys
+        WHERE user_id = %s AND created_at < NOW() - make_interval(hours => %s)
+    """, (user_id, IDEMPOTENCY_TTL_HOURS))
+
+    # Se un'altra transazione ha appena inserito la stessa chiave, l'INSERT
+    # attende il suo esito: dopo il commit la risposta è già leggibile
+    cursor.execute("""
+        INSERT INTO idempotency_keys (user_id, key, endpoint, request_hash)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id, key) DO NOTHING
+        RETURNING key
+    """, (user_id, key, endpoint, payload_hash))
+    if cursor.fetchone():
+        return None
+
+    cursor.execute("""
+        SELECT endpoint, request_hash, response
+        FROM idempotency_keys
+        WHERE user_id = %s AND key = %s
+    """, (user_id, key))
+    row = cursor.fetchone()
+    if row["endpoint"] != endpoint or row["request_hash"] != payload_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key già utilizzata per una richiesta diversa")
+    return row["response"]
+
+
+def complete(cursor, user_id: int, key: str, response: dict):
+    """Salva la risposta (da chiamare prima del commit delle scritture)"""
+    cursor.execute(
+        "UPDATE idempotency_keys SET response = %s WHERE user_id = %s AND key = %s",
+        (json.dumps(response, default=str), user_id, key)
+    )
@@ -0,0 +1,369 @@
+"""
+Importazioni massive da CSV
+Il file caricato viene validato in un unico passaggio in streaming; le righe
+valide sono caricate con COPY in una tabella di staging temporanea e poi
+unite alla tabella di destinazione (aziende, dpi_catalog) con un solo
+INSERT ... SELECT, nella transazione del chiamante.
+"""
+from tempfile import SpooledTemporaryFile
+import csv
+import io
+import logging
+import os
+import re
+
+from noise_calculations import OTTAVE_HZ
+
+logger = logging.getLogger(__name__)
+
+# Oltre questa dimensione il buffer per COPY passa da memoria a disco
+IMPORT_SPOOL_MAX_BYTES = int(os.getenv("IMPORT_SPOOL_MAX_MB", "16")) * 1024 * 1024
+
+# Errori per riga restituiti al client (il conteggio totale è sempre completo)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Colonna -> (obbligatoria, lunghezza massima) come da schema di aziende
+AZIENDE_COLUMNS = {
+    "ragione_sociale": (True, 255),
+    "partita_iva": (True, 11),
+    "codice_fiscale": (True, 16),
+    "indirizzo": (True, 255),
+    "citta": (True, 100),
+    "cap": (True, 5),
+    "provincia": (True, 2),
+    "telefono": (False, 20),
+    "email": (False, 255),
+    "rappresentante_legale": (False, 255),
+}
+
+_CF_PERSONA = re.compile(r"^[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]$")
+_CF_DISPARI = dict(zip("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ", [
+    1, 0, 5, 7, 9, 13, 15, 17, 19, 21,
+    1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 2, 4, 18, 20, 11, 3, 6, 8, 12, 14, 16, 10, 22, 25, 24, 23,
+]))
+_CF_PARI = dict(zip("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ", list(range(10)) + list(range(26))))
+
+
+def valida_partita_iva(piva: str) -> bool:
+    """Stesso algoritmo di controllo di validaPartitaIVA (AziendaForm.tsx)"""
+    if len(piva) != 11 or not piva.isdigit():
+        return False
+    somma = 0
+    for i, c in enumerate(piva[:10]):
+        cifra = int(c)
+        if i % 2 == 1:
+            cifra *= 2
+            if cifra > 9:
+                cifra -= 9
+        somma += cifra
+    return (10 - somma % 10) % 10 == int(piva[10])
+
+
+def valida_codice_fiscale(cf: str) -> bool:
+    """
+    Codice fiscale di persona fisica (come validaCodiceFiscale in AziendaForm.tsx)
+    oppure numerico a 11 cifre, la forma usata dalle società
+    """
+    if cf.isdigit():
+        return valida_partita_iva(cf)
+    if not _CF_PERSONA.match(cf):
+        return False
+    somma = sum((_CF_DISPARI if i % 2 == 0 else _CF_PARI)[c] for i, c in enumerate(cf[:15]))
+    return cf[15] == chr(ord("A") + somma % 26)
+
+
+def _valida_riga(row: dict) -> tuple:
+    """(valori normalizzati nell'ordine di AZIENDE_COLUMNS, messaggio di errore o None)"""
+    valori = {}
+    for colonna, (obbligatoria, max_len) in AZIENDE_COLUMNS.items():
+        valore = (row.get(colonna) or "").strip()
+        if not valore:
+            if obbligatoria:
+                return None, f"Campo obbligatorio mancante: {colonna}"
+            valore = None
+        elif len(valore) > max_len:
+            return None, f"{colonna}: massimo {max_len} caratteri"
+        valori[colonna] = valore
+
+    valori["codice_fiscale"] = valori["codice_fiscale"].upper()
+    valori["provincia"] = valori["provincia"].upper()
+
+    if not valida_partita_iva(valori["partita_iva"]):
+        return None, "Partita IVA non valida"
+    if not valida_codice_fiscale(valori["codice_fiscale"]):
+        return None, "Codice Fiscale non valido"
+    if len(valori["cap"]) != 5 or not valori["cap"].isdigit():
+        return None, "Il CAP deve essere di 5 cifre"
+    if len(valori["provincia"]) != 2 or not valori["provincia"].isalpha():
+        return None, "La provincia deve essere di 2 lettere"
+    if valori["email"] and "@" not in valori["email"]:
+        return None, "Email non valida"
+
+    return [valori[colonna] for colonna in AZIENDE_COLUMNS], None
+
+
+def _reader(binary_file, columns: dict) -> tuple:
+    """
+    csv.DictReader sul file caricato, decodificato al volo
+    Il separatore (',' o ';', quello di Excel in italiano) è dedotto dall'intestazione
+    """
+    text = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+    header = text.readline()
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    fieldnames = [name.strip().lower() for name in next(csv.reader([header], delimiter=delimiter), [])]
+    mancanti = [c for c, (obbligatoria, _) in columns.items() if obbligatoria and c not in fieldnames]
+    return csv.DictReader(text, fieldnames=fieldnames, delimiter=delimiter), mancanti
+
+
+class ImportResult:
+    """Esito dell'importazione: righe lette, id creati ed errori per riga"""
+
+    def __init__(self):
+        self.righe = 0
+        self.importate = []
+        self.errori = []
+        self.totale_errori = 0
+
+    def errore(self, riga: int, messaggio: str, **chiave):
+        """chiave: campo che identifica la riga (es. partita_iva=...)"""
+        self.totale_errori += 1
+        if len(self.errori) < IMPORT_MAX_ERRORS:
+            self.errori.append({"riga": riga, **{k: v or None for k, v in chiave.items()}, "errore": messaggio})
+
+    def to_dict(self) -> dict:
+        return {
+            "righe": self.righe,
+            "importate": len(self.importate),
+            "scartate": self.totale_errori,
+            "ids": self.importate,
+            "errori": sorted(self.errori, key=lambda e: e["riga"]),
+            "errori_troncati": self.totale_errori > len(self.errori),
+        }
+
+
+def import_aziende(cursor, user_id: int, binary_file) -> ImportResult:
+    """
+    Importa le aziende dal CSV nella transazione del chiamante
+
+    1. Validazione in streaming: le righe valide vanno nel buffer per COPY,
+       le altre (e le partite IVA ripetute nel file) diventano errori di riga
+    2. COPY nella tabella temporanea aziende_import (eliminata al commit)
+    3. INSERT ... SELECT ... ON CONFLICT DO NOTHING: le partite IVA già
+       presenti in aziende restano senza id e sono segnalate come duplicate
+
+    Raises:
+        ValueError se mancano colonne obbligatorie nell'intestazione
+    """
+    result = ImportResult()
+    reader, mancanti = _reader(binary_file, AZIENDE_COLUMNS)
+    if mancanti:
+        raise ValueError(f"Colonne obbligatorie mancanti nell'intestazione: {', '.join(mancanti)}")
+
+    viste = set()
+    with SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_BYTES, mode="w+", newline="", encoding="utf-8") as buffer:
+        writer = csv.writer(buffer)
+        valide = 0
+        for row in reader:
+            # Numero di riga nel file: l'intestazione è la riga 1 (letta a parte)
+            riga = reader.line_num + 1
+            result.righe += 1
+            valori, errore = _valida_riga(row)
+            if errore:
+                result.errore(riga, errore, partita_iva=(row.get("partita_iva") or "").strip())
+                continue
+            if valori[1] in viste:
+                result.errore(riga, "Partita IVA duplicata nel file", partita_iva=valori[1])
+                continue
+            viste.add(valori[1])
+            writer.writerow([riga] + valori)
+            valide += 1
+
+        if not valide:
+            return result
+
+        colonne = ", ".join(AZIENDE_COLUMNS)
+        cursor.execute("""
+            CREATE TEMP TABLE aziende_import (
+                riga INTEGER NOT NULL,
+                ragione_sociale VARCHAR(255),
+                partita_iva VARCHAR(11),
+                codice_fiscale VARCHAR(16),
+                indirizzo VARCHAR(255),
+                citta VARCHAR(100),
+                cap VARCHAR(5),
+                provincia VARCHAR(2),
+                telefono VARCHAR(20),
+                email VARCHAR(255),
+                rappresentante_legale VARCHAR(255)
+            ) ON COMMIT DROP
+        """)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY aziende_import (riga, {colonne}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    cursor.execute(f"""
+        WITH inserite AS (
+            INSERT INTO aziende (user_id, {colonne})
+            SELECT %s, {colonne} FROM aziende_import ORDER BY riga
+            ON CONFLICT (partita_iva) DO NOTHING
+            RETURNING id, partita_iva
+        )
+        SELECT i.riga, i.partita_iva, ins.id
+        FROM aziende_import i
+        LEFT JOIN inserite ins ON ins.partita_iva = i.partita_iva
+        ORDER BY i.riga
+    """, (user_id,))
+    for row in cursor.fetchall():
+        if row["id"] is None:
+            result.errore(row["riga"], "Partita IVA già esistente", partita_iva=row["partita_iva"])
+        else:
+            result.importate.append({"riga": row["riga"], "id": row["id"]})
+
+    logger.info("Importazione aziende", extra={
+        "user_id": user_id, "righe": result.righe,
+        "importate": len(result.importate), "scartate": result.totale_errori,
+    })
+    return result
+
+
+# ==================== CATALOGO DPI ====================
+
+# Colonne mf_<Hz> (attenuazione media) e sf_<Hz> (deviazione standard) per banda d'ottava
+DPI_CATALOG_COLUMNS = {
+    "codice": (True, 100),
+    "nome": (True, 255),
+    "produttore": (False, 100),
+    "tipo": (False, 30),
+    "snr": (True, None),
+    "h": (True, None),
+    "m": (True, None),
+    "l": (True, None),
+    **{f"mf_{hz}": (False, None) for hz in OTTAVE_HZ},
+    **{f"sf_{hz}": (False, None) for hz in OTTAVE_HZ},
+}
+
+# Attenuazioni plausibili in dB (DECIMAL(4,1) in dpi_catalog)
+_DPI_DB_MAX = 60
+
+
+def _db(valore: str, campo: str) -> float:
+    try:
+        numero = float(valore.replace(",", "."))
+    except ValueError:
+        raise ValueError(f"{campo}: valore numerico non valido")
+    if not 0 <= numero <= _DPI_DB_MAX:
+        raise ValueError(f"{campo}: fuori intervallo (0-{_DPI_DB_MAX} dB)")
+    return round(numero, 1)
+
+
+def _valida_dpi(row: dict) -> tuple:
+    """(valori per la tabella di staging, messaggio di errore o None)"""
+    valori = {}
+    for colonna, (obbligatoria, max_len) in DPI_CATALOG_COLUMNS.items():
+        valore = (row.get(colonna) or "").strip()
+        if not valore:
+            if obbligatoria:
+                return None, f"Campo obbligatorio mancante: {colonna}"
+            valore = None
+        elif max_len and len(valore) > max_len:
+            return None, f"{colonna}: massimo {max_len} caratteri"
+        valori[colonna] = valore
+
+    try:
+        hml = [_db(valori[c], c) for c in ("snr", "h", "m", "l")]
+        mf = [valori[f"mf_{hz}"] for hz in OTTAVE_HZ]
+        sf = [valori[f"sf_{hz}"] for hz in OTTAVE_HZ]
+        ottave = [None, None]
+        if any(mf) or any(sf):
+            if not (all(mf) and all(sf)):
+                return None, "Dati per banda d'ottava incompleti (servono mf_ e sf_ per 63-8000 Hz)"
+            ottave = [
+                "{" + ",".join(str(_db(v, f"mf_{hz}")) for v, hz in zip(mf, OTTAVE_HZ)) + "}",
+                "{" + ",".join(str(_db(v, f"sf_{hz}")) for v, hz in zip(sf, OTTAVE_HZ)) + "}",
+            ]
+    except ValueError as e:
+        return None, str(e)
+
+    tipo = valori["tipo"].lower() if valori["tipo"] else None
+    return [valori["codice"], valori["nome"], valori["produttore"], tipo, *hml, *ottave], None
+
+
+def import_dpi_catalog(cursor, binary_file) -> ImportResult:
+    """
+    Importa o aggiorna (per codice) i prodotti del catalogo DPI nella
+    transazione del chiamante, con lo stesso schema di import_aziende:
+    validazione in streaming, COPY in staging, un solo INSERT ... ON CONFLICT
+
+    Raises:
+        ValueError se mancano colonne obbligatorie nell'intestazione
+    """
+    result = ImportResult()
+    reader, mancanti = _reader(binary_file, DPI_CATALOG_COLUMNS)
+    if mancanti:
+        raise ValueError(f"Colonne obbligatorie mancanti nell'intestazione: {', '.join(mancanti)}")
+
+    visti = set()
+    with SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_BYTES, mode="w+", newline="", encoding="utf-8") as buffer:
+        writer = csv.writer(buffer)
+        valide = 0
+        for row in reader:
+            riga = reader.line_num + 1
+            result.righe += 1
+            valori, errore = _valida_dpi(row)
+            if errore:
+                result.errore(riga, errore, codice=(row.get("codice") or "").strip())
+                continue
+            if valori[0] in visti:
+                result.errore(riga, "Codice duplicato nel file", codice=valori[0])
+                continue
+            visti.add(valori[0])
+            writer.writerow([riga] + valori)
+            valide += 1
+
+        if not valide:
+            return result
+
+        cursor.execute("""
+            CREATE TEMP TABLE dpi_catalog_import (
+                riga INTEGER NOT NULL,
+                codice VARCHAR(100),
+                nome VARCHAR(255),
+                produttore VARCHAR(100),
+                tipo VARCHAR(30),
+                snr DECIMAL(4,1),
+                h DECIMAL(4,1),
+                m DECIMAL(4,1),
+                l DECIMAL(4,1),
+                ottave_mf REAL[],
+                ottave_sf REAL[]
+            ) ON COMMIT DROP
+        """)
+        buffer.seek(0)
+        cursor.copy_expert("""
+            COPY dpi_catalog_import (riga, codice, nome, produttore, tipo, snr, h, m, l, ottave_mf, ottave_sf)
+            FROM STDIN WITH (FORMAT csv)
+        """, buffer)
+
+    # Un prodotto reimportato viene aggiornato e riattivato
+    cursor.execute("""
+        WITH salvati AS (
+            INSERT INTO dpi_catalog (codice, nome, produttore, tipo, snr, h, m, l, ottave_mf, ottave_sf)
+            SELECT codice, nome, produttore, tipo, snr, h, m, l, ottave_mf, ottave_sf
+            FROM dpi_catalog_import
+            ORDER BY riga
+            ON CONFLICT (codice) DO UPDATE SET
+                nome = EXCLUDED.nome, produttore = EXCLUDED.produttore, tipo = EXCLUDED.tipo,
+                snr = EXCLUDED.snr, h = EXCLUDED.h, m = EXCLUDED.m, l = EXCLUDED.l,
+                ottave_mf = EXCLUDED.ottave_mf, ottave_sf = EXCLUDED.ottave_sf, attivo = TRUE
+            RETURNING id, codice
+        )
+        SELECT i.riga, s.id
+        FROM dpi_catalog_import i
+        JOIN salvati s ON s.codice = i.codice
+        ORDER BY i.riga
+    """)
+    result.importate = [{"riga": row["riga"], "id": row["id"]} for row in cursor.fetchall()]
+
+    logger.info("Importazione catalogo DPI", extra={
+        "righe": result.righe, "importate": len(result.importate), "scartate": result.totale_errori,
+    })
+    return result
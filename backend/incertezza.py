@@ -0,0 +1,109 @@
+"""
+Incertezza di misura del LEX,8h (UNI EN ISO 9612:2011, strategia per compiti)
+Due motori equivalenti: le formule analitiche dell'appendice C e un Monte
+Carlo vettoriale che propaga le stesse incertezze nella formula del LEX
+(estrazioni a blocchi di dimensione fissa, senza cicli Python per estrazione).
+"""
+from math import erf, sqrt
+
+import numpy as np
+
+from noise_calculations import lex_8h
+
+# Valori d'azione e limite (D.Lgs. 81/2008) per le probabilità di superamento
+SOGLIE_LEX = (80, 85, 87)
+
+# Incertezza standard della strumentazione (ISO 9612, tabella C.5)
+U2_FONOMETRO = {1: 0.7, 2: 1.5}
+
+# Incertezza per la posizione del microfono (ISO 9612, C.6)
+U3_POSIZIONE = 1.0
+
+# Fattore di copertura per l'intervallo unilaterale al 95%
+K_COPERTURA = 1.65
+
+# Elementi per matrice di estrazioni del Monte Carlo (8 MB in float64)
+BLOCCO_MONTECARLO = 1 << 20
+
+
+def u1a_campioni(campioni) -> float:
+    """Incertezza di campionamento di un compito da misure ripetute (ISO 9612, C.4)"""
+    campioni = np.asarray(campioni, dtype=np.float64)
+    n = len(campioni)
+    if n < 2:
+        raise ValueError("Servono almeno 2 misure ripetute per stimare u1a")
+    return float(np.sqrt(np.sum((campioni - campioni.mean()) ** 2) / (n * (n - 1))))
+
+
+def _probabilita_normale(lex: float, u: float) -> dict:
+    if u <= 0:
+        return {soglia: float(lex > soglia) for soglia in SOGLIE_LEX}
+    return {soglia: 0.5 * (1 - erf((soglia - lex) / (u * sqrt(2)))) for soglia in SOGLIE_LEX}
+
+
+def incertezza_analitica(leq, durata, u1a, u2: float, u3: float, u1b) -> dict:
+    """
+    u²(LEX) = Σm c1a,m² (u1a,m² + u2² + u3²) + (c1b,m u1b,m)²   (ISO 9612, C.6)
+
+    Args:
+        leq: Leq dei compiti dB(A), forma (M,)
+        durata: Durate dei compiti in minuti, forma (M,)
+        u1a: Incertezza di campionamento per compito (dB)
+        u2: Incertezza della strumentazione (dB)
+        u3: Incertezza della posizione del microfono (dB)
+        u1b: Incertezza standard delle durate (minuti)
+    """
+    leq = np.asarray(leq, dtype=np.float64)
+    durata = np.asarray(durata, dtype=np.float64)
+    lex = float(lex_8h(leq, durata))
+
+    c1a = durata / 480 * 10 ** (0.1 * (leq - lex))
+    c1b = 4.34 * c1a / durata
+    u = float(np.sqrt(np.sum(
+        c1a ** 2 * (np.asarray(u1a) ** 2 + u2 ** 2 + u3 ** 2) + (c1b * np.asarray(u1b)) ** 2
+    )))
+    return {
+        "lex": lex,
+        "u": u,
+        "U": K_COPERTURA * u,
+        "probabilita_superamento": _probabilita_normale(lex, u),
+    }
+
+
+def incertezza_montecarlo(leq, durata, u1a, u2: float, u3: float, u1b,
+                          campioni: int = 100_000, seed=None) -> dict:
+    """
+    Stesse ipotesi di incertezza_analitica, propagate per simulazione
+
+    Ogni estrazione perturba i Leq (normale, σ² = u1a² + u2² + u3²) e le
+    durate (normale troncata a 0, σ = u1b); il LEX delle estrazioni è
+    calcolato su matrici (righe, M) di al più BLOCCO_MONTECARLO elementi,
+    così la memoria non cresce con campioni x compiti. Il LEX non è lineare
+    nei Leq, quindi le probabilità di superamento tengono conto
+    dell'asimmetria della distribuzione.
+    """
+    leq = np.asarray(leq, dtype=np.float64)
+    durata = np.asarray(durata, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+
+    sigma_leq = np.sqrt(np.asarray(u1a, dtype=np.float64) ** 2 + u2 ** 2 + u3 ** 2)
+    # Solo i LEX estratti (campioni,) restano in memoria, i blocchi sono riusati
+    lex_estratti = np.empty(campioni)
+    righe = max(1, BLOCCO_MONTECARLO // len(leq))
+    for inizio in range(0, campioni, righe):
+        n = min(righe, campioni - inizio)
+        leq_estratti = leq + rng.standard_normal((n, len(leq))) * sigma_leq
+        durate_estratte = np.maximum(durata + rng.standard_normal((n, len(leq))) * u1b, 0)
+        energia = np.einsum("km,km->k", durate_estratte / 480, 10 ** (0.1 * leq_estratti))
+        lex_estratti[inizio:inizio + n] = 10 * np.log10(np.maximum(energia, np.finfo(np.float64).tiny))
+
+    lex = float(lex_8h(leq, durata))
+    u = float(lex_estratti.std(ddof=1))
+    return {
+        "lex": lex,
+        "u": u,
+        # Semiampiezza unilaterale al 95% della distribuzione simulata
+        "U": float(np.percentile(lex_estratti, 95) - lex),
+        "probabilita_superamento": {soglia: float(np.mean(lex_estratti > soglia)) for soglia in SOGLIE_LEX},
+        "campioni": campioni,
+    }
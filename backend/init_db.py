@@ -206,6 +206,50 @@ BEGIN
 END $$;
 """
 
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Migrazioni applicate automaticamente all'avvio (le 003-005 restano manuali)
+MIGRATIONS = [
+    "006_user_quotas.sql",
+    "007_user_stats.sql",
+    "008_storage_gc.sql",
+    "009_documenti_content_hash.sql",
+    "010_idempotency_keys.sql",
+    "011_sync.sql",
+    "012_dpi_catalog.sql",
+    "013_spettri_ottave.sql",
+    "014_incertezza.sql",
+    "015_data_misura.sql",
+    "016_serie_temporali.sql",
+    "017_analisi_rischio.sql",
+    "018_user_stats_totali.sql",
+]
+
+def apply_migrations(conn):
+    """Applica le migrazioni non ancora registrate in schema_migrations"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    cursor.execute("SELECT name FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+
+    for name in MIGRATIONS:
+        if name in applied:
+            continue
+        print(f"Applicazione migrazione {name}...")
+        with open(os.path.join(MIGRATIONS_DIR, name), "r", encoding="utf-8") as f:
+            cursor.execute(f.read())
+        cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+        conn.commit()
+
+    cursor.close()
+
 def init_database():
     """Inizializza il database con lo schema"""
     print("Connessione al database...")
@@ -222,6 +266,7 @@ def init_database():
         print("Esecuzione migrazioni...")
         cursor.execute(SQL_MIGRATION)
         conn.commit()
+        apply_migrations(conn)
         print("Migrazioni completate")
 
         print("\nDatabase inizializzato con successo!")
@@ -0,0 +1,124 @@
+"""
+Job di background in memoria
+Operazioni lunghe (report in blocco, ottimizzazioni) eseguite in un pool di
+thread con avanzamento interrogabile via API. I job vivono nel processo che li
+ha creati e vengono rimossi JOB_RETENTION_SECONDS dopo la fine.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Optional
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+
+class Job:
+    """Stato di un job: avanzamento, errori per elemento e risultato finale"""
+
+    def __init__(self, user_id: int, kind: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.kind = kind
+        self.status = "pending"  # pending / running / completed / failed
+        self.total = 0
+        self.done = 0
+        self.items = []
+        self.errors = []
+        self.result = None
+        self.error = None
+        self.artifact_path = None  # file scaricabile prodotto dal job
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        self._finished_monotonic = None
+        self._lock = threading.Lock()
+
+    def advance(self, item: Optional[dict] = None, error: Optional[dict] = None):
+        """Segna un elemento come elaborato (con esito o errore)"""
+        with self._lock:
+            self.done += 1
+            if item is not None:
+                self.items.append(item)
+            if error is not None:
+                self.errors.append(error)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "total": self.total,
+                "done": self.done,
+                "progress": round(self.done / self.total, 3) if self.total else (1.0 if self.status == "completed" else 0.0),
+                "items": list(self.items),
+                "errors": list(self.errors),
+                "result": self.result,
+                "error": self.error,
+                "download": self.artifact_path is not None,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+
+def _purge_expired():
+    now = time.monotonic()
+    with _jobs_lock:
+        expired = [
+            job_id for job_id, job in _jobs.items()
+            if job._finished_monotonic is not None and now - job._finished_monotonic > JOB_RETENTION_SECONDS
+        ]
+        for job_id in expired:
+            job = _jobs.pop(job_id)
+            if job.artifact_path:
+                try:
+                    os.remove(job.artifact_path)
+                except FileNotFoundError:
+                    pass
+
+
+def _run(job: Job, func: Callable, args: tuple):
+    job.status = "running"
+    try:
+        job.result = func(job, *args)
+        job.status = "completed"
+    except Exception as e:
+        logger.exception("Job fallito", extra={"job_id": job.id, "kind": job.kind})
+        job.error = str(e)
+        job.status = "failed"
+    finally:
+        job.finished_at = datetime.utcnow()
+        job._finished_monotonic = time.monotonic()
+
+
+def submit_job(user_id: int, kind: str, func: Callable, *args) -> Job:
+    """
+    Crea un job ed esegue func(job, *args) in background
+    func aggiorna job.total / job.advance() e restituisce il risultato finale
+    """
+    _purge_expired()
+    job = Job(user_id, kind)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    _executor.submit(_run, job, func, args)
+    return job
+
+
+def get_job(job_id: str, user_id: int) -> Optional[Job]:
+    """Job dell'utente (None se inesistente, scaduto o di un altro utente)"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    return job
@@ -1,26 +1,60 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, Request, UploadFile, Response
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, UploadFile, Response, BackgroundTasks, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse
 from contextlib import asynccontextmanager
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
+import asyncio
+import base64
+import csv
+import json
+import math
 import os
 import secrets
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from pydantic import BaseModel, EmailStr
-from datetime import datetime, timedelta
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from datetime import date, datetime, timedelta
 from auth import hash_password, verify_password, create_access_token, decode_access_token
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+import logging
+from logging_config import setup_logging, shutdown_logging, RequestIdMiddleware
+
+# Logging configurato prima degli altri moduli, che loggano già all'import
+load_dotenv()
+setup_logging()
+
 from storage import storage
+import database
+import metrics
+from quotas import consume_quota, check_quota, has_feature
+import storage_gc
+import reports
+import jobs
+import exports
+import imports
+import idempotency
+import sync
+import dpi_catalog
+import noise_calculations
+import incertezza
+import esposizione_settimanale
+import analisi_rischio
+import time_history
+import serie_temporali
+import riduzione
+import rotazioni
+import verifica
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from subscriptions import router as subscriptions_router
 from stripe_webhooks import router as webhooks_router
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # ==================== SMTP EMAIL HELPER ====================
 
@@ -55,15 +89,20 @@ def send_email(to_email: str, subject: str, html_content: str) -> bool:
         msg.attach(html_part)
 
         # Connetti e invia
-        with smtplib.SMTP_SSL(smtp_host, smtp_port) as server:
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-
-        print(f"✅ Email inviata con successo a {to_email}")
+        metrics.EMAIL_QUEUE_DEPTH.inc()
+        try:
+            with metrics.track_external("smtp", "send_message"):
+                with smtplib.SMTP_SSL(smtp_host, smtp_port) as server:
+                    server.login(smtp_user, smtp_password)
+                    server.send_message(msg)
+        finally:
+            metrics.EMAIL_QUEUE_DEPTH.dec()
+
+        logger.info("Email inviata", extra={"to_email": to_email})
         return True
 
     except Exception as e:
-        print(f"❌ Errore invio email a {to_email}: {e}")
+        logger.error("Errore invio email", extra={"to_email": to_email, "error": str(e)})
         return False
 
 # ==================== MODELLI PYDANTIC ====================
@@ -138,6 +177,8 @@ class MisurazioneAPI(BaseModel):
     leq: str
     durata: str
     lpicco: str
+    # Livelli non ponderati per banda d'ottava 63-8000 Hz (metodo per ottave)
+    spettro_ottave: Optional[List[float]] = Field(None, min_length=8, max_length=8)
 
 class ValutazioneEsposizioneCreate(BaseModel):
     azienda_id: Optional[int] = None
@@ -147,6 +188,13 @@ class ValutazioneEsposizioneCreate(BaseModel):
     lex: str
     lpicco: str
     classe_rischio: str
+    data_misura: Optional[date] = None  # giorno della misura (default: oggi)
+
+class ValutazioneEsposizioneBatchItem(ValutazioneEsposizioneCreate):
+    id: Optional[int] = None  # presente: aggiorna la valutazione esistente
+
+class ValutazioneEsposizioneBatch(BaseModel):
+    valutazioni: List[ValutazioneEsposizioneBatchItem]
 
 class ValutazioneEsposizione(BaseModel):
     id: int
@@ -158,6 +206,53 @@ class ValutazioneEsposizione(BaseModel):
     lpicco: str
     classe_rischio: str
     created_at: datetime
+    data_misura: Optional[date] = None
+    incertezza_estesa: Optional[float] = None
+    prob_superamento_80: Optional[float] = None
+    prob_superamento_85: Optional[float] = None
+    prob_superamento_87: Optional[float] = None
+
+class IncertezzaRequest(BaseModel):
+    metodo: Literal["montecarlo", "analitico"] = "montecarlo"
+    classe_fonometro: Literal[1, 2] = 1
+    u1a: float = Field(1.0, ge=0, le=10)         # dB, per i compiti senza misure ripetute
+    u3: float = Field(incertezza.U3_POSIZIONE, ge=0, le=10)
+    u1b_percentuale: float = Field(10.0, ge=0, le=100)  # incertezza delle durate, % della durata
+    misure_ripetute: List[List[float]] = []      # Leq ripetuti per compito, nell'ordine delle misurazioni
+    campioni: int = Field(100_000, ge=1_000, le=1_000_000)
+
+class SegmentoTimeHistory(BaseModel):
+    attivita: str = Field(..., min_length=1, max_length=255)
+    inizio: float = Field(..., ge=0)   # secondi dall'inizio del log
+    fine: float
+
+class VincoloAttivita(BaseModel):
+    riduzione_max: Optional[float] = Field(None, ge=0)  # dB ottenibili sull'attività
+    durata_min: Optional[float] = Field(None, ge=0)     # minuti non comprimibili
+    peso: float = Field(1.0, gt=0)                      # costo relativo dell'intervento
+
+class RiduzioneRequest(BaseModel):
+    obiettivi: List[float] = Field([80, 85], min_length=1, max_length=5)
+    modalita: Optional[Literal["livelli", "durate"]] = None  # piano ottimo su più attività
+    vincoli: List[VincoloAttivita] = []        # per attività, nell'ordine delle misurazioni
+    riduzione_max: Optional[float] = Field(None, ge=0)       # default per tutte le attività
+    durata_min_percentuale: float = Field(0, ge=0, le=100)   # default per tutte le attività
+    leq_sostituzione: Optional[float] = None   # livello dove vanno i minuti tolti (es. pausa)
+
+class LavoratoreRotazione(BaseModel):
+    nome: str = Field(..., min_length=1, max_length=255)
+    attivita: Optional[List[str]] = None                 # attività abilitate (None = tutte)
+    minuti_turno: Optional[float] = Field(None, gt=0, le=1440)
+
+class RotazioneRequest(BaseModel):
+    reparto: str = Field(..., min_length=1)
+    lavoratori: List[LavoratoreRotazione] = Field([], max_length=2000)  # vuoto: uno per valutazione
+    fabbisogno: Dict[str, float] = {}          # minuti per turno per attività (assenti: somma delle valutazioni)
+    minuti_turno: float = Field(480, gt=0, le=1440)
+    slot: float = Field(15, ge=1, le=240)      # minuti, granularità della rotazione
+    obiettivo: float = 80
+    leq_riposo: Optional[float] = None         # livello dei minuti senza attività assegnata
+    tempo_max: float = Field(5, gt=0, le=60)   # secondi di ricerca locale
 
 class ValoriHMLAPI(BaseModel):
     h: str
@@ -175,6 +270,28 @@ class ValutazioneDPICreate(BaseModel):
     leff: Optional[str] = None
     protezione_adeguata: Optional[str] = None
 
+class RaccomandazioneDPIRequest(BaseModel):
+    lex_per_dpi: Optional[float] = None
+    esposizioni: List[float] = []           # LEX di più lavoratori
+    azienda_id: Optional[int] = None        # usa i LEX delle valutazioni dell'azienda
+    top: int = 10
+    tipo: Optional[str] = None
+    produttore: Optional[str] = None
+    snr_min: Optional[float] = None
+    snr_max: Optional[float] = None
+
+class DPIOttave(BaseModel):
+    nome: str = "DPI Personalizzato"
+    mf: List[float] = Field(..., min_length=8, max_length=8)  # attenuazione media per banda
+    sf: List[float] = Field(..., min_length=8, max_length=8)  # deviazione standard per banda
+
+class AttenuazioneOttaveRequest(BaseModel):
+    spettri: List[List[float]] = []          # livelli non ponderati, 8 bande per spettro
+    valutazione_id: Optional[int] = None     # usa gli spettri delle misurazioni salvate
+    dpi: List[str] = []                      # codici del catalogo (vuoto = tutti con dati per ottava)
+    dpi_personalizzati: List[DPIOttave] = []
+    alfa: float = 1.0                        # APV = mf - alfa * sf (1 = protezione all'84%)
+
 class ValutazioneDPI(BaseModel):
     id: int
     azienda_id: Optional[int]
@@ -197,20 +314,19 @@ class Documento(BaseModel):
     tipo_file: str
     created_at: datetime
 
+class ReportJobCreate(BaseModel):
+    formato: Literal["docx", "pdf"] = "docx"
+    tipo: Literal["esposizione", "dpi", "tutte"] = "tutte"
+    allega: bool = False
+
 # ==================== DATABASE ====================
 
 def get_db_connection():
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise ValueError("DATABASE_URL environment variable is not set")
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    return database.connect(cursor_factory=RealDictCursor)
 
 def get_db():
     database_url = os.getenv("DATABASE_URL")
 
-    # Debug: stampa lo stato della variabile d'ambiente
-    print(f"DATABASE_URL: {database_url}")
-
     if not database_url:
         raise ValueError(
             "DATABASE_URL environment variable is not set. "
@@ -218,13 +334,9 @@ def get_db():
         )
 
     try:
-        conn = psycopg2.connect(
-            database_url,
-            cursor_factory=RealDictCursor
-        )
+        conn = database.connect(cursor_factory=RealDictCursor)
     except Exception as e:
-        print(f"Database connection error: {e}")
-        print(f"Attempted to connect with URL: {database_url}")
+        logger.error("Errore connessione database", extra={"error": str(e)})
         raise
 
     try:
@@ -236,9 +348,31 @@ def get_db():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("🚀 Server avviato")
+    logger.info("Server avviato")
+
+    # Garbage collection periodica degli oggetti B2 orfani (0 = disattivata)
+    gc_interval = float(os.getenv("STORAGE_GC_INTERVAL_HOURS", "0"))
+    gc_task = asyncio.create_task(storage_gc.periodic_storage_gc(gc_interval)) if gc_interval > 0 else None
+
+    # Monitor del ritardo dell'event loop (handler async che bloccano)
+    loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+
+    # Pulizia giornaliera delle lapidi di /api/sync (0 = conservate per sempre)
+    tombstone_task = (
+        asyncio.create_task(sync.periodic_tombstone_purge())
+        if sync.SYNC_TOMBSTONE_RETENTION_DAYS > 0 else None
+    )
+
     yield
-    print("👋 Server arrestato")
+
+    loop_monitor.cancel()
+    if tombstone_task:
+        tombstone_task.cancel()
+    if gc_task:
+        gc_task.cancel()
+    reports.shutdown_pool()
+    logger.info("Server arrestato")
+    shutdown_logging()
 
 app = FastAPI(
     title="API Calcolo Esposizione Rumore",
@@ -250,7 +384,7 @@ app = FastAPI(
 # CORS
 cors_origins = os.getenv("CORS_ORIGINS")
 if not cors_origins:
-    print("⚠️  WARNING: CORS_ORIGINS not set. Using wildcard '*' (unsafe for production!)")
+    logger.warning("CORS_ORIGINS non impostato: uso wildcard '*' (non sicuro in produzione)")
     cors_origins = "*"
 
 origins = cors_origins.split(",") if cors_origins != "*" else ["*"]
@@ -260,8 +394,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paginazione della lista utenti admin (GET /api/admin/users)
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],
 )
 
+# Metriche Prometheus (latenza per route, richieste in corso, query per richiesta)
+app.add_middleware(metrics.PrometheusMiddleware)
+
+# Request id per correlare i log (aggiunto per ultimo: è il middleware più esterno)
+app.add_middleware(RequestIdMiddleware)
+
 # ==================== ROUTERS ====================
 
 # Include subscription and webhook routers
@@ -409,9 +551,9 @@ def register(user_data: UserRegister, conn=Depends(get_db)):
                 (user_id, plan_id, status, is_trial, trial_ends_at, created_at)
                 VALUES (%s, %s, 'trial', true, %s, NOW())
             """, (user_id, trial_plan['id'], trial_ends_at))
-            print(f"✅ Piano Free Trial assegnato a utente {user_id} (scadenza: {trial_ends_at})")
+            logger.info("Piano Free Trial assegnato", extra={"user_id": user_id, "trial_ends_at": trial_ends_at})
         else:
-            print(f"⚠️  Piano free_trial non trovato nel database")
+            logger.warning("Piano free_trial non trovato nel database")
         
         conn.commit()
 
@@ -426,9 +568,9 @@ def register(user_data: UserRegister, conn=Depends(get_db)):
 
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        print(f"Errore durante registrazione: {e}")
+        logger.exception("Errore durante registrazione")
         raise HTTPException(status_code=500, detail="Errore durante la registrazione")
     finally:
         cursor.close()
@@ -476,8 +618,8 @@ def login(credentials: UserLogin, conn=Depends(get_db)):
 
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Errore durante login: {e}")
+    except Exception:
+        logger.exception("Errore durante login")
         raise HTTPException(status_code=500, detail="Errore durante il login")
     finally:
         cursor.close()
@@ -656,17 +798,18 @@ def forgot_password(request: ForgotPasswordRequest, conn=Depends(get_db)):
             html_content=html_content
         )
 
-        # Se l'email non viene inviata, stampa il link nel log (utile in sviluppo)
+        # Se l'email non viene inviata, il link va nel log DEBUG (utile in sviluppo)
         if not email_sent:
-            print(f"🔗 Link reset password: {reset_url}")
+            logger.warning("Email di reset password non inviata", extra={"user_id": user["id"]})
+            logger.debug("Link reset password: %s", reset_url)
 
         return {"message": "Se l'email esiste, riceverai un link per reimpostare la password"}
 
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        print(f"Errore durante richiesta reset password: {e}")
+        logger.exception("Errore durante richiesta reset password")
         raise HTTPException(status_code=500, detail="Errore durante la richiesta di reset password")
     finally:
         cursor.close()
@@ -720,31 +863,54 @@ def reset_password(request: ResetPasswordRequest, conn=Depends(get_db)):
 
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        print(f"Errore durante reset password: {e}")
+        logger.exception("Errore durante reset password")
         raise HTTPException(status_code=500, detail="Errore durante il reset della password")
     finally:
         cursor.close()
 
 # ==================== ENDPOINTS UPLOAD ====================
 
+def get_upload_size(file: UploadFile) -> int:
+    """
+    Dimensione in bytes del file caricato (usata per la quota storage)
+    """
+    if file.size is not None:
+        return file.size
+    posizione = file.file.tell()
+    file.file.seek(0, os.SEEK_END)
+    dimensione = file.file.tell()
+    file.file.seek(posizione)
+    return dimensione
+
 @app.post("/api/upload")
-async def upload_file(
+def upload_file(
     file: UploadFile, 
     valutazione_id: Optional[str] = Header(None),
     tipo_valutazione: Optional[str] = Header(None),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
 ):
+    dimensione = get_upload_size(file)
+    archivia = bool(valutazione_id and tipo_valutazione)
+
+    cursor = conn.cursor()
     try:
+        if archivia:
+            # La quota storage è consumata nella stessa transazione del documento:
+            # se il salvataggio fallisce viene restituita con il rollback
+            consume_quota(cursor, current_user['id'], "storage", dimensione)
+        else:
+            quota = check_quota(cursor, current_user['id'], "storage", dimensione)
+            if not quota['allowed']:
+                raise HTTPException(status_code=403, detail=quota['message'])
+
         # Upload su B2
         file_url = storage.upload_file(file)
         
         # Se ci sono metadati di valutazione, salva nel DB
-        if valutazione_id and tipo_valutazione:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
+        if archivia:
             try:
                 # Determina colonne in base al tipo
                 col_valutazione = "valutazione_esposizione_id" if tipo_valutazione == "esposizione" else "valutazione_dpi_id"
@@ -756,30 +922,33 @@ async def upload_file(
                 cursor.execute(
                     f"""
                     INSERT INTO documenti 
-                    ({col_valutazione}, nome_file, url, tipo_file, user_id)
-                    VALUES (%s, %s, %s, %s, %s)
+                    ({col_valutazione}, nome_file, url, tipo_file, user_id, dimensione_bytes)
+                    VALUES (%s, %s, %s, %s, %s, %s)
                     RETURNING id
                     """,
-                    (valutazione_id, file.filename, file_url, tipo_file, current_user['id'])
+                    (valutazione_id, file.filename, file_url, tipo_file, current_user['id'], dimensione)
                 )
-                conn.commit()
                 doc_id = cursor.fetchone()['id']
-                print(f"Documento salvato nel DB con ID: {doc_id}")
+                conn.commit()
+                logger.info("Documento salvato nel DB", extra={"documento_id": doc_id})
                 
-            except Exception as e:
-                print(f"Errore salvataggio DB: {e}")
+            except Exception:
+                conn.rollback()
+                logger.exception("Errore salvataggio documento nel DB")
                 # Non blocchiamo l'upload se fallisce il salvataggio DB, ma lo logghiamo
-            finally:
-                cursor.close()
-                conn.close()
             
         return {"url": file_url}
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
+        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cursor.close()
 
 @app.get("/api/valutazioni/{tipo}/{id}/documenti", response_model=List[Documento])
-async def get_documenti_valutazione(tipo: str, id: int, current_user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
+def get_documenti_valutazione(tipo: str, id: int, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
     cursor = conn.cursor()
     try:
         col_valutazione = "valutazione_esposizione_id" if tipo == "esposizione" else "valutazione_dpi_id"
@@ -796,11 +965,9 @@ async def get_documenti_valutazione(tipo: str, id: int, current_user: dict = Dep
         return documenti
     finally:
         cursor.close()
-        conn.close()
 
 @app.delete("/api/documenti/{id}")
-async def delete_documento(id: int, current_user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
+def delete_documento(id: int, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
     cursor = conn.cursor()
     try:
         # Verifica proprietà
@@ -818,15 +985,13 @@ async def delete_documento(id: int, current_user: dict = Depends(get_current_use
         return {"message": "Documento eliminato"}
     finally:
         cursor.close()
-        conn.close()
 
 @app.get("/api/documenti/{id}/download")
-async def download_documento(id: int, current_user: dict = Depends(get_current_user)):
+def download_documento(id: int, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
     """
     Proxy download: scarica il file da B2 e lo serve al client
     Mantiene il bucket privato e sicuro
     """
-    conn = get_db_connection()
     cursor = conn.cursor()
     try:
         # Get document info
@@ -848,7 +1013,7 @@ async def download_documento(id: int, current_user: dict = Depends(get_current_u
         try:
             import io
             file_obj = io.BytesIO()
-            storage.s3_client.download_fileobj(storage.bucket_name, file_key, file_obj)
+            storage.download_fileobj(file_key, file_obj)
             file_obj.seek(0)
 
             # Determina content type dal nome file
@@ -866,12 +1031,11 @@ async def download_documento(id: int, current_user: dict = Depends(get_current_u
                     "Content-Disposition": f'attachment; filename="{doc["nome_file"]}"'
                 }
             )
-        except Exception as e:
-            print(f"Error downloading from B2: {e}")
+        except Exception:
+            logger.exception("Errore download da B2", extra={"documento_id": id})
             raise HTTPException(status_code=500, detail="Errore durante il download del file")
     finally:
         cursor.close()
-        conn.close()
 
 # ==================== ADMIN MIDDLEWARE ====================
 
@@ -885,17 +1049,71 @@ def get_admin_user(current_user: dict = Depends(get_current_user)):
 
 # ==================== ENDPOINTS ADMIN ====================
 
+# Chiavi di ordinamento della lista utenti admin (whitelist per ORDER BY), con
+# gli indici (chiave, id) della migrazione 018; le date mancanti valgono
+# -infinity, quindi in ordine decrescente finiscono in fondo
+ADMIN_USERS_SORT = {
+    "created_at": "COALESCE(u.created_at, '-infinity'::timestamp)",
+    "last_login": "COALESCE(u.last_login, '-infinity'::timestamp)",
+    "email": "u.email",
+    "nome": "u.nome",
+    "num_aziende": "s.num_aziende",
+    "num_valutazioni_esposizione": "s.num_valutazioni_esposizione",
+    "num_valutazioni_dpi": "s.num_valutazioni_dpi",
+}
+
+
+def _admin_users_cursore(sort: str, direction: str, chiave: str, user_id: int) -> str:
+    """Token opaco della pagina successiva: ordinamento e ultima riga restituita"""
+    dati = json.dumps([sort, direction, chiave, user_id]).encode()
+    return base64.urlsafe_b64encode(dati).decode().rstrip("=")
+
+
+def _admin_users_posizione(after: str, sort: str, direction: str) -> tuple:
+    """(chiave, id) dell'ultima riga della pagina precedente"""
+    try:
+        dati = json.loads(base64.urlsafe_b64decode(after + "=" * (-len(after) % 4)))
+        sort_token, direction_token, chiave, user_id = dati
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursore di paginazione non valido")
+    if (sort_token, direction_token) != (sort, direction):
+        raise HTTPException(status_code=400, detail="Il cursore appartiene a un altro ordinamento")
+    return chiave, int(user_id)
+
+
 @app.get("/api/admin/users")
-def get_all_users(current_user: dict = Depends(get_admin_user), conn=Depends(get_db)):
+def get_all_users(
+    response: Response,
+    after: Optional[str] = None,
+    page_size: int = 100,
+    sort: str = "created_at",
+    order: str = "desc",
+    current_user: dict = Depends(get_admin_user),
+    conn=Depends(get_db)
+):
     """
-    Ottieni tutti gli utenti con i conteggi dei loro dati
+    Ottieni gli utenti con i conteggi dei loro dati, ordinabili e paginati
+    con keyset: X-Next-Cursor è il valore di `after` per la pagina successiva
+    (assente all'ultima), X-Total-Count il numero di utenti. I conteggi sono
+    letti da user_stats e il totale da user_stats_totali (mantenute dai trigger)
     Solo per amministratori
     """
+    if sort not in ADMIN_USERS_SORT:
+        raise HTTPException(status_code=400, detail=f"Ordinamento non valido: {sort}")
+    direction = "ASC" if order.lower() == "asc" else "DESC"
+    page_size = min(max(page_size, 1), 500)
+    chiave = ADMIN_USERS_SORT[sort]
+
+    filtro, params = "", []
+    if after:
+        filtro = f"WHERE ({chiave}, u.id) {'>' if direction == 'ASC' else '<'} (%s, %s)"
+        params.extend(_admin_users_posizione(after, sort, direction))
+
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
     try:
-        # Ottieni tutti gli utenti
-        cursor.execute("""
+        # Una riga in più per sapere se esiste la pagina successiva
+        cursor.execute(f"""
             SELECT
                 u.id,
                 u.email,
@@ -903,26 +1121,65 @@ def get_all_users(current_user: dict = Depends(get_admin_user), conn=Depends(get
                 u.is_admin,
                 u.created_at,
                 u.last_login,
-                COUNT(DISTINCT a.id) as num_aziende,
-                COUNT(DISTINCT ve.id) as num_valutazioni_esposizione,
-                COUNT(DISTINCT vd.id) as num_valutazioni_dpi
+                s.num_aziende,
+                s.num_valutazioni_esposizione,
+                s.num_valutazioni_dpi,
+                ({chiave})::text AS chiave_ordinamento
             FROM users u
-            LEFT JOIN aziende a ON a.user_id = u.id
-            LEFT JOIN valutazioni_esposizione ve ON ve.user_id = u.id
-            LEFT JOIN valutazioni_dpi vd ON vd.user_id = u.id
-            GROUP BY u.id, u.email, u.nome, u.is_admin, u.created_at, u.last_login
-            ORDER BY u.created_at DESC
-        """)
+            JOIN user_stats s ON s.user_id = u.id
+            {filtro}
+            ORDER BY {chiave} {direction}, u.id {direction}
+            LIMIT %s
+        """, (*params, page_size + 1))
+        users = [dict(user) for user in cursor.fetchall()]
+
+        if len(users) > page_size:
+            users = users[:page_size]
+            ultimo = users[-1]
+            response.headers["X-Next-Cursor"] = _admin_users_cursore(
+                sort, direction, ultimo["chiave_ordinamento"], ultimo["id"]
+            )
+        for user in users:
+            del user["chiave_ordinamento"]
 
-        users = cursor.fetchall()
-        return [dict(user) for user in users]
+        cursor.execute("SELECT num_utenti FROM user_stats_totali")
+        totali = cursor.fetchone()
+        response.headers["X-Total-Count"] = str(totali["num_utenti"] if totali else 0)
 
-    except Exception as e:
-        print(f"Errore durante recupero utenti: {e}")
+        return users
+
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Errore durante recupero utenti")
         raise HTTPException(status_code=500, detail="Errore durante il recupero degli utenti")
     finally:
         cursor.close()
 
+@app.get("/api/admin/stats")
+def get_admin_stats(current_user: dict = Depends(get_admin_user), conn=Depends(get_db)):
+    """
+    Numero di utenti e amministratori (user_stats_totali) e di aziende
+    (somma dei conteggi per utente di user_stats), mantenuti dai trigger
+    Solo per amministratori
+    """
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        cursor.execute("""
+            SELECT
+                COALESCE((SELECT num_utenti FROM user_stats_totali), 0) AS num_utenti,
+                COALESCE((SELECT num_admin FROM user_stats_totali), 0) AS num_admin,
+                (SELECT COALESCE(SUM(num_aziende), 0) FROM user_stats)::int AS num_aziende
+        """)
+        return dict(cursor.fetchone())
+
+    except Exception:
+        logger.exception("Errore durante recupero statistiche admin")
+        raise HTTPException(status_code=500, detail="Errore durante il recupero delle statistiche")
+    finally:
+        cursor.close()
+
 @app.delete("/api/admin/users/{user_id}")
 def delete_user(user_id: int, current_user: dict = Depends(get_admin_user), conn=Depends(get_db)):
     """
@@ -945,16 +1202,9 @@ def delete_user(user_id: int, current_user: dict = Depends(get_admin_user), conn
 
         # Ottieni conteggi dati prima di eliminare
         cursor.execute("""
-            SELECT
-                COUNT(DISTINCT a.id) as num_aziende,
-                COUNT(DISTINCT ve.id) as num_valutazioni_esposizione,
-                COUNT(DISTINCT vd.id) as num_valutazioni_dpi
-            FROM users u
-            LEFT JOIN aziende a ON a.user_id = u.id
-            LEFT JOIN valutazioni_esposizione ve ON ve.user_id = u.id
-            LEFT JOIN valutazioni_dpi vd ON vd.user_id = u.id
-            WHERE u.id = %s
-            GROUP BY u.id
+            SELECT num_aziende, num_valutazioni_esposizione, num_valutazioni_dpi
+            FROM user_stats
+            WHERE user_id = %s
         """, (user_id,))
 
         counts = cursor.fetchone()
@@ -979,13 +1229,66 @@ def delete_user(user_id: int, current_user: dict = Depends(get_admin_user), conn
 
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        print(f"Errore durante eliminazione utente: {e}")
+        logger.exception("Errore durante eliminazione utente")
         raise HTTPException(status_code=500, detail="Errore durante l'eliminazione dell'utente")
     finally:
         cursor.close()
 
+@app.post("/api/admin/storage/gc")
+def start_storage_gc(
+    background_tasks: BackgroundTasks,
+    dry_run: bool = True,
+    current_user: dict = Depends(get_admin_user),
+    conn=Depends(get_db)
+):
+    """
+    Avvia in background la garbage collection degli oggetti B2 orfani
+    Con dry_run=true produce solo il report; altrimenti elimina e riprende
+    l'ultima esecuzione interrotta dal suo checkpoint
+    Solo per amministratori
+    """
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        if storage_gc.is_gc_running(cursor):
+            raise HTTPException(status_code=409, detail="Garbage collection già in esecuzione")
+        run_id = storage_gc.start_run(conn, dry_run=dry_run)
+    finally:
+        cursor.close()
+
+    background_tasks.add_task(storage_gc.run_storage_gc, run_id)
+    return {"run_id": run_id, "dry_run": dry_run, "status": "running"}
+
+@app.get("/api/admin/storage/gc")
+def list_storage_gc_runs(limit: int = 20, current_user: dict = Depends(get_admin_user), conn=Depends(get_db)):
+    """Ultime esecuzioni della garbage collection (senza il campione di chiavi)"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("""
+            SELECT id, dry_run, status, last_key, scanned_objects, orphaned_objects,
+                   orphaned_bytes, deleted_objects, failed_objects, error,
+                   started_at, updated_at, finished_at
+            FROM storage_gc_runs
+            ORDER BY id DESC
+            LIMIT %s
+        """, (min(limit, 100),))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+@app.get("/api/admin/storage/gc/{run_id}")
+def get_storage_gc_run(run_id: int, current_user: dict = Depends(get_admin_user), conn=Depends(get_db)):
+    """Report di un'esecuzione (incluse le chiavi orfane del dry-run)"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        run = storage_gc.get_run(cursor, run_id)
+        if not run:
+            raise HTTPException(status_code=404, detail="Esecuzione non trovata")
+        return run
+    finally:
+        cursor.close()
+
 # ==================== ENDPOINTS AZIENDE ====================
 
 @app.post("/api/aziende", response_model=dict)
@@ -993,6 +1296,8 @@ def create_azienda(azienda: AziendaCreate, current_user: dict = Depends(get_curr
     """Crea una nuova azienda"""
     cursor = conn.cursor()
     try:
+        consume_quota(cursor, current_user["id"], "azienda")
+
         cursor.execute("""
             INSERT INTO aziende (
                 user_id, ragione_sociale, partita_iva, codice_fiscale,
@@ -1013,6 +1318,9 @@ def create_azienda(azienda: AziendaCreate, current_user: dict = Depends(get_curr
             "created_at": result["created_at"].isoformat(),
             "message": "Azienda creata con successo"
         }
+    except HTTPException:
+        conn.rollback()
+        raise
     except psycopg2.IntegrityError:
         conn.rollback()
         raise HTTPException(status_code=400, detail="Partita IVA già esistente")
@@ -1022,6 +1330,32 @@ def create_azienda(azienda: AziendaCreate, current_user: dict = Depends(get_curr
     finally:
         cursor.close()
 
+@app.post("/api/aziende/import", response_model=dict)
+def import_aziende(file: UploadFile, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
+    """
+    Importa aziende da un file CSV (separatore ',' o ';', intestazione con i
+    nomi dei campi). Le righe non valide o con partita IVA già esistente sono
+    restituite in "errori"; le altre vengono create in un'unica transazione.
+    """
+    cursor = conn.cursor()
+    try:
+        result = imports.import_aziende(cursor, current_user["id"], file.file)
+        if result.importate:
+            consume_quota(cursor, current_user["id"], "azienda", len(result.importate))
+        conn.commit()
+        return result.to_dict()
+    except HTTPException:
+        conn.rollback()
+        raise
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        conn.rollback()
+        raise HTTPException(status_code=400, detail=f"File CSV non valido: {e}")
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cursor.close()
+
 @app.get("/api/aziende", response_model=List[Azienda])
 def list_aziende(limit: int = 100, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
     """Lista tutte le aziende dell'utente corrente"""
@@ -1099,17 +1433,88 @@ def delete_azienda(azienda_id: int, current_user: dict = Depends(get_current_use
 
 # ==================== ENDPOINTS VALUTAZIONI ESPOSIZIONE ====================
 
+def _applica_verifica(val, tipo: str, inviati: dict, calcolati: Optional[dict]) -> List[dict]:
+    """
+    Confronta i valori del client con quelli ricalcolati (verifica.VERIFICA_CALCOLI)
+    Con "correggi" il modello riceve i valori del server; le differenze sono
+    registrate nel log (build del frontend non aggiornate) e restituite
+    """
+    if calcolati is None:
+        return []
+    differenze = verifica.discrepanze(inviati, calcolati)
+    if differenze:
+        logger.warning("Valori calcolati dal client non coerenti", extra={
+            "tipo": tipo, "campi": [d["campo"] for d in differenze], "modalita": verifica.VERIFICA_CALCOLI
+        })
+    if verifica.VERIFICA_CALCOLI == "correggi":
+        for campo, valore in verifica.formatta(calcolati).items():
+            setattr(val, campo, valore)
+    return differenze
+
+def _valida_numeri(numeri) -> Optional[str]:
+    """Errore del primo (campo, valore, limite) non numerico o fuori dal limite della colonna DECIMAL"""
+    for campo, valore, limite in numeri:
+        valore = _decimale(valore)
+        if valore is None:
+            continue
+        try:
+            numero = float(valore)
+        except ValueError:
+            return f"{campo}: valore numerico non valido"
+        if not math.isfinite(numero) or abs(numero) >= limite:
+            return f"{campo}: valore fuori intervallo"
+    return None
+
+def _numeri_esposizione(val: ValutazioneEsposizioneCreate) -> list:
+    """(campo, valore, limite) dei numeri della valutazione: limiti delle colonne DECIMAL(5,2) e DECIMAL(10,2)"""
+    numeri = [("lex", val.lex, 1000), ("lpicco", val.lpicco, 1000)]
+    for i, mis in enumerate(val.misurazioni):
+        numeri += [
+            (f"misurazioni[{i}].leq", mis.leq, 1000),
+            (f"misurazioni[{i}].durata", mis.durata, 10 ** 8),
+            (f"misurazioni[{i}].lpicco", mis.lpicco, 1000),
+        ]
+    return numeri
+
+def _verifica_esposizione(val: ValutazioneEsposizioneCreate) -> List[dict]:
+    """
+    Ricalcola lex, lpicco e classe_rischio dalle misurazioni
+    I numeri sono controllati prima: fuori dai limiti delle colonne il
+    ricalcolo (10^(Leq/10)) andrebbe in overflow; risposta 422
+    """
+    errore = _valida_numeri(_numeri_esposizione(val))
+    if errore:
+        raise HTTPException(status_code=422, detail=errore)
+    return _applica_verifica(
+        val, "esposizione",
+        {"lex": val.lex, "lpicco": val.lpicco, "classe_rischio": val.classe_rischio},
+        verifica.esposizione(val.misurazioni)
+    )
+
+def _rifiuta_discrepanze(differenze: List[dict]):
+    """Con VERIFICA_CALCOLI=rifiuta la scrittura non coerente è respinta"""
+    if differenze and verifica.VERIFICA_CALCOLI == "rifiuta":
+        raise HTTPException(status_code=422, detail={
+            "message": "Valori calcolati non coerenti con i dati inviati",
+            "discrepanze": differenze,
+        })
+
 @app.post("/api/esposizione", response_model=dict)
 def create_valutazione_esposizione(val: ValutazioneEsposizioneCreate, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
     """Crea valutazione esposizione"""
+    differenze = _verifica_esposizione(val)
+    _rifiuta_discrepanze(differenze)
     cursor = conn.cursor()
     try:
+        consume_quota(cursor, current_user["id"], "valutazione_esposizione")
+
         cursor.execute("""
             INSERT INTO valutazioni_esposizione (
-                user_id, azienda_id, mansione, reparto, lex, lpicco, classe_rischio
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+                user_id, azienda_id, mansione, reparto, lex, lpicco, classe_rischio, data_misura
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_DATE))
             RETURNING id, created_at
-        """, (current_user["id"], val.azienda_id, val.mansione, val.reparto, val.lex, val.lpicco, val.classe_rischio))
+        """, (current_user["id"], val.azienda_id, val.mansione, val.reparto, val.lex, val.lpicco,
+              val.classe_rischio, val.data_misura))
 
         result = cursor.fetchone()
         valutazione_id = result["id"]
@@ -1117,16 +1522,189 @@ def create_valutazione_esposizione(val: ValutazioneEsposizioneCreate, current_us
         for idx, mis in enumerate(val.misurazioni):
             cursor.execute("""
                 INSERT INTO misurazioni (
-                    valutazione_id, attivita, leq, durata, lpicco, ordine
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, (valutazione_id, mis.attivita, mis.leq, mis.durata, mis.lpicco, idx))
+                    valutazione_id, attivita, leq, durata, lpicco, ordine, spettro_ottave
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (valutazione_id, mis.attivita, mis.leq, mis.durata, mis.lpicco, idx, mis.spettro_ottave))
 
         conn.commit()
         return {
             "id": valutazione_id,
             "created_at": result["created_at"].isoformat(),
-            "message": "Valutazione salvata con successo"
+            "message": "Valutazione salvata con successo",
+            "discrepanze": differenze
         }
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cursor.close()
+
+# Valutazioni accettate in un singolo batch
+ESPOSIZIONE_BATCH_MAX = int(os.getenv("ESPOSIZIONE_BATCH_MAX", "500"))
+
+def _decimale(value: str) -> Optional[str]:
+    """Stringa numerica per le colonne DECIMAL ('' -> NULL)"""
+    value = (value or "").strip()
+    return value or None
+
+def _valida_esposizione(val: ValutazioneEsposizioneCreate) -> Optional[str]:
+    """Errore della singola valutazione del batch (None se valida)"""
+    if not val.mansione.strip():
+        return "Mansione obbligatoria"
+    testi = [("mansione", val.mansione, 255), ("reparto", val.reparto, 255), ("classe_rischio", val.classe_rischio, 50)]
+    for i, mis in enumerate(val.misurazioni):
+        testi.append((f"misurazioni[{i}].attivita", mis.attivita, 255))
+    for campo, valore, max_len in testi:
+        if len(valore) > max_len:
+            return f"{campo}: massimo {max_len} caratteri"
+    return _valida_numeri(_numeri_esposizione(val))
+
+def _salva_batch_esposizione(cursor, user_id: int, valutazioni: List[ValutazioneEsposizioneBatchItem]) -> dict:
+    """
+    Scrive il batch con istruzioni set-based (un INSERT/UPDATE per tabella)
+    Gli elementi non validi restano fuori e sono riportati per indice
+    """
+    risultati = [None] * len(valutazioni)
+
+    # Proprietà di aziende e valutazioni da aggiornare: due query per tutto il batch
+    azienda_ids = list({v.azienda_id for v in valutazioni if v.azienda_id is not None})
+    cursor.execute("SELECT id FROM aziende WHERE id = ANY(%s) AND user_id = %s", (azienda_ids, user_id))
+    aziende_utente = {row["id"] for row in cursor.fetchall()}
+    update_ids = list({v.id for v in valutazioni if v.id is not None})
+    cursor.execute("SELECT id FROM valutazioni_esposizione WHERE id = ANY(%s) AND user_id = %s", (update_ids, user_id))
+    valutazioni_utente = {row["id"] for row in cursor.fetchall()}
+
+    nuove, aggiornate, visti = [], [], set()
+    differenze = [[] for _ in valutazioni]
+    for indice, val in enumerate(valutazioni):
+        errore = _valida_esposizione(val)
+        if not errore:
+            differenze[indice] = _verifica_esposizione(val)
+            if differenze[indice] and verifica.VERIFICA_CALCOLI == "rifiuta":
+                errore = "Valori calcolati non coerenti: " + ", ".join(d["campo"] for d in differenze[indice])
+        if not errore and val.azienda_id is not None and val.azienda_id not in aziende_utente:
+            errore = "Azienda non trovata o non autorizzato"
+        if not errore and val.id is not None:
+            if val.id not in valutazioni_utente:
+                errore = "Valutazione non trovata o non autorizzato"
+            elif val.id in visti:
+                errore = "Valutazione ripetuta nel batch"
+        if errore:
+            risultati[indice] = {"indice": indice, "errore": errore}
+            continue
+        if val.id is None:
+            nuove.append((indice, val))
+        else:
+            visti.add(val.id)
+            aggiornate.append((indice, val))
+
+    salvate = []
+    if nuove:
+        consume_quota(cursor, user_id, "valutazione_esposizione", len(nuove))
+        # Id riservati in anticipo: ogni riga delle misurazioni sa già a chi appartiene
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence('valutazioni_esposizione', 'id')) AS id FROM generate_series(1, %s)",
+            (len(nuove),)
+        )
+        for (indice, val), row in zip(nuove, cursor.fetchall()):
+            salvate.append((row["id"], val))
+            risultati[indice] = {"indice": indice, "id": row["id"], "stato": "creata"}
+        execute_values(cursor, """
+            INSERT INTO valutazioni_esposizione (
+                id, user_id, azienda_id, mansione, reparto, lex, lpicco, classe_rischio, data_misura
+            ) VALUES %s
+        """, [
+            (valutazione_id, user_id, val.azienda_id, val.mansione, val.reparto,
+             _decimale(val.lex), _decimale(val.lpicco), val.classe_rischio, val.data_misura)
+            for valutazione_id, val in salvate
+        ], template="(%s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s::date, CURRENT_DATE))", page_size=1000)
+
+    if aggiornate:
+        execute_values(cursor, """
+            UPDATE valutazioni_esposizione v
+            SET azienda_id = d.azienda_id, mansione = d.mansione, reparto = d.reparto,
+                lex = d.lex, lpicco = d.lpicco, classe_rischio = d.classe_rischio,
+                data_misura = COALESCE(d.data_misura, v.data_misura)
+            FROM (VALUES %s) AS d(id, azienda_id, mansione, reparto, lex, lpicco, classe_rischio, data_misura)
+            WHERE v.id = d.id
+        """, [
+            (val.id, val.azienda_id, val.mansione, val.reparto,
+             _decimale(val.lex), _decimale(val.lpicco), val.classe_rischio, val.data_misura)
+            for _, val in aggiornate
+        ], template="(%s::int, %s::int, %s, %s, %s::numeric, %s::numeric, %s, %s::date)", page_size=1000)
+        cursor.execute(
+            "DELETE FROM misurazioni WHERE valutazione_id = ANY(%s)",
+            ([val.id for _, val in aggiornate],)
+        )
+        for indice, val in aggiornate:
+            salvate.append((val.id, val))
+            risultati[indice] = {"indice": indice, "id": val.id, "stato": "aggiornata"}
+
+    misurazioni = [
+        (valutazione_id, mis.attivita, _decimale(mis.leq), _decimale(mis.durata), _decimale(mis.lpicco), idx, mis.spettro_ottave)
+        for valutazione_id, val in salvate
+        for idx, mis in enumerate(val.misurazioni)
+    ]
+    if misurazioni:
+        execute_values(cursor, """
+            INSERT INTO misurazioni (valutazione_id, attivita, leq, durata, lpicco, ordine, spettro_ottave)
+            VALUES %s
+        """, misurazioni, template="(%s, %s, %s, %s, %s, %s, %s::real[])", page_size=1000)
+
+    for risultato in risultati:
+        if "errore" not in risultato and differenze[risultato["indice"]]:
+            risultato["discrepanze"] = differenze[risultato["indice"]]
+
+    return {
+        "risultati": risultati,
+        "create": len(nuove),
+        "aggiornate": len(aggiornate),
+        "errori": sum(1 for r in risultati if "errore" in r),
+    }
+
+@app.post("/api/esposizione/batch", response_model=dict)
+def batch_valutazioni_esposizione(
+    batch: ValutazioneEsposizioneBatch,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Crea (senza id) o aggiorna (con id) più valutazioni esposizione in
+    un'unica transazione. Con l'header Idempotency-Key un nuovo invio dello
+    stesso batch restituisce l'esito del primo senza duplicare i dati.
+    """
+    if not batch.valutazioni:
+        raise HTTPException(status_code=400, detail="Nessuna valutazione nel batch")
+    if len(batch.valutazioni) > ESPOSIZIONE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Massimo {ESPOSIZIONE_BATCH_MAX} valutazioni per batch")
+
+    cursor = conn.cursor()
+    try:
+        if idempotency_key:
+            payload_hash = idempotency.request_hash(batch.model_dump(mode="json"))
+            salvata = idempotency.begin(cursor, current_user["id"], idempotency_key, "esposizione_batch", payload_hash)
+            if salvata is not None:
+                conn.commit()
+                response.headers["Idempotent-Replayed"] = "true"
+                return salvata
+
+        result = _salva_batch_esposizione(cursor, current_user["id"], batch.valutazioni)
+        if idempotency_key:
+            idempotency.complete(cursor, current_user["id"], idempotency_key, result)
+        conn.commit()
+        logger.info("Batch valutazioni esposizione", extra={
+            "user_id": current_user["id"], "create": result["create"],
+            "aggiornate": result["aggiornate"], "errori": result["errori"],
+        })
+        return result
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -1147,7 +1725,7 @@ def list_valutazioni_esposizione(limit: int = 50, current_user: dict = Depends(g
         result = []
         for val in valutazioni:
             cursor.execute("""
-                SELECT id, attivita, leq::text, durata::text, lpicco::text
+                SELECT id, attivita, leq::text, durata::text, lpicco::text, spettro_ottave
                 FROM misurazioni WHERE valutazione_id = %s ORDER BY ordine
             """, (val["id"],))
             misurazioni = cursor.fetchall()
@@ -1163,6 +1741,28 @@ def list_valutazioni_esposizione(limit: int = 50, current_user: dict = Depends(g
     finally:
         cursor.close()
 
+@app.get("/api/esposizione/settimanale")
+def get_esposizione_settimanale(
+    azienda_id: Optional[int] = None,
+    mansione: Optional[str] = None,
+    reparto: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Livello di esposizione settimanale LEX,w per (azienda, mansione, reparto)
+    Ogni settimana somma i LEX,8h dei giorni misurati su 5 giorni lavorativi
+    """
+    cursor = conn.cursor()
+    try:
+        return {
+            "gruppi": esposizione_settimanale.load_esposizione_settimanale(
+                cursor, current_user["id"], azienda_id, mansione, reparto
+            )
+        }
+    finally:
+        cursor.close()
+
 @app.get("/api/esposizione/{valutazione_id}", response_model=ValutazioneEsposizione)
 def get_valutazione_esposizione(valutazione_id: int, conn=Depends(get_db)):
     """Ottieni dettagli valutazione esposizione"""
@@ -1175,7 +1775,7 @@ def get_valutazione_esposizione(valutazione_id: int, conn=Depends(get_db)):
             raise HTTPException(status_code=404, detail="Valutazione non trovata")
 
         cursor.execute("""
-            SELECT id, attivita, leq::text, durata::text, lpicco::text
+            SELECT id, attivita, leq::text, durata::text, lpicco::text, spettro_ottave
             FROM misurazioni WHERE valutazione_id = %s ORDER BY ordine
         """, (valutazione_id,))
         misurazioni = cursor.fetchall()
@@ -1197,6 +1797,8 @@ def update_valutazione_esposizione(
     conn=Depends(get_db)
 ):
     """Aggiorna valutazione esposizione esistente"""
+    differenze = _verifica_esposizione(val)
+    _rifiuta_discrepanze(differenze)
     cursor = conn.cursor()
     try:
         # Verifica che la valutazione appartenga all'utente corrente
@@ -1211,10 +1813,11 @@ def update_valutazione_esposizione(
         cursor.execute("""
             UPDATE valutazioni_esposizione
             SET azienda_id = %s, mansione = %s, reparto = %s,
-                lex = %s, lpicco = %s, classe_rischio = %s
+                lex = %s, lpicco = %s, classe_rischio = %s,
+                data_misura = COALESCE(%s, data_misura)
             WHERE id = %s
         """, (val.azienda_id, val.mansione, val.reparto, val.lex, val.lpicco,
-              val.classe_rischio, valutazione_id))
+              val.classe_rischio, val.data_misura, valutazione_id))
 
         # Elimina misurazioni esistenti
         cursor.execute("DELETE FROM misurazioni WHERE valutazione_id = %s", (valutazione_id,))
@@ -1223,14 +1826,15 @@ def update_valutazione_esposizione(
         for idx, mis in enumerate(val.misurazioni):
             cursor.execute("""
                 INSERT INTO misurazioni (
-                    valutazione_id, attivita, leq, durata, lpicco, ordine
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, (valutazione_id, mis.attivita, mis.leq, mis.durata, mis.lpicco, idx))
+                    valutazione_id, attivita, leq, durata, lpicco, ordine, spettro_ottave
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (valutazione_id, mis.attivita, mis.leq, mis.durata, mis.lpicco, idx, mis.spettro_ottave))
 
         conn.commit()
         return {
             "id": valutazione_id,
-            "message": "Valutazione aggiornata con successo"
+            "message": "Valutazione aggiornata con successo",
+            "discrepanze": differenze
         }
     except HTTPException:
         conn.rollback()
@@ -1254,60 +1858,616 @@ def delete_valutazione_esposizione(valutazione_id: int, conn=Depends(get_db)):
     finally:
         cursor.close()
 
-# ==================== ENDPOINTS VALUTAZIONI DPI ====================
-
-@app.post("/api/dpi", response_model=dict)
-def create_valutazione_dpi(val: ValutazioneDPICreate, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
-    """Crea valutazione DPI"""
+@app.post("/api/esposizione/{valutazione_id}/incertezza", response_model=dict)
+def calcola_incertezza_esposizione(
+    valutazione_id: int,
+    richiesta: IncertezzaRequest,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Incertezza del LEX secondo la UNI EN ISO 9612 (strategia per compiti)
+    Salva l'incertezza estesa e la probabilità di superare 80, 85 e 87 dB(A)
+    """
     cursor = conn.cursor()
     try:
+        cursor.execute(
+            "SELECT id FROM valutazioni_esposizione WHERE id = %s AND user_id = %s",
+            (valutazione_id, current_user["id"])
+        )
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="Valutazione non trovata o non autorizzato")
+
         cursor.execute("""
-            INSERT INTO valutazioni_dpi (
-                user_id, azienda_id, mansione, reparto, dpi_selezionato,
-                h, m, l, lex_per_dpi, pnr, leff, protezione_adeguata
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, created_at
+            SELECT leq::float8 AS leq, durata::float8 AS durata
+            FROM misurazioni WHERE valutazione_id = %s ORDER BY ordine, id
+        """, (valutazione_id,))
+        misurazioni = cursor.fetchall()
+        if len(richiesta.misure_ripetute) > len(misurazioni):
+            raise HTTPException(status_code=400, detail="misure_ripetute ha più compiti delle misurazioni")
+
+        u1a = np.full(len(misurazioni), richiesta.u1a)
+        for idx, ripetute in enumerate(richiesta.misure_ripetute):
+            if ripetute:
+                try:
+                    u1a[idx] = incertezza.u1a_campioni(ripetute)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=f"Compito {idx + 1}: {e}")
+
+        # I compiti senza durata non contribuiscono al LEX
+        attivi = [i for i, m in enumerate(misurazioni) if m["leq"] is not None and (m["durata"] or 0) > 0]
+        if not attivi:
+            raise HTTPException(status_code=400, detail="Nessuna misurazione con Leq e durata")
+        leq = np.array([misurazioni[i]["leq"] for i in attivi])
+        durata = np.array([misurazioni[i]["durata"] for i in attivi])
+
+        parametri = {
+            "u1a": u1a[attivi],
+            "u2": incertezza.U2_FONOMETRO[richiesta.classe_fonometro],
+            "u3": richiesta.u3,
+            "u1b": durata * richiesta.u1b_percentuale / 100,
+        }
+        if richiesta.metodo == "montecarlo":
+            # Seme fisso per valutazione: lo stesso calcolo dà lo stesso risultato salvato
+            risultato = incertezza.incertezza_montecarlo(
+                leq, durata, **parametri, campioni=richiesta.campioni, seed=valutazione_id
+            )
+        else:
+            risultato = incertezza.incertezza_analitica(leq, durata, **parametri)
+        probabilita = risultato["probabilita_superamento"]
+
+        cursor.execute("""
+            UPDATE valutazioni_esposizione
+            SET incertezza_u = %s, incertezza_estesa = %s,
+                prob_superamento_80 = %s, prob_superamento_85 = %s, prob_superamento_87 = %s,
+                incertezza_metodo = %s, incertezza_parametri = %s,
+                incertezza_calcolata_at = clock_timestamp()
+            WHERE id = %s
         """, (
-            current_user["id"],
-            val.azienda_id, val.mansione, val.reparto, val.dpi_selezionato,
-            val.valori_hml.h, val.valori_hml.m, val.valori_hml.l,
-            val.lex_per_dpi, val.pnr, val.leff, val.protezione_adeguata
+            round(risultato["u"], 2), round(risultato["U"], 2),
+            round(probabilita[80], 4), round(probabilita[85], 4), round(probabilita[87], 4),
+            richiesta.metodo,
+            Json({
+                "u1a": [round(float(u), 3) for u in parametri["u1a"]],
+                "u2": parametri["u2"],
+                "u3": parametri["u3"],
+                "u1b_percentuale": richiesta.u1b_percentuale,
+                "campioni": risultato.get("campioni"),
+            }),
+            valutazione_id,
         ))
-
-        result = cursor.fetchone()
         conn.commit()
+
         return {
-            "id": result["id"],
-            "created_at": result["created_at"].isoformat(),
-            "message": "Valutazione DPI salvata con successo"
+            "id": valutazione_id,
+            "metodo": richiesta.metodo,
+            "lex": round(risultato["lex"], 1),
+            "incertezza_u": round(risultato["u"], 2),
+            "incertezza_estesa": round(risultato["U"], 2),
+            "lex_piu_u": round(risultato["lex"] + risultato["U"], 1),
+            "probabilita_superamento": {str(soglia): round(p, 4) for soglia, p in probabilita.items()},
         }
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cursor.close()
 
-@app.get("/api/dpi", response_model=List[ValutazioneDPI])
-def list_valutazioni_dpi(limit: int = 50, conn=Depends(get_db)):
-    """Lista valutazioni DPI"""
+@app.post("/api/esposizione/{valutazione_id}/time-history", response_model=dict)
+def import_time_history(
+    valutazione_id: int,
+    file: UploadFile,
+    intervallo: float = Form(1.0, gt=0, le=3600),
+    segmenti: Optional[str] = Form(None),
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Importa il log per campioni di un fonometro/dosimetro (CSV o testo)
+    Le misurazioni della valutazione sono sostituite da una riga per attività
+    (Leq energetico, durata, Lpicco massimo); LEX, Lpicco e classe di rischio
+    sono ricalcolati. La serie grezza è salvata nello storage in binario.
+
+    segmenti: JSON [{"attivita", "inizio", "fine"}] in secondi dall'inizio del
+    log; senza segmenti le attività sono lette dalla colonna attività/marker.
+    """
+    try:
+        lista_segmenti = None
+        if segmenti:
+            lista_segmenti = [SegmentoTimeHistory.model_validate(s).model_dump() for s in json.loads(segmenti)]
+    except (ValueError, TypeError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Segmenti non validi: {e}")
+
     cursor = conn.cursor()
+    caricata = None     # serie nello storage non ancora referenziata da una transazione confermata
     try:
-        cursor.execute("SELECT * FROM valutazioni_dpi ORDER BY created_at DESC LIMIT %s", (limit,))
-        valutazioni = cursor.fetchall()
+        cursor.execute(
+            "SELECT serie_key FROM valutazioni_esposizione WHERE id = %s AND user_id = %s",
+            (valutazione_id, current_user["id"])
+        )
+        valutazione = cursor.fetchone()
+        if not valutazione:
+            raise HTTPException(status_code=404, detail="Valutazione non trovata o non autorizzato")
 
-        result = []
-        for val in valutazioni:
-            result.append({
-                "id": val["id"],
-                "azienda_id": val["azienda_id"],
-                "mansione": val["mansione"],
-                "reparto": val["reparto"],
-                "dpi_selezionato": val["dpi_selezionato"],
-                "valori_hml": {
-                    "h": str(val["h"]) if val["h"] else "0",
-                    "m": str(val["m"]) if val["m"] else "0",
-                    "l": str(val["l"]) if val["l"] else "0"
-                },
+        try:
+            log = time_history.leggi_time_history(file.file, intervallo, lista_segmenti)
+        except (ValueError, csv.Error) as e:
+            raise HTTPException(status_code=400, detail=f"Log non valido: {e}")
+        misurazioni = log.misurazioni()
+        if not misurazioni:
+            raise HTTPException(status_code=400, detail="Nessun campione valido nelle attività")
+
+        # LEX dalle righe salvate, come calcolaLEX sul client
+        lex = round(float(noise_calculations.lex_8h(
+            [m["leq"] for m in misurazioni], [m["durata"] for m in misurazioni]
+        )), 1)
+        picchi = [m["lpicco"] for m in misurazioni if m["lpicco"] is not None]
+        lpicco = max(picchi) if picchi else None
+
+        # Quota prima del caricamento: un rifiuto non lascia oggetti nello storage
+        leq_serie, picco_serie = log.serie()
+        contenuto = serie_temporali.codifica(leq_serie, picco_serie, intervallo)
+        serie_bytes = len(contenuto)
+        consume_quota(cursor, current_user["id"], "storage", serie_bytes)
+        serie_key = caricata = serie_temporali.carica(contenuto)
+
+        cursor.execute("DELETE FROM misurazioni WHERE valutazione_id = %s", (valutazione_id,))
+        execute_values(cursor, """
+            INSERT INTO misurazioni (valutazione_id, attivita, leq, durata, lpicco, ordine)
+            VALUES %s
+        """, [
+            (valutazione_id, m["attivita"], m["leq"], m["durata"], m["lpicco"], idx)
+            for idx, m in enumerate(misurazioni)
+        ], page_size=1000)
+        cursor.execute("""
+            UPDATE valutazioni_esposizione
+            SET lex = %s, lpicco = %s, classe_rischio = %s,
+                serie_key = %s, serie_bytes = %s, serie_campioni = %s, serie_intervallo = %s
+            WHERE id = %s
+        """, (
+            lex, lpicco, noise_calculations.RISCHIO_CLASSI[noise_calculations.classe_rischio(lex)],
+            serie_key, serie_bytes, len(leq_serie), intervallo, valutazione_id,
+        ))
+        conn.commit()
+        caricata = None
+
+        # La serie precedente non è più referenziata (altrimenti la raccoglie la GC)
+        if valutazione["serie_key"]:
+            try:
+                storage.delete_objects([valutazione["serie_key"]])
+            except Exception:
+                logger.warning("Eliminazione serie temporale sostituita fallita", extra={"key": valutazione["serie_key"]})
+
+        return {
+            "id": valutazione_id,
+            "lex": f"{lex:.1f}",
+            "lpicco": f"{lpicco:.1f}" if lpicco is not None else "0",
+            "misurazioni": misurazioni,
+            "campioni": len(leq_serie),
+            "campioni_non_validi": log.non_validi,
+            "campioni_esclusi": log.esclusi,
+            "serie_bytes": serie_bytes,
+        }
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cursor.close()
+        # Scrittura fallita dopo il caricamento: la serie non è referenziata
+        if caricata:
+            try:
+                storage.delete_objects([caricata])
+            except Exception:
+                logger.warning("Eliminazione serie temporale non salvata fallita", extra={"key": caricata})
+
+# Punti massimi di un profilo ricampionato della serie temporale
+SERIE_PROFILO_MAX_PUNTI = 20000
+
+@app.get("/api/esposizione/{valutazione_id}/serie", response_model=dict)
+def get_serie_temporale(
+    valutazione_id: int,
+    inizio: float = 0,
+    fine: Optional[float] = None,
+    passo: Optional[float] = None,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Aggregato (Leq, Lpicco, min/max) della time history in [inizio, fine)
+    secondi e, con `passo`, il profilo ricampionato a `passo` secondi.
+    Dallo storage vengono letti solo l'indice e i blocchi necessari.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT serie_key FROM valutazioni_esposizione WHERE id = %s AND user_id = %s",
+            (valutazione_id, current_user["id"])
+        )
+        valutazione = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not valutazione:
+        raise HTTPException(status_code=404, detail="Valutazione non trovata o non autorizzato")
+    if not valutazione["serie_key"]:
+        raise HTTPException(status_code=404, detail="Nessuna time history per questa valutazione")
+
+    serie = serie_temporali.apri(valutazione["serie_key"])
+    fine_effettiva = serie.durata if fine is None else min(fine, serie.durata)
+    result = {
+        "campioni": serie.campioni,
+        "intervallo": serie.intervallo,
+        "durata": serie.durata,
+        "aggregato": serie.aggrega(inizio, fine),
+    }
+    if passo is not None:
+        if passo <= 0:
+            raise HTTPException(status_code=400, detail="passo deve essere positivo")
+        if (fine_effettiva - inizio) / max(passo, serie.intervallo) > SERIE_PROFILO_MAX_PUNTI:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Profilo troppo dettagliato (massimo {SERIE_PROFILO_MAX_PUNTI} punti): aumentare passo"
+            )
+        result["profilo"] = serie.profilo(inizio, fine, passo)
+    return result
+
+def _calcola_riduzione(valutazioni: list, richiesta: RiduzioneRequest) -> list:
+    """
+    Analisi what-if di più valutazioni in un'unica passata vettoriale
+
+    Args:
+        valutazioni: [(id, [{"attivita", "leq", "durata"}, ...])]; i vincoli
+                     per attività si applicano solo alla singola valutazione
+    """
+    usa_vincoli = len(valutazioni) == 1
+    attivita, gruppo, leq, durata, riduzione_max, durata_min, peso = [], [], [], [], [], [], []
+    for g, (_, misurazioni) in enumerate(valutazioni):
+        for idx, mis in enumerate(misurazioni):
+            if mis["leq"] is None or not mis["durata"] or mis["durata"] <= 0:
+                continue
+            vincolo = richiesta.vincoli[idx] if usa_vincoli and idx < len(richiesta.vincoli) else VincoloAttivita()
+            attivita.append(mis["attivita"])
+            gruppo.append(g)
+            leq.append(mis["leq"])
+            durata.append(mis["durata"])
+            riduzione_max.append(vincolo.riduzione_max if vincolo.riduzione_max is not None
+                                 else richiesta.riduzione_max if richiesta.riduzione_max is not None else np.inf)
+            durata_min.append(vincolo.durata_min if vincolo.durata_min is not None
+                              else mis["durata"] * richiesta.durata_min_percentuale / 100)
+            peso.append(vincolo.peso)
+
+    n = len(valutazioni)
+    analisi = riduzione.analisi(leq, durata, gruppo, n, richiesta.obiettivi)
+    piani = {}
+    for obiettivo in richiesta.obiettivi if richiesta.modalita else []:
+        if richiesta.modalita == "livelli":
+            piani[obiettivo] = riduzione.ottimizza_livelli(leq, durata, gruppo, n, obiettivo, riduzione_max, peso)
+        else:
+            piani[obiettivo] = riduzione.ottimizza_durate(
+                leq, durata, gruppo, n, obiettivo, durata_min, peso, richiesta.leq_sostituzione
+            )
+
+    indici = [[] for _ in range(n)]
+    for i, g in enumerate(gruppo):
+        indici[g].append(i)
+
+    risultati = []
+    for g, (valutazione_id, _) in enumerate(valutazioni):
+        lex = riduzione.arrotonda(analisi["lex"][g])
+        obiettivi = []
+        for k, obiettivo in enumerate(richiesta.obiettivi):
+            voce = {
+                "obiettivo": obiettivo,
+                "conforme": lex is not None and lex <= obiettivo,
+                "riduzione_uniforme": riduzione.arrotonda(analisi["riduzione_uniforme"][g, k]),
+                "attivita": [
+                    {
+                        "attivita": attivita[i],
+                        "leq": leq[i],
+                        "durata": durata[i],
+                        "durata_max": riduzione.arrotonda(analisi["durata_max"][i, k], 2),
+                        "riduzione_leq": riduzione.arrotonda(analisi["riduzione_leq"][i, k]),
+                    }
+                    for i in indici[g]
+                ],
+            }
+            piano = piani.get(obiettivo)
+            if piano is not None:
+                campo = "riduzione" if richiesta.modalita == "livelli" else "minuti"
+                voce["piano"] = {
+                    "modalita": richiesta.modalita,
+                    "fattibile": bool(piano["fattibile"][g]),
+                    "lex": riduzione.arrotonda(piano["lex"][g]),
+                    campo: [riduzione.arrotonda(piano[campo][i], 2) for i in indici[g]],
+                }
+            obiettivi.append(voce)
+        risultati.append({"id": valutazione_id, "lex": lex, "obiettivi": obiettivi})
+    return risultati
+
+def _riduzione_cached(valutazioni: list, richiesta: RiduzioneRequest) -> list:
+    """Stessi dati e parametri -> risultato dalla cache del worker"""
+    chiave = idempotency.request_hash({"valutazioni": valutazioni, "richiesta": richiesta.model_dump()})
+    return riduzione.cached(chiave, lambda: _calcola_riduzione(valutazioni, richiesta))
+
+@app.post("/api/esposizione/{valutazione_id}/riduzione", response_model=dict)
+def riduzione_valutazione(
+    valutazione_id: int,
+    richiesta: RiduzioneRequest,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Quanto ridurre durata o livello di ogni attività per rientrare negli obiettivi
+    Con `modalita` calcola anche il piano ottimo su tutte le attività insieme,
+    rispettando i vincoli per attività
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT id FROM valutazioni_esposizione WHERE id = %s AND user_id = %s",
+            (valutazione_id, current_user["id"])
+        )
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="Valutazione non trovata o non autorizzato")
+        cursor.execute("""
+            SELECT attivita, leq::float8 AS leq, durata::float8 AS durata
+            FROM misurazioni WHERE valutazione_id = %s ORDER BY ordine, id
+        """, (valutazione_id,))
+        misurazioni = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    return _riduzione_cached([(valutazione_id, misurazioni)], richiesta)[0]
+
+@app.post("/api/aziende/{azienda_id}/riduzione", response_model=dict)
+def riduzione_azienda(
+    azienda_id: int,
+    richiesta: RiduzioneRequest,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """Analisi what-if di tutte le valutazioni dell'azienda (vincoli per attività ignorati)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT id FROM aziende WHERE id = %s AND user_id = %s",
+            (azienda_id, current_user["id"])
+        )
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="Azienda non trovata o non autorizzato")
+        cursor.execute("""
+            SELECT v.id, v.mansione, v.reparto, m.attivita, m.leq::float8 AS leq, m.durata::float8 AS durata
+            FROM valutazioni_esposizione v
+            LEFT JOIN misurazioni m ON m.valutazione_id = v.id
+            WHERE v.azienda_id = %s AND v.user_id = %s
+            ORDER BY v.id, m.ordine, m.id
+        """, (azienda_id, current_user["id"]))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    valutazioni, intestazioni = [], {}
+    for row in rows:
+        if row["id"] not in intestazioni:
+            intestazioni[row["id"]] = {"mansione": row["mansione"], "reparto": row["reparto"]}
+            valutazioni.append((row["id"], []))
+        if row["attivita"] is not None:
+            valutazioni[-1][1].append({"attivita": row["attivita"], "leq": row["leq"], "durata": row["durata"]})
+
+    risultati = _riduzione_cached(valutazioni, richiesta.model_copy(update={"vincoli": []})) if valutazioni else []
+    return {
+        "azienda_id": azienda_id,
+        "valutazioni": [{**intestazioni[r["id"]], **r} for r in risultati],
+    }
+
+def run_rotazione_job(job: jobs.Job, richiesta: RotazioneRequest, attivita: list, leq: list,
+                      fabbisogno: list, lavoratori: list, lex_attuali: list):
+    """Ricerca della rotazione (job di background, senza accesso al database)"""
+    job.total = 100
+
+    def progresso(frazione: float):
+        for _ in range(int(frazione * job.total) - job.done):
+            job.advance()
+
+    indice = {nome: a for a, nome in enumerate(attivita)}
+    abilitato = np.zeros((len(lavoratori), len(attivita)), dtype=bool)
+    for w, lavoratore in enumerate(lavoratori):
+        if lavoratore.attivita is None:
+            abilitato[w] = True
+        else:
+            abilitato[w, [indice[nome] for nome in lavoratore.attivita]] = True
+    turni = [lavoratore.minuti_turno or richiesta.minuti_turno for lavoratore in lavoratori]
+
+    # RotazioneImpossibile -> job fallito con il messaggio come errore
+    piano = rotazioni.pianifica(
+        leq, fabbisogno, turni, abilitato, richiesta.slot, richiesta.leq_riposo,
+        richiesta.tempo_max, progresso
+    )
+
+    calendario = []
+    for w, lavoratore in enumerate(lavoratori):
+        blocchi, inizio = [], 0.0
+        for a in np.argsort(-np.asarray(leq)):
+            if piano["conteggi"][w, a]:
+                fine = inizio + int(piano["conteggi"][w, a]) * richiesta.slot
+                blocchi.append({"attivita": attivita[a], "inizio": inizio, "fine": fine})
+                inizio = fine
+        lex = riduzione.arrotonda(piano["lex"][w])
+        calendario.append({
+            "lavoratore": lavoratore.nome,
+            "lex": lex,
+            "classe_rischio": noise_calculations.RISCHIO_CLASSI[noise_calculations.classe_rischio(lex)] if lex is not None else None,
+            "conforme": lex is None or lex <= richiesta.obiettivo,
+            "blocchi": blocchi,
+        })
+
+    lex_piano = [c["lex"] for c in calendario if c["lex"] is not None]
+    lex_attuali = [lex for lex in lex_attuali if lex is not None]
+    return {
+        "reparto": richiesta.reparto,
+        "obiettivo": richiesta.obiettivo,
+        "attivita": [{"attivita": nome, "leq": riduzione.arrotonda(l), "fabbisogno": f}
+                     for nome, l, f in zip(attivita, leq, fabbisogno)],
+        "lex_max": max(lex_piano, default=None),
+        "lex_max_attuale": max(lex_attuali, default=None),
+        "sopra_obiettivo": sum(1 for c in calendario if not c["conforme"]),
+        "iterazioni": piano["iterazioni"],
+        "lavoratori": calendario,
+    }
+
+@app.post("/api/aziende/{azienda_id}/rotazione", status_code=202)
+def create_rotazione_job(
+    azienda_id: int,
+    richiesta: RotazioneRequest,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Avvia la pianificazione delle rotazioni tra le mansioni di un reparto
+    I livelli delle attività sono le medie energetiche delle misurazioni
+    salvate nel reparto; senza lavoratori o fabbisogno espliciti ogni
+    valutazione conta come un lavoratore e il lavoro da coprire è quello
+    attuale. Avanzamento e piano su /api/jobs/{id}
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT user_id FROM aziende WHERE id = %s", (azienda_id,))
+        azienda = cursor.fetchone()
+        if not azienda:
+            raise HTTPException(status_code=404, detail="Azienda non trovata")
+        if azienda["user_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Non autorizzato")
+        cursor.execute("""
+            SELECT v.id, v.mansione, m.attivita, m.leq::float8 AS leq, m.durata::float8 AS durata
+            FROM valutazioni_esposizione v
+            JOIN misurazioni m ON m.valutazione_id = v.id
+            WHERE v.azienda_id = %s AND v.user_id = %s AND v.reparto = %s
+              AND m.leq IS NOT NULL AND m.durata > 0
+            ORDER BY v.id, m.ordine, m.id
+        """, (azienda_id, current_user["id"], richiesta.reparto))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="Nessuna misurazione nel reparto")
+
+    # Leq medio energetico (pesato sulle durate) e minuti totali per attività
+    energie, minuti, valutazioni = {}, {}, {}
+    for row in rows:
+        energia = row["durata"] * 10 ** (0.1 * row["leq"])
+        energie[row["attivita"]] = energie.get(row["attivita"], 0.0) + energia
+        minuti[row["attivita"]] = minuti.get(row["attivita"], 0.0) + row["durata"]
+        mansione, totale = valutazioni.get(row["id"], (row["mansione"], 0.0))
+        valutazioni[row["id"]] = (mansione, totale + energia / 480)
+    attivita = list(energie)
+    leq = [10 * math.log10(energie[nome] / minuti[nome]) for nome in attivita]
+
+    sconosciute = sorted(
+        ({nome for lav in richiesta.lavoratori for nome in lav.attivita or []} | set(richiesta.fabbisogno))
+        - set(attivita)
+    )
+    if sconosciute:
+        raise HTTPException(status_code=400, detail=f"Attività senza misurazioni nel reparto: {', '.join(sconosciute)}")
+    fabbisogno = [richiesta.fabbisogno.get(nome, minuti[nome]) for nome in attivita]
+    lavoratori = richiesta.lavoratori or [
+        LavoratoreRotazione(nome=f"{mansione} (#{valutazione_id})")
+        for valutazione_id, (mansione, _) in valutazioni.items()
+    ]
+    lex_attuali = [riduzione.arrotonda(10 * math.log10(energia)) for _, energia in valutazioni.values()]
+
+    job = jobs.submit_job(
+        current_user["id"], "rotazione", run_rotazione_job,
+        richiesta, attivita, leq, fabbisogno, lavoratori, lex_attuali
+    )
+    return job.to_dict()
+
+# ==================== ENDPOINTS VALUTAZIONI DPI ====================
+
+def _verifica_dpi(val: ValutazioneDPICreate) -> List[dict]:
+    """
+    Ricalcola pnr, leff e protezione_adeguata da lex_per_dpi e valori HML
+    (422 se i dati del ricalcolo sono fuori dai limiti delle colonne DECIMAL(5,2))
+    """
+    errore = _valida_numeri([
+        ("lex_per_dpi", val.lex_per_dpi, 1000),
+        ("valori_hml.h", val.valori_hml.h, 1000),
+        ("valori_hml.m", val.valori_hml.m, 1000),
+        ("valori_hml.l", val.valori_hml.l, 1000),
+    ])
+    if errore:
+        raise HTTPException(status_code=422, detail=errore)
+    return _applica_verifica(
+        val, "dpi",
+        {"pnr": val.pnr, "leff": val.leff, "protezione_adeguata": val.protezione_adeguata},
+        verifica.dpi(val.lex_per_dpi, val.valori_hml.h, val.valori_hml.m, val.valori_hml.l)
+    )
+
+@app.post("/api/dpi", response_model=dict)
+def create_valutazione_dpi(val: ValutazioneDPICreate, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
+    """Crea valutazione DPI"""
+    differenze = _verifica_dpi(val)
+    _rifiuta_discrepanze(differenze)
+    cursor = conn.cursor()
+    try:
+        consume_quota(cursor, current_user["id"], "valutazione_dpi")
+
+        cursor.execute("""
+            INSERT INTO valutazioni_dpi (
+                user_id, azienda_id, mansione, reparto, dpi_selezionato,
+                h, m, l, lex_per_dpi, pnr, leff, protezione_adeguata
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, created_at
+        """, (
+            current_user["id"],
+            val.azienda_id, val.mansione, val.reparto, val.dpi_selezionato,
+            val.valori_hml.h, val.valori_hml.m, val.valori_hml.l,
+            val.lex_per_dpi, val.pnr, val.leff, val.protezione_adeguata
+        ))
+
+        result = cursor.fetchone()
+        conn.commit()
+        return {
+            "id": result["id"],
+            "created_at": result["created_at"].isoformat(),
+            "message": "Valutazione DPI salvata con successo",
+            "discrepanze": differenze
+        }
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cursor.close()
+
+@app.get("/api/dpi", response_model=List[ValutazioneDPI])
+def list_valutazioni_dpi(limit: int = 50, conn=Depends(get_db)):
+    """Lista valutazioni DPI"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT * FROM valutazioni_dpi ORDER BY created_at DESC LIMIT %s", (limit,))
+        valutazioni = cursor.fetchall()
+
+        result = []
+        for val in valutazioni:
+            result.append({
+                "id": val["id"],
+                "azienda_id": val["azienda_id"],
+                "mansione": val["mansione"],
+                "reparto": val["reparto"],
+                "dpi_selezionato": val["dpi_selezionato"],
+                "valori_hml": {
+                    "h": str(val["h"]) if val["h"] else "0",
+                    "m": str(val["m"]) if val["m"] else "0",
+                    "l": str(val["l"]) if val["l"] else "0"
+                },
                 "lex_per_dpi": str(val["lex_per_dpi"]) if val["lex_per_dpi"] else "0",
                 "pnr": str(val["pnr"]) if val["pnr"] else None,
                 "leff": str(val["leff"]) if val["leff"] else None,
@@ -1358,6 +2518,8 @@ def update_valutazione_dpi(
     conn=Depends(get_db)
 ):
     """Aggiorna valutazione DPI esistente"""
+    differenze = _verifica_dpi(val)
+    _rifiuta_discrepanze(differenze)
     cursor = conn.cursor()
     try:
         # Verifica che la valutazione appartenga all'utente corrente
@@ -1385,7 +2547,8 @@ def update_valutazione_dpi(
         conn.commit()
         return {
             "id": valutazione_id,
-            "message": "Valutazione DPI aggiornata con successo"
+            "message": "Valutazione DPI aggiornata con successo",
+            "discrepanze": differenze
         }
     except HTTPException:
         conn.rollback()
@@ -1409,6 +2572,196 @@ def delete_valutazione_dpi(valutazione_id: int, conn=Depends(get_db)):
     finally:
         cursor.close()
 
+# ==================== ENDPOINTS CATALOGO DPI ====================
+
+@app.get("/api/dpi-catalog")
+def cerca_dpi_catalog(
+    q: str = "",
+    tipo: Optional[str] = None,
+    produttore: Optional[str] = None,
+    snr_min: Optional[float] = None,
+    snr_max: Optional[float] = None,
+    h_min: Optional[float] = None,
+    h_max: Optional[float] = None,
+    m_min: Optional[float] = None,
+    m_max: Optional[float] = None,
+    l_min: Optional[float] = None,
+    l_max: Optional[float] = None,
+    limit: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Ricerca nel catalogo DPI (typeahead): prefisso o fuzzy su nome,
+    produttore e tipo, filtri per intervallo su SNR/H/M/L
+    """
+    limit = max(1, min(limit, 100))
+    index = dpi_catalog.get_index()
+    return index.search(
+        q, limit=limit, tipo=tipo, produttore=produttore,
+        snr_min=snr_min, snr_max=snr_max, h_min=h_min, h_max=h_max,
+        m_min=m_min, m_max=m_max, l_min=l_min, l_max=l_max,
+    )
+
+@app.post("/api/dpi-catalog/raccomandazioni")
+def raccomanda_dpi(
+    richiesta: RaccomandazioneDPIRequest,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Valuta con il metodo HML tutti i DPI del catalogo per un LEX, un insieme
+    di esposizioni o le valutazioni di un'azienda e restituisce i `top`
+    prodotti con L'eff più vicino alla fascia OTTIMALE (70-80 dB(A))
+    """
+    lex = list(richiesta.esposizioni)
+    if richiesta.lex_per_dpi is not None:
+        lex.append(richiesta.lex_per_dpi)
+
+    if richiesta.azienda_id is not None:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT user_id FROM aziende WHERE id = %s", (richiesta.azienda_id,))
+            azienda = cursor.fetchone()
+            if not azienda:
+                raise HTTPException(status_code=404, detail="Azienda non trovata")
+            if azienda["user_id"] != current_user["id"]:
+                raise HTTPException(status_code=403, detail="Non autorizzato")
+            cursor.execute(
+                "SELECT lex FROM valutazioni_esposizione WHERE azienda_id = %s AND lex > 0",
+                (richiesta.azienda_id,)
+            )
+            lex.extend(float(row["lex"]) for row in cursor.fetchall())
+        finally:
+            cursor.close()
+
+    if not lex:
+        raise HTTPException(status_code=400, detail="Indicare lex_per_dpi, esposizioni o un'azienda con valutazioni")
+
+    return dpi_catalog.get_index().raccomanda(
+        lex, top=max(1, min(richiesta.top, 100)),
+        tipo=richiesta.tipo, produttore=richiesta.produttore,
+        snr_min=richiesta.snr_min, snr_max=richiesta.snr_max,
+    )
+
+# Celle spettri x DPI calcolate in una richiesta del metodo per ottave
+OTTAVE_MAX_CELLE = int(os.getenv("OTTAVE_MAX_CELLE", "1000000"))
+
+@app.post("/api/dpi/ottave")
+def attenuazione_ottave(
+    richiesta: AttenuazioneOttaveRequest,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Metodo per bande d'ottava (EN ISO 4869-2): livello sotto il protettore
+    di ogni spettro con ogni DPI, calcolato in un unico passaggio vettoriale.
+    Con valutazione_id restituisce anche il LEX,8h protetto per DPI,
+    pesando le attività con le loro durate.
+    """
+    if any(len(spettro) != len(noise_calculations.OTTAVE_HZ) for spettro in richiesta.spettri):
+        raise HTTPException(status_code=400, detail="Ogni spettro deve avere 8 bande (63-8000 Hz)")
+
+    spettri = [{"la": None, "livelli": spettro} for spettro in richiesta.spettri]
+    durate = None
+    if richiesta.valutazione_id is not None:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT user_id FROM valutazioni_esposizione WHERE id = %s",
+                (richiesta.valutazione_id,)
+            )
+            val = cursor.fetchone()
+            if not val or val["user_id"] != current_user["id"]:
+                raise HTTPException(status_code=404, detail="Valutazione non trovata o non autorizzato")
+            cursor.execute("""
+                SELECT attivita, durata, spettro_ottave
+                FROM misurazioni
+                WHERE valutazione_id = %s AND spettro_ottave IS NOT NULL
+                ORDER BY ordine, id
+            """, (richiesta.valutazione_id,))
+            misurazioni = cursor.fetchall()
+        finally:
+            cursor.close()
+        if not misurazioni:
+            raise HTTPException(status_code=400, detail="Nessuna misurazione della valutazione ha lo spettro per ottave")
+        spettri += [
+            {"attivita": m["attivita"], "durata": float(m["durata"] or 0), "livelli": m["spettro_ottave"]}
+            for m in misurazioni
+        ]
+        durate = [0.0] * len(richiesta.spettri) + [float(m["durata"] or 0) for m in misurazioni]
+
+    if not spettri:
+        raise HTTPException(status_code=400, detail="Indicare almeno uno spettro o una valutazione")
+
+    index = dpi_catalog.get_index()
+    if richiesta.dpi:
+        mancanti = [codice for codice in richiesta.dpi if codice not in index.posizione]
+        if mancanti:
+            raise HTTPException(status_code=404, detail=f"DPI non presenti nel catalogo: {', '.join(mancanti)}")
+        posizioni = [index.posizione[codice] for codice in richiesta.dpi]
+        senza_ottave = [codice for codice, pos in zip(richiesta.dpi, posizioni) if not index.ha_ottave[pos]]
+        if senza_ottave:
+            raise HTTPException(status_code=400, detail=f"DPI senza dati per banda d'ottava: {', '.join(senza_ottave)}")
+    elif richiesta.dpi_personalizzati:
+        posizioni = []
+    else:
+        posizioni = list(np.flatnonzero(index.ha_ottave))
+
+    dpi = [{"codice": index.products[pos]["codice"], "nome": index.products[pos]["nome"]} for pos in posizioni]
+    dpi += [{"codice": None, "nome": d.nome} for d in richiesta.dpi_personalizzati]
+    if not dpi:
+        raise HTTPException(status_code=400, detail="Nessun DPI con dati per banda d'ottava")
+    if len(spettri) * len(dpi) > OTTAVE_MAX_CELLE:
+        raise HTTPException(status_code=413, detail=f"Massimo {OTTAVE_MAX_CELLE} combinazioni spettro x DPI per richiesta")
+
+    mf, sf = index.ottave_mf[posizioni], index.ottave_sf[posizioni]
+    if richiesta.dpi_personalizzati:
+        mf = np.vstack([mf, [d.mf for d in richiesta.dpi_personalizzati]])
+        sf = np.vstack([sf, [d.sf for d in richiesta.dpi_personalizzati]])
+    livelli = np.array([s["livelli"] for s in spettri], dtype=np.float64)
+
+    la = noise_calculations.livello_a(livelli)
+    la_protetto = noise_calculations.livello_a_protetto(livelli, noise_calculations.apv(mf, sf, richiesta.alfa))
+    for spettro, valore in zip(spettri, la):
+        spettro["la"] = round(float(valore), 1)
+
+    risultato = {
+        "bande_hz": list(noise_calculations.OTTAVE_HZ),
+        "alfa": richiesta.alfa,
+        "spettri": spettri,
+        "dpi": dpi,
+        "la_protetto": np.round(la_protetto, 1).tolist(),
+        "pnr": np.round(la[:, None] - la_protetto, 1).tolist(),
+    }
+    if durate is not None and sum(durate) > 0:
+        lex = noise_calculations.lex_8h(la_protetto, durate)
+        risultato["lex_protetto"] = np.round(lex, 1).tolist()
+        risultato["protezione_adeguata"] = [
+            noise_calculations.PROTEZIONE_CLASSI[k] for k in noise_calculations.classe_protezione(lex)
+        ]
+    return risultato
+
+@app.post("/api/admin/dpi-catalog/import", response_model=dict)
+def import_dpi_catalog(file: UploadFile, admin_user: dict = Depends(get_admin_user), conn=Depends(get_db)):
+    """
+    Importa o aggiorna prodotti del catalogo DPI da CSV (colonne codice, nome,
+    produttore, tipo, snr, h, m, l e facoltative mf_63 ... sf_8000)
+    """
+    cursor = conn.cursor()
+    try:
+        result = imports.import_dpi_catalog(cursor, file.file)
+        conn.commit()
+        dpi_catalog.invalidate()
+        return result.to_dict()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        conn.rollback()
+        raise HTTPException(status_code=400, detail=f"File CSV non valido: {e}")
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cursor.close()
+
 # ==================== ENDPOINTS VALUTAZIONI PER AZIENDA ====================
 
 @app.get("/api/aziende/{azienda_id}/esposizione", response_model=List[ValutazioneEsposizione])
@@ -1426,7 +2779,7 @@ def get_azienda_valutazioni_esposizione(azienda_id: int, conn=Depends(get_db)):
         result = []
         for val in valutazioni:
             cursor.execute("""
-                SELECT id, attivita, leq::text, durata::text, lpicco::text
+                SELECT id, attivita, leq::text, durata::text, lpicco::text, spettro_ottave
                 FROM misurazioni WHERE valutazione_id = %s ORDER BY ordine
             """, (val["id"],))
             misurazioni = cursor.fetchall()
@@ -1478,6 +2831,318 @@ def get_azienda_valutazioni_dpi(azienda_id: int, conn=Depends(get_db)):
     finally:
         cursor.close()
 
+# ==================== ENDPOINTS ANALISI ====================
+
+@app.get("/api/analisi")
+def get_analisi_utente(
+    da: Optional[date] = None,
+    a: Optional[date] = None,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Quadro del rischio per azienda: valutazioni per classe di rischio e di
+    protezione, LEX medio e massimo (dagli aggregati mensili, mesi da/a inclusi)
+    """
+    cursor = conn.cursor()
+    try:
+        return {"aziende": analisi_rischio.load_analisi_utente(cursor, current_user["id"], da, a)}
+    finally:
+        cursor.close()
+
+@app.get("/api/aziende/{azienda_id}/analisi")
+def get_analisi_azienda(
+    azienda_id: int,
+    da: Optional[date] = None,
+    a: Optional[date] = None,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """Quadro del rischio di un'azienda: totale, per reparto e andamento mensile"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT user_id FROM aziende WHERE id = %s", (azienda_id,))
+        azienda = cursor.fetchone()
+        if not azienda:
+            raise HTTPException(status_code=404, detail="Azienda non trovata")
+        if azienda["user_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Non autorizzato")
+        return {
+            "azienda_id": azienda_id,
+            **analisi_rischio.load_analisi_azienda(cursor, current_user["id"], azienda_id, da, a),
+        }
+    finally:
+        cursor.close()
+
+# ==================== ENDPOINTS REPORT ====================
+
+def serve_report(conn, current_user: dict, tipo: str, valutazione_id: int, formato: str, if_none_match: Optional[str]):
+    """
+    Genera (o legge dalla cache) il report di una valutazione
+    L'ETag è l'hash del contenuto: il client può rivalidare senza scaricare
+    """
+    cursor = conn.cursor()
+    try:
+        data = reports.load_report_data(cursor, tipo, valutazione_id)
+    finally:
+        cursor.close()
+
+    if not data:
+        raise HTTPException(status_code=404, detail="Valutazione non trovata")
+    if data["valutazione"].get("user_id") != current_user["id"] and not current_user.get("is_admin"):
+        raise HTTPException(status_code=403, detail="Non autorizzato")
+
+    etag = f'"{reports.content_hash(data, formato)}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    try:
+        path, _ = reports.render_report(data, formato)
+    except Exception:
+        logger.exception("Errore generazione report", extra={"tipo": tipo, "valutazione_id": valutazione_id})
+        raise HTTPException(status_code=500, detail="Errore durante la generazione del report")
+
+    return FileResponse(
+        path,
+        media_type=reports.MEDIA_TYPES[formato],
+        filename=reports.report_filename(data, formato),
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+    )
+
+@app.get("/api/esposizione/{valutazione_id}/report.pdf")
+def report_pdf_esposizione(
+    valutazione_id: int,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """Report PDF della valutazione esposizione generato lato server"""
+    return serve_report(conn, current_user, "esposizione", valutazione_id, "pdf", if_none_match)
+
+@app.get("/api/dpi/{valutazione_id}/report.pdf")
+def report_pdf_dpi(
+    valutazione_id: int,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """Report PDF della valutazione DPI generato lato server"""
+    return serve_report(conn, current_user, "dpi", valutazione_id, "pdf", if_none_match)
+
+@app.get("/api/esposizione/{valutazione_id}/report.docx")
+def report_docx_esposizione(
+    valutazione_id: int,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """Report Word della valutazione esposizione generato lato server"""
+    return serve_report(conn, current_user, "esposizione", valutazione_id, "docx", if_none_match)
+
+@app.get("/api/dpi/{valutazione_id}/report.docx")
+def report_docx_dpi(
+    valutazione_id: int,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """Report Word della valutazione DPI generato lato server"""
+    return serve_report(conn, current_user, "dpi", valutazione_id, "docx", if_none_match)
+
+@app.post("/api/valutazioni/{tipo}/{id}/report")
+def allega_report(
+    tipo: Literal["esposizione", "dpi"],
+    id: int,
+    formato: Literal["docx", "pdf"] = "docx",
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """Genera il report e lo allega alla valutazione tra i documenti"""
+    cursor = conn.cursor()
+    try:
+        data = reports.load_report_data(cursor, tipo, id)
+        if not data:
+            raise HTTPException(status_code=404, detail="Valutazione non trovata")
+        if data["valutazione"].get("user_id") != current_user["id"] and not current_user.get("is_admin"):
+            raise HTTPException(status_code=403, detail="Non autorizzato")
+
+        path, key = reports.render_report(data, formato)
+        documento_id = reports.attach_report(cursor, data["valutazione"]["user_id"], data, formato, path, key)
+        conn.commit()
+        return {"documento_id": documento_id, "content_hash": key}
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception:
+        conn.rollback()
+        logger.exception("Errore allegando il report", extra={"tipo": tipo, "valutazione_id": id})
+        raise HTTPException(status_code=500, detail="Errore durante la generazione del report")
+    finally:
+        cursor.close()
+
+# Archivi ZIP dei job di report (rimossi alla scadenza del job)
+REPORT_JOBS_DIR = os.path.join(reports.REPORT_CACHE_DIR, "jobs")
+
+def run_report_job(job: jobs.Job, user_id: int, azienda_id: int, richiesta: ReportJobCreate):
+    """
+    Genera i report di tutte le valutazioni di un'azienda (job di background)
+    I rendering girano in parallelo nel pool di processi; l'archivio ZIP finale
+    raccoglie i file dalla cache
+    """
+    tipi = ["esposizione", "dpi"] if richiesta.tipo == "tutte" else [richiesta.tipo]
+    conn = database.connect()
+    cursor = conn.cursor()
+    try:
+        datasets = reports.load_azienda_report_data(cursor, azienda_id, user_id=user_id, tipi=tipi)
+        conn.commit()
+        job.total = len(datasets)
+
+        archivio = []
+        with ThreadPoolExecutor(max_workers=reports.REPORT_WORKERS) as executor:
+            futures = {executor.submit(reports.render_report, data, richiesta.formato): data for data in datasets}
+            for future in as_completed(futures):
+                data = futures[future]
+                item = {"tipo": data["tipo"], "valutazione_id": data["valutazione"]["id"]}
+                try:
+                    path, key = future.result()
+                    if richiesta.allega:
+                        item["documento_id"] = reports.attach_report(cursor, user_id, data, richiesta.formato, path, key)
+                        conn.commit()
+                    archivio.append((f"{data['tipo']}/{reports.report_filename(data, richiesta.formato)}", path))
+                    job.advance(item=item)
+                except Exception as e:
+                    conn.rollback()
+                    detail = e.detail if isinstance(e, HTTPException) else str(e)
+                    job.advance(error={**item, "error": detail})
+
+        if archivio:
+            os.makedirs(REPORT_JOBS_DIR, exist_ok=True)
+            archive_path = os.path.join(REPORT_JOBS_DIR, f"{job.id}.zip")
+            reports.build_archive(sorted(archivio), archive_path)
+            job.artifact_path = archive_path
+        return {"generati": len(archivio), "errori": len(job.errors)}
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.post("/api/aziende/{azienda_id}/reports", status_code=202)
+def create_report_job(
+    azienda_id: int,
+    richiesta: ReportJobCreate,
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Avvia la generazione in blocco dei report di un'azienda
+    Restituisce subito il job: avanzamento su /api/jobs/{id}, archivio ZIP su
+    /api/jobs/{id}/download
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT user_id FROM aziende WHERE id = %s", (azienda_id,))
+        azienda = cursor.fetchone()
+        if not azienda:
+            raise HTTPException(status_code=404, detail="Azienda non trovata")
+        if azienda["user_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Non autorizzato")
+    finally:
+        cursor.close()
+
+    job = jobs.submit_job(current_user["id"], "report", run_report_job, current_user["id"], azienda_id, richiesta)
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}")
+def get_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Stato e avanzamento di un job di background"""
+    job = jobs.get_job(job_id, current_user["id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/download")
+def download_job_result(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Archivio prodotto da un job completato"""
+    job = jobs.get_job(job_id, current_user["id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    if job.status != "completed" or not job.artifact_path:
+        raise HTTPException(status_code=409, detail="Nessun file disponibile per questo job")
+    return FileResponse(job.artifact_path, media_type="application/zip", filename=f"report_{job.id}.zip")
+
+# ==================== ENDPOINTS EXPORT ====================
+
+@app.get("/api/aziende/{azienda_id}/export.zip")
+def export_azienda_zip(azienda_id: int, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
+    """
+    Archivio ZIP per audit: report PDF di tutte le valutazioni esposizione e
+    DPI dell'azienda più i documenti allegati, generato e inviato in streaming
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT user_id FROM aziende WHERE id = %s", (azienda_id,))
+        azienda = cursor.fetchone()
+        if not azienda:
+            raise HTTPException(status_code=404, detail="Azienda non trovata")
+        if azienda["user_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Non autorizzato")
+    finally:
+        cursor.close()
+
+    return StreamingResponse(
+        exports.stream_azienda_zip(azienda_id, current_user["id"]),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="export_azienda_{azienda_id}.zip"'}
+    )
+
+@app.get("/api/export/{risorsa}")
+def export_dati(
+    risorsa: Literal["aziende", "esposizione", "dpi"],
+    formato: Literal["csv", "ndjson"] = "csv",
+    current_user: dict = Depends(get_current_user),
+    conn=Depends(get_db)
+):
+    """
+    Esporta tutte le aziende / valutazioni dell'utente in CSV o NDJSON
+    Disponibile con i piani che includono feature_export_data
+    """
+    if not current_user.get("is_admin"):
+        cursor = conn.cursor()
+        try:
+            enabled = has_feature(cursor, current_user["id"], "feature_export_data")
+        finally:
+            cursor.close()
+        if not enabled:
+            raise HTTPException(status_code=403, detail="L'esportazione dei dati non è inclusa nel tuo piano")
+
+    return StreamingResponse(
+        exports.stream_export(risorsa, formato, current_user["id"]),
+        media_type=exports.EXPORT_MEDIA_TYPES[formato],
+        headers={"Content-Disposition": f'attachment; filename="{risorsa}.{formato}"'}
+    )
+
+# ==================== ENDPOINTS SYNC ====================
+
+@app.get("/api/sync")
+def sync_modifiche(since: int = 0, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
+    """
+    Aziende e valutazioni create, modificate o eliminate dopo il token `since`
+    (0 = elenco completo). Il client salva il "token" della risposta e lo
+    invia alla sincronizzazione successiva.
+    """
+    if since < 0:
+        raise HTTPException(status_code=400, detail="Token non valido")
+
+    cursor = conn.cursor()
+    try:
+        return sync.load_changes(cursor, current_user["id"], since)
+    except sync.TokenScaduto:
+        raise HTTPException(
+            status_code=410,
+            detail="Token di sincronizzazione scaduto: eseguire una sincronizzazione completa (since=0)"
+        )
+    finally:
+        cursor.close()
+
 # ==================== HEALTH CHECK ====================
 
 @app.get("/health")
@@ -1485,6 +3150,19 @@ def health_check():
     """Health check endpoint"""
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(authorization: Optional[str] = Header(None)):
+    """
+    Metriche in formato Prometheus
+    Se METRICS_TOKEN è impostato richiede 'Authorization: Bearer <token>'
+    """
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if metrics_token and authorization != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=401, detail="Non autorizzato")
+
+    payload, content_type = metrics.render_latest()
+    return Response(content=payload, media_type=content_type)
+
 # ==================== SERVE FRONTEND STATICO ====================
 
 # Monta i file statici del frontend
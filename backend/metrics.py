@@ -0,0 +1,223 @@
+"""
+Metriche Prometheus per il backend
+Espone contatori e istogrammi per richieste HTTP, database, servizi esterni (B2, Stripe, SMTP)
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+import asyncio
+import logging
+import os
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+logger = logging.getLogger(__name__)
+
+# ==================== DEFINIZIONE METRICHE ====================
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "Richieste HTTP servite",
+    ["method", "route", "status"],
+)
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latenza delle richieste HTTP per route template",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Richieste HTTP in corso",
+)
+
+DB_CONNECTIONS_IN_USE = Gauge(
+    "db_connections_in_use",
+    "Connessioni PostgreSQL aperte dal processo",
+)
+
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "Numero di query SQL eseguite per richiesta",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+
+EXTERNAL_CALL_LATENCY = Histogram(
+    "external_call_duration_seconds",
+    "Latenza delle chiamate ai servizi esterni",
+    ["service", "operation", "outcome"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Durata delle singole query SQL per punto di chiamata",
+    ["callsite"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+EMAIL_QUEUE_DEPTH = Gauge(
+    "email_queue_depth",
+    "Email in attesa di consegna al server SMTP",
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Ritardo dell'event loop rispetto al risveglio programmato",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+# ==================== CONTATORE QUERY PER RICHIESTA ====================
+
+# Ripetizioni dello stesso statement in una richiesta segnalate come N+1 (solo debug)
+N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "10"))
+
+# In debug le risposte includono l'header X-Query-Stats (query e tempo SQL)
+SQL_DEBUG = os.getenv("SQL_DEBUG", "").lower() in ("1", "true", "yes")
+
+class RequestStats:
+    """Statistiche accumulate durante una singola richiesta HTTP"""
+    __slots__ = ("queries", "query_time", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        # Conteggio per statement normalizzato, solo in debug (rilevamento N+1)
+        self.statements = {} if SQL_DEBUG else None
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+def get_request_stats() -> Optional[RequestStats]:
+    """Statistiche della richiesta corrente (None fuori da una richiesta)"""
+    return _request_stats.get()
+
+def record_query(duration: float = 0.0) -> Optional[RequestStats]:
+    """Registra una query SQL nella richiesta corrente"""
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_time += duration
+    return stats
+
+# ==================== SERVIZI ESTERNI ====================
+
+@contextmanager
+def track_external(service: str, operation: str):
+    """
+    Misura la durata di una chiamata a un servizio esterno
+
+    Args:
+        service: Nome del servizio (es. "b2", "stripe", "smtp")
+        operation: Operazione eseguita (es. "upload_file")
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        EXTERNAL_CALL_LATENCY.labels(service, operation, outcome).observe(time.perf_counter() - start)
+
+def timed_external(service: str):
+    """Decoratore: misura ogni chiamata della funzione come operazione del servizio"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with track_external(service, func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# ==================== MIDDLEWARE ASGI ====================
+
+class PrometheusMiddleware:
+    """
+    Middleware ASGI puro (nessun BaseHTTPMiddleware) per latenza, conteggio e
+    richieste in corso. Le label usano il template della route (es.
+    /api/aziende/{azienda_id}) per mantenere bassa la cardinalità.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if SQL_DEBUG:
+                    summary = f"count={stats.queries}; time_ms={stats.query_time * 1000:.1f}"
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"x-query-stats", summary.encode("latin-1"))
+                    ]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            _request_stats.reset(token)
+
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+
+            HTTP_REQUESTS.labels(method, route_path, str(status_code)).inc()
+            HTTP_LATENCY.labels(method, route_path).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route_path).observe(stats.queries)
+
+            if stats.statements:
+                for statement, count in stats.statements.items():
+                    if count >= N_PLUS_ONE_THRESHOLD:
+                        logger.warning("Possibile N+1", extra={
+                            "route": f"{method} {route_path}",
+                            "count": count,
+                            "sql": statement,
+                        })
+
+# ==================== EVENT LOOP ====================
+
+# Blocchi dell'event loop oltre questa soglia vengono loggati
+EVENT_LOOP_LAG_THRESHOLD_MS = float(os.getenv("EVENT_LOOP_LAG_THRESHOLD_MS", "100"))
+
+async def monitor_event_loop(interval: float = 0.5):
+    """
+    Task di background che misura quanto l'event loop ritarda i risvegli
+    programmati: un ritardo alto significa che un callback (es. un handler
+    async con I/O sincrono) ha bloccato il loop. Con EVENT_LOOP_DEBUG=1 asyncio
+    logga anche il callback responsabile (modalità debug, più costosa).
+    """
+    loop = asyncio.get_running_loop()
+    threshold = EVENT_LOOP_LAG_THRESHOLD_MS / 1000
+    if os.getenv("EVENT_LOOP_DEBUG", "").lower() in ("1", "true", "yes"):
+        loop.set_debug(True)
+        loop.slow_callback_duration = threshold
+
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - expected, 0.0)
+        EVENT_LOOP_LAG.observe(lag)
+        if lag >= threshold:
+            logger.warning("Event loop bloccato", extra={"lag_ms": round(lag * 1000, 1)})
+
+def render_latest():
+    """Restituisce (payload, content_type) nel formato di esposizione Prometheus"""
+    return generate_latest(), CONTENT_TYPE_LATEST
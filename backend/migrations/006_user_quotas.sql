@@ -0,0 +1,187 @@
+-- ============================================================
+-- Migration 006: Quote abbonamento con contatori incrementali
+-- Descrizione: Limiti del piano copiati per utente e contatori di utilizzo,
+--              così la verifica "l'utente può creare X?" è un singolo
+--              UPDATE condizionale sulla riga dell'utente, senza JOIN.
+-- ============================================================
+
+-- Colonne usate da register() e check_trial_expired() (introdotte dalla 005)
+ALTER TABLE user_subscriptions ADD COLUMN IF NOT EXISTS trial_ends_at TIMESTAMP;
+ALTER TABLE user_subscriptions ADD COLUMN IF NOT EXISTS is_trial BOOLEAN DEFAULT false;
+
+-- Dimensione dei file archiviati (per la quota storage)
+ALTER TABLE documenti ADD COLUMN IF NOT EXISTS dimensione_bytes BIGINT DEFAULT 0;
+
+-- ============================================================
+-- TABELLA: user_quotas
+-- Descrizione: Una riga per utente con i limiti del piano attivo
+--              (cache denormalizzata) e i contatori di utilizzo
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS user_quotas (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    plan_id INTEGER REFERENCES subscription_plans(id),
+
+    -- Abbonamento trial/active presente e relativa scadenza (solo trial)
+    attiva BOOLEAN NOT NULL DEFAULT FALSE,
+    scadenza TIMESTAMP,
+
+    -- Limiti del piano (NULL = illimitato)
+    max_valutazioni_esposizione_month INTEGER,
+    max_valutazioni_dpi_month INTEGER,
+    max_aziende INTEGER,
+    storage_mb INTEGER,
+
+    -- Contatori mensili (azzerati al cambio di mese da consuma_quota)
+    periodo_inizio DATE NOT NULL DEFAULT date_trunc('month', CURRENT_DATE)::date,
+    usage_valutazioni_esposizione INTEGER NOT NULL DEFAULT 0,
+    usage_valutazioni_dpi INTEGER NOT NULL DEFAULT 0,
+
+    -- Contatori assoluti
+    usage_aziende INTEGER NOT NULL DEFAULT 0,
+    usage_storage_bytes BIGINT NOT NULL DEFAULT 0,
+
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE user_quotas IS 'Limiti del piano attivo e contatori di utilizzo per utente (verifica quote O(1))';
+
+-- ============================================================
+-- FUNZIONE: refresh_user_quota
+-- Descrizione: Ricopia i limiti dal piano dell'abbonamento trial/active
+--              più recente. Eseguita solo quando cambia l'abbonamento o il piano.
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION refresh_user_quota(p_user_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_sub RECORD;
+    v_found BOOLEAN;
+BEGIN
+    SELECT
+        us.plan_id,
+        CASE WHEN us.is_trial THEN us.trial_ends_at END AS scadenza,
+        sp.max_valutazioni_esposizione_month,
+        sp.max_valutazioni_dpi_month,
+        sp.max_aziende,
+        sp.storage_mb
+    INTO v_sub
+    FROM user_subscriptions us
+    JOIN subscription_plans sp ON us.plan_id = sp.id
+    WHERE us.user_id = p_user_id
+      AND us.status IN ('trial', 'active')
+    ORDER BY us.created_at DESC
+    LIMIT 1;
+    v_found := FOUND;
+
+    INSERT INTO user_quotas (user_id) VALUES (p_user_id)
+    ON CONFLICT (user_id) DO NOTHING;
+
+    UPDATE user_quotas
+    SET
+        plan_id = v_sub.plan_id,
+        attiva = v_found,
+        scadenza = v_sub.scadenza,
+        max_valutazioni_esposizione_month = v_sub.max_valutazioni_esposizione_month,
+        max_valutazioni_dpi_month = v_sub.max_valutazioni_dpi_month,
+        max_aziende = v_sub.max_aziende,
+        storage_mb = v_sub.storage_mb,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE user_id = p_user_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_user_subscriptions_quota()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_user_quota(NEW.user_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_subscriptions_quota ON user_subscriptions;
+CREATE TRIGGER user_subscriptions_quota
+    AFTER INSERT OR UPDATE OF plan_id, status, is_trial, trial_ends_at ON user_subscriptions
+    FOR EACH ROW EXECUTE FUNCTION trg_user_subscriptions_quota();
+
+CREATE OR REPLACE FUNCTION trg_subscription_plans_quota()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE user_quotas
+    SET
+        max_valutazioni_esposizione_month = NEW.max_valutazioni_esposizione_month,
+        max_valutazioni_dpi_month = NEW.max_valutazioni_dpi_month,
+        max_aziende = NEW.max_aziende,
+        storage_mb = NEW.storage_mb,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE plan_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS subscription_plans_quota ON subscription_plans;
+CREATE TRIGGER subscription_plans_quota
+    AFTER UPDATE OF max_valutazioni_esposizione_month, max_valutazioni_dpi_month, max_aziende, storage_mb
+    ON subscription_plans
+    FOR EACH ROW EXECUTE FUNCTION trg_subscription_plans_quota();
+
+-- ============================================================
+-- RILASCIO QUOTE
+-- Descrizione: Le eliminazioni (anche in CASCADE) restituiscono la quota
+--              di aziende e storage. Le valutazioni sono quote mensili di
+--              creazione e non vengono restituite.
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION trg_aziende_release_quota()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE user_quotas
+    SET usage_aziende = GREATEST(usage_aziende - 1, 0)
+    WHERE user_id = OLD.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS aziende_release_quota ON aziende;
+CREATE TRIGGER aziende_release_quota
+    AFTER DELETE ON aziende
+    FOR EACH ROW EXECUTE FUNCTION trg_aziende_release_quota();
+
+CREATE OR REPLACE FUNCTION trg_documenti_release_quota()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF COALESCE(OLD.dimensione_bytes, 0) > 0 THEN
+        UPDATE user_quotas
+        SET usage_storage_bytes = GREATEST(usage_storage_bytes - OLD.dimensione_bytes, 0)
+        WHERE user_id = OLD.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS documenti_release_quota ON documenti;
+CREATE TRIGGER documenti_release_quota
+    AFTER DELETE ON documenti
+    FOR EACH ROW EXECUTE FUNCTION trg_documenti_release_quota();
+
+-- ============================================================
+-- POPOLAMENTO INIZIALE
+-- ============================================================
+
+SELECT refresh_user_quota(id) FROM users;
+
+UPDATE user_quotas q
+SET
+    periodo_inizio = date_trunc('month', CURRENT_DATE)::date,
+    usage_aziende = (SELECT COUNT(*) FROM aziende a WHERE a.user_id = q.user_id),
+    usage_valutazioni_esposizione = (
+        SELECT COUNT(*) FROM valutazioni_esposizione ve
+        WHERE ve.user_id = q.user_id AND ve.created_at >= date_trunc('month', CURRENT_DATE)
+    ),
+    usage_valutazioni_dpi = (
+        SELECT COUNT(*) FROM valutazioni_dpi vd
+        WHERE vd.user_id = q.user_id AND vd.created_at >= date_trunc('month', CURRENT_DATE)
+    ),
+    usage_storage_bytes = (
+        SELECT COALESCE(SUM(d.dimensione_bytes), 0) FROM documenti d WHERE d.user_id = q.user_id
+    );
@@ -0,0 +1,117 @@
+-- ============================================================
+-- Migration 007: Statistiche per utente materializzate
+-- Descrizione: Conteggi di aziende e valutazioni per utente mantenuti dai
+--              trigger, letti dalla lista utenti admin al posto dei
+--              LEFT JOIN + COUNT(DISTINCT) su tutte le tabelle.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    num_aziende INTEGER NOT NULL DEFAULT 0,
+    num_valutazioni_esposizione INTEGER NOT NULL DEFAULT 0,
+    num_valutazioni_dpi INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE user_stats IS 'Conteggi per utente mantenuti dai trigger (lista utenti admin)';
+
+-- Indici per l'ordinamento paginato della lista admin
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_users_last_login ON users(last_login DESC);
+CREATE INDEX IF NOT EXISTS idx_user_stats_aziende ON user_stats(num_aziende DESC);
+CREATE INDEX IF NOT EXISTS idx_user_stats_esposizione ON user_stats(num_valutazioni_esposizione DESC);
+CREATE INDEX IF NOT EXISTS idx_user_stats_dpi ON user_stats(num_valutazioni_dpi DESC);
+
+-- ============================================================
+-- TRIGGER
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION trg_users_stats_row()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_stats (user_id) VALUES (NEW.id)
+    ON CONFLICT (user_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_stats_row ON users;
+CREATE TRIGGER users_stats_row
+    AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION trg_users_stats_row();
+
+-- TG_ARGV[0] = colonna di user_stats da aggiornare
+CREATE OR REPLACE FUNCTION trg_user_stats_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.user_id IS NOT NULL THEN
+        EXECUTE format(
+            'INSERT INTO user_stats (user_id, %1$I) VALUES ($1, 1)
+             ON CONFLICT (user_id) DO UPDATE
+             SET %1$I = user_stats.%1$I + 1, updated_at = CURRENT_TIMESTAMP',
+            TG_ARGV[0]
+        ) USING NEW.user_id;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') AND OLD.user_id IS NOT NULL THEN
+        EXECUTE format(
+            'UPDATE user_stats
+             SET %1$I = GREATEST(%1$I - 1, 0), updated_at = CURRENT_TIMESTAMP
+             WHERE user_id = $1',
+            TG_ARGV[0]
+        ) USING OLD.user_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS aziende_user_stats ON aziende;
+CREATE TRIGGER aziende_user_stats
+    AFTER INSERT OR DELETE ON aziende
+    FOR EACH ROW EXECUTE FUNCTION trg_user_stats_count('num_aziende');
+
+DROP TRIGGER IF EXISTS aziende_user_stats_owner ON aziende;
+CREATE TRIGGER aziende_user_stats_owner
+    AFTER UPDATE OF user_id ON aziende
+    FOR EACH ROW WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id)
+    EXECUTE FUNCTION trg_user_stats_count('num_aziende');
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_user_stats ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_user_stats
+    AFTER INSERT OR DELETE ON valutazioni_esposizione
+    FOR EACH ROW EXECUTE FUNCTION trg_user_stats_count('num_valutazioni_esposizione');
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_user_stats_owner ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_user_stats_owner
+    AFTER UPDATE OF user_id ON valutazioni_esposizione
+    FOR EACH ROW WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id)
+    EXECUTE FUNCTION trg_user_stats_count('num_valutazioni_esposizione');
+
+DROP TRIGGER IF EXISTS valutazioni_dpi_user_stats ON valutazioni_dpi;
+CREATE TRIGGER valutazioni_dpi_user_stats
+    AFTER INSERT OR DELETE ON valutazioni_dpi
+    FOR EACH ROW EXECUTE FUNCTION trg_user_stats_count('num_valutazioni_dpi');
+
+DROP TRIGGER IF EXISTS valutazioni_dpi_user_stats_owner ON valutazioni_dpi;
+CREATE TRIGGER valutazioni_dpi_user_stats_owner
+    AFTER UPDATE OF user_id ON valutazioni_dpi
+    FOR EACH ROW WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id)
+    EXECUTE FUNCTION trg_user_stats_count('num_valutazioni_dpi');
+
+-- ============================================================
+-- POPOLAMENTO INIZIALE
+-- ============================================================
+
+INSERT INTO user_stats (user_id, num_aziende, num_valutazioni_esposizione, num_valutazioni_dpi)
+SELECT
+    u.id,
+    (SELECT COUNT(*) FROM aziende a WHERE a.user_id = u.id),
+    (SELECT COUNT(*) FROM valutazioni_esposizione ve WHERE ve.user_id = u.id),
+    (SELECT COUNT(*) FROM valutazioni_dpi vd WHERE vd.user_id = u.id)
+FROM users u
+ON CONFLICT (user_id) DO UPDATE SET
+    num_aziende = EXCLUDED.num_aziende,
+    num_valutazioni_esposizione = EXCLUDED.num_valutazioni_esposizione,
+    num_valutazioni_dpi = EXCLUDED.num_valutazioni_dpi,
+    updated_at = CURRENT_TIMESTAMP;
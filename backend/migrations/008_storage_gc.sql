@@ -0,0 +1,37 @@
+-- ============================================================
+-- Migration 008: Garbage collection degli oggetti B2 orfani
+-- Descrizione: Stato delle esecuzioni del reaper (checkpoint per la
+--              ripresa e report del dry-run) e indice sulla chiave
+--              dell'oggetto ricavata da documenti.url.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS storage_gc_runs (
+    id SERIAL PRIMARY KEY,
+    dry_run BOOLEAN NOT NULL DEFAULT TRUE,
+    -- running / paused / completed / failed
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+
+    -- Ultima chiave elaborata: la ripresa riparte da qui (StartAfter)
+    last_key TEXT,
+
+    scanned_objects INTEGER NOT NULL DEFAULT 0,
+    orphaned_objects INTEGER NOT NULL DEFAULT 0,
+    orphaned_bytes BIGINT NOT NULL DEFAULT 0,
+    deleted_objects INTEGER NOT NULL DEFAULT 0,
+    failed_objects INTEGER NOT NULL DEFAULT 0,
+
+    -- Campione delle chiavi orfane (report del dry-run) ed eventuale errore
+    orphan_sample JSONB NOT NULL DEFAULT '[]'::jsonb,
+    error TEXT,
+
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_storage_gc_runs_status ON storage_gc_runs(dry_run, status, id DESC);
+
+COMMENT ON TABLE storage_gc_runs IS 'Esecuzioni della garbage collection degli oggetti B2 non referenziati';
+
+-- Chiave dell'oggetto nel bucket = ultimo segmento di documenti.url
+CREATE INDEX IF NOT EXISTS idx_documenti_file_key ON documenti ((regexp_replace(url, '^.*/', '')));
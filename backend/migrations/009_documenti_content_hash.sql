@@ -0,0 +1,13 @@
+-- ============================================================
+-- Migration 009: Hash del contenuto dei documenti generati
+-- Descrizione: I report generati lato server e allegati alla valutazione
+--              registrano l'hash del contenuto, così lo stesso report non
+--              viene caricato due volte.
+-- ============================================================
+
+ALTER TABLE documenti ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_documenti_esposizione_hash
+    ON documenti(valutazione_esposizione_id, content_hash) WHERE content_hash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_documenti_dpi_hash
+    ON documenti(valutazione_dpi_id, content_hash) WHERE content_hash IS NOT NULL;
@@ -0,0 +1,21 @@
+-- ============================================================
+-- Migration 010: Chiavi di idempotenza
+-- Descrizione: Le richieste con header Idempotency-Key (es. il batch delle
+--              valutazioni esposizione) registrano la risposta nella stessa
+--              transazione delle scritture; un nuovo invio con la stessa
+--              chiave restituisce la risposta salvata senza duplicare dati.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    key VARCHAR(255) NOT NULL,
+    endpoint VARCHAR(100) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    response JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, key)
+);
+
+COMMENT ON TABLE idempotency_keys IS 'Risposte salvate per le richieste con Idempotency-Key (scadenza IDEMPOTENCY_TTL_HOURS)';
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(user_id, created_at);
@@ -0,0 +1,126 @@
+-- ============================================================
+-- Migration 011: Sincronizzazione incrementale
+-- Descrizione: Ogni scrittura su aziende e valutazioni registra l'id della
+--              transazione (sync_xid) e aggiorna updated_at; le eliminazioni
+--              lasciano una riga in sync_tombstones. GET /api/sync restituisce
+--              solo le modifiche successive al token del client.
+--              Richiede PostgreSQL 13+ (pg_current_xact_id).
+-- ============================================================
+
+-- updated_at sulle valutazioni (aziende lo ha già): le righe esistenti partono da created_at
+ALTER TABLE valutazioni_esposizione ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+UPDATE valutazioni_esposizione SET updated_at = created_at WHERE updated_at IS NULL;
+ALTER TABLE valutazioni_esposizione ALTER COLUMN updated_at SET DEFAULT CURRENT_TIMESTAMP;
+
+ALTER TABLE valutazioni_dpi ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+UPDATE valutazioni_dpi SET updated_at = created_at WHERE updated_at IS NULL;
+ALTER TABLE valutazioni_dpi ALTER COLUMN updated_at SET DEFAULT CURRENT_TIMESTAMP;
+
+-- Transazione dell'ultima scrittura (NULL = precedente alla migrazione)
+ALTER TABLE aziende ADD COLUMN IF NOT EXISTS sync_xid BIGINT;
+ALTER TABLE valutazioni_esposizione ADD COLUMN IF NOT EXISTS sync_xid BIGINT;
+ALTER TABLE valutazioni_dpi ADD COLUMN IF NOT EXISTS sync_xid BIGINT;
+
+CREATE INDEX IF NOT EXISTS idx_aziende_sync ON aziende(user_id, sync_xid);
+CREATE INDEX IF NOT EXISTS idx_valutazioni_esposizione_sync ON valutazioni_esposizione(user_id, sync_xid);
+CREATE INDEX IF NOT EXISTS idx_valutazioni_dpi_sync ON valutazioni_dpi(user_id, sync_xid);
+
+-- Righe eliminate (o passate a un altro utente), conservate
+-- SYNC_TOMBSTONE_RETENTION_DAYS giorni. Senza FK su users: le eliminazioni
+-- a cascata dell'utente scrivono qui mentre la riga in users sparisce.
+CREATE TABLE IF NOT EXISTS sync_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    risorsa VARCHAR(20) NOT NULL,
+    record_id INTEGER NOT NULL,
+    sync_xid BIGINT NOT NULL DEFAULT (pg_current_xact_id()::text::bigint),
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_user ON sync_tombstones(user_id, sync_xid);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted_at ON sync_tombstones(deleted_at);
+
+-- Token più alto tra le lapidi già eliminate: un token precedente richiede
+-- una sincronizzazione completa
+CREATE TABLE IF NOT EXISTS sync_horizon (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    purged_xid BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO sync_horizon DEFAULT VALUES ON CONFLICT (id) DO NOTHING;
+
+COMMENT ON TABLE sync_tombstones IS 'Eliminazioni per la sincronizzazione incrementale (GET /api/sync)';
+
+-- ============================================================
+-- TRIGGER
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION trg_sync_touch()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.sync_xid := pg_current_xact_id()::text::bigint;
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := CURRENT_TIMESTAMP;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TG_ARGV[0] = risorsa di /api/sync
+CREATE OR REPLACE FUNCTION trg_sync_tombstone()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF OLD.user_id IS NOT NULL THEN
+        INSERT INTO sync_tombstones (user_id, risorsa, record_id)
+        VALUES (OLD.user_id, TG_ARGV[0], OLD.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS aziende_sync_touch ON aziende;
+CREATE TRIGGER aziende_sync_touch
+    BEFORE INSERT OR UPDATE ON aziende
+    FOR EACH ROW EXECUTE FUNCTION trg_sync_touch();
+
+DROP TRIGGER IF EXISTS aziende_sync_tombstone ON aziende;
+CREATE TRIGGER aziende_sync_tombstone
+    AFTER DELETE ON aziende
+    FOR EACH ROW EXECUTE FUNCTION trg_sync_tombstone('aziende');
+
+DROP TRIGGER IF EXISTS aziende_sync_tombstone_owner ON aziende;
+CREATE TRIGGER aziende_sync_tombstone_owner
+    AFTER UPDATE OF user_id ON aziende
+    FOR EACH ROW WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id)
+    EXECUTE FUNCTION trg_sync_tombstone('aziende');
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_sync_touch ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_sync_touch
+    BEFORE INSERT OR UPDATE ON valutazioni_esposizione
+    FOR EACH ROW EXECUTE FUNCTION trg_sync_touch();
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_sync_tombstone ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_sync_tombstone
+    AFTER DELETE ON valutazioni_esposizione
+    FOR EACH ROW EXECUTE FUNCTION trg_sync_tombstone('esposizione');
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_sync_tombstone_owner ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_sync_tombstone_owner
+    AFTER UPDATE OF user_id ON valutazioni_esposizione
+    FOR EACH ROW WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id)
+    EXECUTE FUNCTION trg_sync_tombstone('esposizione');
+
+DROP TRIGGER IF EXISTS valutazioni_dpi_sync_touch ON valutazioni_dpi;
+CREATE TRIGGER valutazioni_dpi_sync_touch
+    BEFORE INSERT OR UPDATE ON valutazioni_dpi
+    FOR EACH ROW EXECUTE FUNCTION trg_sync_touch();
+
+DROP TRIGGER IF EXISTS valutazioni_dpi_sync_tombstone ON valutazioni_dpi;
+CREATE TRIGGER valutazioni_dpi_sync_tombstone
+    AFTER DELETE ON valutazioni_dpi
+    FOR EACH ROW EXECUTE FUNCTION trg_sync_tombstone('dpi');
+
+DROP TRIGGER IF EXISTS valutazioni_dpi_sync_tombstone_owner ON valutazioni_dpi;
+CREATE TRIGGER valutazioni_dpi_sync_tombstone_owner
+    AFTER UPDATE OF user_id ON valutazioni_dpi
+    FOR EACH ROW WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id)
+    EXECUTE FUNCTION trg_sync_tombstone('dpi');
@@ -0,0 +1,48 @@
+-- ============================================================
+-- Migration 012: Catalogo DPI uditivi
+-- Descrizione: Prodotti con valori SNR/H/M/L dichiarati e, se disponibili,
+--              attenuazione media e deviazione standard per banda d'ottava
+--              (63-8000 Hz, 8 valori). Caricato con l'import CSV admin e
+--              indicizzato in memoria per la ricerca (dpi_catalog.py).
+--              codice coincide con le chiavi di src/data/dpiDatabase.ts,
+--              quindi valutazioni_dpi.dpi_selezionato resta compatibile.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS dpi_catalog (
+    id SERIAL PRIMARY KEY,
+    codice VARCHAR(100) NOT NULL UNIQUE,
+    nome VARCHAR(255) NOT NULL,
+    produttore VARCHAR(100),
+    tipo VARCHAR(30),
+    snr DECIMAL(4,1) NOT NULL,
+    h DECIMAL(4,1) NOT NULL,
+    m DECIMAL(4,1) NOT NULL,
+    l DECIMAL(4,1) NOT NULL,
+    ottave_mf REAL[] CHECK (ottave_mf IS NULL OR array_length(ottave_mf, 1) = 8),
+    ottave_sf REAL[] CHECK (ottave_sf IS NULL OR array_length(ottave_sf, 1) = 8),
+    attivo BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE dpi_catalog IS 'Catalogo DPI uditivi (HML/SNR e dati per banda d''ottava)';
+
+DROP TRIGGER IF EXISTS update_dpi_catalog_updated_at ON dpi_catalog;
+CREATE TRIGGER update_dpi_catalog_updated_at
+    BEFORE UPDATE ON dpi_catalog
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Prodotti del database client (src/data/dpiDatabase.ts)
+INSERT INTO dpi_catalog (codice, nome, produttore, tipo, snr, h, m, l) VALUES
+    ('3m_classic_small', '3M E-A-R Classic Small', '3M', 'tappi', 28, 30, 24, 22),
+    ('3m_classic', '3M E-A-R Classic', '3M', 'tappi', 28, 30, 24, 22),
+    ('3m_classic_regular', '3M E-A-R Classic Regular', '3M', 'tappi', 31, 32, 28, 26),
+    ('3m_yellow_neons', '3M E-A-Rsoft Yellow Neons', '3M', 'tappi', 34, 33, 33, 30),
+    ('3m_1100', '3M 1100', '3M', 'tappi', 35, 33, 33, 31),
+    ('3m_1110', '3M 1110 con cordino', '3M', 'tappi', 35, 33, 33, 31),
+    ('3m_soft_fx', '3M E-A-Rsoft FX', '3M', 'tappi', 37, 35, 35, 32),
+    ('peltor_optime1', '3M Peltor Optime I', '3M', 'cuffie', 27, 30, 26, 17),
+    ('peltor_optime2', '3M Peltor Optime II', '3M', 'cuffie', 31, 34, 31, 23),
+    ('peltor_optime3', '3M Peltor Optime III', '3M', 'cuffie', 35, 37, 34, 26),
+    ('peltor_x5', '3M Peltor X5A', '3M', 'cuffie', 37, 37, 36, 33)
+ON CONFLICT (codice) DO NOTHING;
@@ -0,0 +1,11 @@
+-- ============================================================
+-- Migration 013: Spettri per bande d'ottava delle misurazioni
+-- Descrizione: Livelli non ponderati (dB) nelle 8 bande d'ottava
+--              63-8000 Hz, facoltativi, per il metodo per bande d'ottava
+--              della EN ISO 4869-2 (rumore tonale o a bassa frequenza).
+-- ============================================================
+
+ALTER TABLE misurazioni ADD COLUMN IF NOT EXISTS spettro_ottave REAL[]
+    CHECK (spettro_ottave IS NULL OR array_length(spettro_ottave, 1) = 8);
+
+COMMENT ON COLUMN misurazioni.spettro_ottave IS 'Livelli non ponderati dB per banda 63, 125, 250, 500, 1k, 2k, 4k, 8k Hz';
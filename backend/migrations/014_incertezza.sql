@@ -0,0 +1,47 @@
+-- ============================================================
+-- Migration 014: Incertezza di misura del LEX (UNI EN ISO 9612)
+-- Descrizione: Incertezza estesa U (copertura unilaterale 95%) e
+--              probabilità che il LEX superi 80, 85 e 87 dB(A), calcolate
+--              da POST /api/esposizione/{id}/incertezza. Qualsiasi altra
+--              modifica della valutazione le azzera: misurazioni cambiate
+--              richiedono un nuovo calcolo.
+-- ============================================================
+
+ALTER TABLE valutazioni_esposizione
+    ADD COLUMN IF NOT EXISTS incertezza_u DECIMAL(4,2),
+    ADD COLUMN IF NOT EXISTS incertezza_estesa DECIMAL(4,2),
+    ADD COLUMN IF NOT EXISTS prob_superamento_80 DECIMAL(5,4),
+    ADD COLUMN IF NOT EXISTS prob_superamento_85 DECIMAL(5,4),
+    ADD COLUMN IF NOT EXISTS prob_superamento_87 DECIMAL(5,4),
+    ADD COLUMN IF NOT EXISTS incertezza_metodo VARCHAR(20),
+    ADD COLUMN IF NOT EXISTS incertezza_parametri JSONB,
+    ADD COLUMN IF NOT EXISTS incertezza_calcolata_at TIMESTAMP;
+
+COMMENT ON COLUMN valutazioni_esposizione.incertezza_estesa IS 'U dB(A) del LEX, fattore di copertura 1.65 (ISO 9612)';
+COMMENT ON COLUMN valutazioni_esposizione.incertezza_parametri IS 'u1a, u2, u3, u1b e campioni usati nel calcolo';
+
+-- ============================================================
+-- TRIGGER
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION trg_incertezza_reset()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.incertezza_calcolata_at IS NOT DISTINCT FROM OLD.incertezza_calcolata_at THEN
+        NEW.incertezza_u := NULL;
+        NEW.incertezza_estesa := NULL;
+        NEW.prob_superamento_80 := NULL;
+        NEW.prob_superamento_85 := NULL;
+        NEW.prob_superamento_87 := NULL;
+        NEW.incertezza_metodo := NULL;
+        NEW.incertezza_parametri := NULL;
+        NEW.incertezza_calcolata_at := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_incertezza_reset ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_incertezza_reset
+    BEFORE UPDATE ON valutazioni_esposizione
+    FOR EACH ROW EXECUTE FUNCTION trg_incertezza_reset();
@@ -0,0 +1,15 @@
+-- ============================================================
+-- Migration 015: Data di misura delle valutazioni esposizione
+-- Descrizione: Giorno lavorativo a cui si riferisce il LEX,8h, usato per
+--              il livello settimanale LEX,w (GET /api/esposizione/settimanale).
+--              Le valutazioni esistenti prendono la data di creazione.
+-- ============================================================
+
+ALTER TABLE valutazioni_esposizione ADD COLUMN IF NOT EXISTS data_misura DATE;
+UPDATE valutazioni_esposizione SET data_misura = created_at::date WHERE data_misura IS NULL;
+ALTER TABLE valutazioni_esposizione ALTER COLUMN data_misura SET DEFAULT CURRENT_DATE;
+
+CREATE INDEX IF NOT EXISTS idx_valutazioni_esposizione_gruppo
+    ON valutazioni_esposizione(user_id, azienda_id, mansione, reparto, data_misura);
+
+COMMENT ON COLUMN valutazioni_esposizione.data_misura IS 'Giorno della misura (LEX,8h giornaliero)';
@@ -0,0 +1,48 @@
+-- ============================================================
+-- Migration 016: Serie temporali grezze delle valutazioni esposizione
+-- Descrizione: Le time history degli strumenti (Leq/Lpicco per campione)
+--              sono oggetti binari nello storage (prefisso serie/), non
+--              righe SQL: la valutazione ne conserva chiave e dimensioni.
+--              La dimensione è conteggiata nella quota storage e restituita
+--              quando la serie viene sostituita o la valutazione eliminata.
+-- ============================================================
+
+ALTER TABLE valutazioni_esposizione
+    ADD COLUMN IF NOT EXISTS serie_key VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS serie_bytes BIGINT,
+    ADD COLUMN IF NOT EXISTS serie_campioni INTEGER,
+    ADD COLUMN IF NOT EXISTS serie_intervallo REAL;
+
+-- Usato dalla garbage collection dello storage
+CREATE INDEX IF NOT EXISTS idx_valutazioni_esposizione_serie_key
+    ON valutazioni_esposizione(serie_key) WHERE serie_key IS NOT NULL;
+
+COMMENT ON COLUMN valutazioni_esposizione.serie_key IS 'Chiave nello storage della time history (serie/<uuid>.srt)';
+COMMENT ON COLUMN valutazioni_esposizione.serie_intervallo IS 'Secondi tra due campioni della time history';
+
+-- ============================================================
+-- TRIGGER
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION trg_serie_release_quota()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF COALESCE(OLD.serie_bytes, 0) > 0 THEN
+        UPDATE user_quotas
+        SET usage_storage_bytes = GREATEST(usage_storage_bytes - OLD.serie_bytes, 0)
+        WHERE user_id = OLD.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_serie_release_quota ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_serie_release_quota
+    AFTER DELETE ON valutazioni_esposizione
+    FOR EACH ROW EXECUTE FUNCTION trg_serie_release_quota();
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_serie_replace_quota ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_serie_replace_quota
+    AFTER UPDATE OF serie_key ON valutazioni_esposizione
+    FOR EACH ROW WHEN (OLD.serie_key IS DISTINCT FROM NEW.serie_key)
+    EXECUTE FUNCTION trg_serie_release_quota();
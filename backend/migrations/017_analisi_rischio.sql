@@ -0,0 +1,271 @@
+-- ============================================================
+-- Migration 017: Aggregati mensili del rischio per azienda e reparto
+-- Descrizione: Conteggi per classe di rischio / protezione, somme per le
+--              medie e LEX massimo per (utente, azienda, reparto, mese),
+--              mantenuti da trigger per istruzione sulle tabelle delle
+--              valutazioni. Le dashboard (GET /api/analisi...) leggono solo
+--              queste righe invece di scorrere tutte le valutazioni.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS analisi_rischio_mensile (
+    user_id INTEGER NOT NULL,                   -- senza FK: vedi trg_analisi_esposizione
+    azienda_id INTEGER NOT NULL DEFAULT 0,      -- 0 = valutazioni senza azienda
+    reparto VARCHAR(255) NOT NULL DEFAULT '',
+    mese DATE NOT NULL,                         -- primo giorno del mese
+    -- Valutazioni esposizione (classi come getClasseRischio, solo LEX > 0)
+    n_esposizione INTEGER NOT NULL DEFAULT 0,
+    n_minimo INTEGER NOT NULL DEFAULT 0,
+    n_medio INTEGER NOT NULL DEFAULT 0,
+    n_rilevante INTEGER NOT NULL DEFAULT 0,
+    n_alto INTEGER NOT NULL DEFAULT 0,
+    somma_lex DOUBLE PRECISION NOT NULL DEFAULT 0,
+    somma_energia DOUBLE PRECISION NOT NULL DEFAULT 0,   -- Σ 10^(LEX/10)
+    lex_max DECIMAL(5,2),
+    -- Valutazioni DPI (classi di protezione del client, solo L'eff > 0)
+    n_dpi INTEGER NOT NULL DEFAULT 0,
+    n_eccessiva INTEGER NOT NULL DEFAULT 0,
+    n_buona INTEGER NOT NULL DEFAULT 0,
+    n_ottimale INTEGER NOT NULL DEFAULT 0,
+    n_accettabile INTEGER NOT NULL DEFAULT 0,
+    n_insufficiente INTEGER NOT NULL DEFAULT 0,
+    somma_leff DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, azienda_id, reparto, mese)
+);
+
+COMMENT ON TABLE analisi_rischio_mensile IS 'Aggregati mensili per azienda/reparto mantenuti dai trigger (dashboard di rischio)';
+
+-- ============================================================
+-- TRIGGER
+-- Un trigger per istruzione con tabelle di transizione: un batch di
+-- centinaia di righe è un solo upsert raggruppato per chiave. Negli UPDATE
+-- contano solo le righe in cui chiave o valore sono cambiati.
+-- ============================================================
+
+-- SQL delle righe uscite (segno -1) ed entrate (segno +1) per l'operazione;
+-- negli UPDATE solo le righe in cui cambia una delle colonne indicate
+CREATE OR REPLACE FUNCTION analisi_rischio_righe(op TEXT, colonne TEXT)
+RETURNS TEXT AS $$
+    SELECT CASE op
+        WHEN 'INSERT' THEN 'SELECT n.*, 1 AS segno FROM nuove n'
+        WHEN 'DELETE' THEN 'SELECT o.*, -1 AS segno FROM vecchie o'
+        ELSE format(
+            'SELECT o.*, -1 AS segno FROM vecchie o JOIN nuove n USING (id) WHERE (%1$s) IS DISTINCT FROM (%2$s)
+             UNION ALL
+             SELECT n.*, 1 AS segno FROM nuove n JOIN vecchie o USING (id) WHERE (%1$s) IS DISTINCT FROM (%2$s)',
+            regexp_replace(colonne, '(\w+)', 'o.\1', 'g'),
+            regexp_replace(colonne, '(\w+)', 'n.\1', 'g')
+        )
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION trg_analisi_esposizione()
+RETURNS TRIGGER AS $$
+BEGIN
+    EXECUTE format($sql$
+        INSERT INTO analisi_rischio_mensile AS a (
+            user_id, azienda_id, reparto, mese, n_esposizione,
+            n_minimo, n_medio, n_rilevante, n_alto, somma_lex, somma_energia, lex_max
+        )
+        SELECT
+            r.user_id, COALESCE(r.azienda_id, 0), COALESCE(r.reparto, ''),
+            date_trunc('month', COALESCE(r.data_misura, r.created_at::date))::date,
+            SUM(r.segno),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.lex > 0 AND r.lex < 80), 0),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.lex >= 80 AND r.lex < 85), 0),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.lex >= 85 AND r.lex < 87), 0),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.lex >= 87), 0),
+            COALESCE(SUM(r.segno * r.lex::float8) FILTER (WHERE r.lex > 0), 0),
+            COALESCE(SUM(r.segno * power(10, r.lex::float8 / 10)) FILTER (WHERE r.lex > 0), 0),
+            MAX(r.lex) FILTER (WHERE r.segno > 0 AND r.lex > 0)
+        FROM (%s) r
+        WHERE r.user_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (user_id, azienda_id, reparto, mese) DO UPDATE SET
+            n_esposizione = a.n_esposizione + EXCLUDED.n_esposizione,
+            n_minimo = a.n_minimo + EXCLUDED.n_minimo,
+            n_medio = a.n_medio + EXCLUDED.n_medio,
+            n_rilevante = a.n_rilevante + EXCLUDED.n_rilevante,
+            n_alto = a.n_alto + EXCLUDED.n_alto,
+            somma_lex = a.somma_lex + EXCLUDED.somma_lex,
+            somma_energia = a.somma_energia + EXCLUDED.somma_energia,
+            lex_max = GREATEST(a.lex_max, EXCLUDED.lex_max),
+            updated_at = CURRENT_TIMESTAMP
+    $sql$, analisi_rischio_righe(TG_OP, 'user_id, azienda_id, reparto, data_misura, lex'));
+
+    -- Il massimo non si può decrementare: si ricalcola solo nei gruppi da cui
+    -- è uscita una riga con LEX pari al massimo memorizzato
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE analisi_rischio_mensile a
+        SET lex_max = (
+            SELECT MAX(v.lex) FROM valutazioni_esposizione v
+            WHERE v.user_id = a.user_id
+              AND COALESCE(v.azienda_id, 0) = a.azienda_id
+              AND COALESCE(v.reparto, '') = a.reparto
+              AND COALESCE(v.data_misura, v.created_at::date) >= a.mese
+              AND COALESCE(v.data_misura, v.created_at::date) < a.mese + INTERVAL '1 month'
+              AND v.lex > 0
+        )
+        FROM (
+            SELECT o.user_id, COALESCE(o.azienda_id, 0) AS azienda_id, COALESCE(o.reparto, '') AS reparto,
+                   date_trunc('month', COALESCE(o.data_misura, o.created_at::date))::date AS mese,
+                   MAX(o.lex) AS lex
+            FROM vecchie o
+            WHERE o.lex > 0
+            GROUP BY 1, 2, 3, 4
+        ) r
+        WHERE a.user_id = r.user_id AND a.azienda_id = r.azienda_id
+          AND a.reparto = r.reparto AND a.mese = r.mese
+          AND r.lex >= a.lex_max;
+
+        -- Gruppi rimasti vuoti. Niente FK su users: quando un utente è
+        -- eliminato le valutazioni escono in cascata e i gruppi (ricreati con
+        -- conteggi negativi se già rimossi) sono eliminati qui
+        DELETE FROM analisi_rischio_mensile a
+        WHERE a.user_id IN (SELECT DISTINCT user_id FROM vecchie)
+          AND a.n_esposizione <= 0 AND a.n_dpi <= 0;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_analisi_dpi()
+RETURNS TRIGGER AS $$
+BEGIN
+    EXECUTE format($sql$
+        INSERT INTO analisi_rischio_mensile AS a (
+            user_id, azienda_id, reparto, mese, n_dpi,
+            n_eccessiva, n_buona, n_ottimale, n_accettabile, n_insufficiente, somma_leff
+        )
+        SELECT
+            r.user_id, COALESCE(r.azienda_id, 0), COALESCE(r.reparto, ''),
+            date_trunc('month', r.created_at)::date,
+            SUM(r.segno),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.leff > 0 AND r.leff < 65), 0),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.leff >= 65 AND r.leff < 70), 0),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.leff >= 70 AND r.leff <= 80), 0),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.leff > 80 AND r.leff <= 85), 0),
+            COALESCE(SUM(r.segno) FILTER (WHERE r.leff > 85), 0),
+            COALESCE(SUM(r.segno * r.leff::float8) FILTER (WHERE r.leff > 0), 0)
+        FROM (%s) r
+        WHERE r.user_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (user_id, azienda_id, reparto, mese) DO UPDATE SET
+            n_dpi = a.n_dpi + EXCLUDED.n_dpi,
+            n_eccessiva = a.n_eccessiva + EXCLUDED.n_eccessiva,
+            n_buona = a.n_buona + EXCLUDED.n_buona,
+            n_ottimale = a.n_ottimale + EXCLUDED.n_ottimale,
+            n_accettabile = a.n_accettabile + EXCLUDED.n_accettabile,
+            n_insufficiente = a.n_insufficiente + EXCLUDED.n_insufficiente,
+            somma_leff = a.somma_leff + EXCLUDED.somma_leff,
+            updated_at = CURRENT_TIMESTAMP
+    $sql$, analisi_rischio_righe(TG_OP, 'user_id, azienda_id, reparto, leff'));
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM analisi_rischio_mensile a
+        WHERE a.user_id IN (SELECT DISTINCT user_id FROM vecchie)
+          AND a.n_esposizione <= 0 AND a.n_dpi <= 0;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Le tabelle di transizione richiedono un trigger per evento
+DROP TRIGGER IF EXISTS valutazioni_esposizione_analisi_ins ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_analisi_ins
+    AFTER INSERT ON valutazioni_esposizione
+    REFERENCING NEW TABLE AS nuove
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_analisi_esposizione();
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_analisi_upd ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_analisi_upd
+    AFTER UPDATE ON valutazioni_esposizione
+    REFERENCING OLD TABLE AS vecchie NEW TABLE AS nuove
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_analisi_esposizione();
+
+DROP TRIGGER IF EXISTS valutazioni_esposizione_analisi_del ON valutazioni_esposizione;
+CREATE TRIGGER valutazioni_esposizione_analisi_del
+    AFTER DELETE ON valutazioni_esposizione
+    REFERENCING OLD TABLE AS vecchie
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_analisi_esposizione();
+
+DROP TRIGGER IF EXISTS valutazioni_dpi_analisi_ins ON valutazioni_dpi;
+CREATE TRIGGER valutazioni_dpi_analisi_ins
+    AFTER INSERT ON valutazioni_dpi
+    REFERENCING NEW TABLE AS nuove
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_analisi_dpi();
+
+DROP TRIGGER IF EXISTS valutazioni_dpi_analisi_upd ON valutazioni_dpi;
+CREATE TRIGGER valutazioni_dpi_analisi_upd
+    AFTER UPDATE ON valutazioni_dpi
+    REFERENCING OLD TABLE AS vecchie NEW TABLE AS nuove
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_analisi_dpi();
+
+DROP TRIGGER IF EXISTS valutazioni_dpi_analisi_del ON valutazioni_dpi;
+CREATE TRIGGER valutazioni_dpi_analisi_del
+    AFTER DELETE ON valutazioni_dpi
+    REFERENCING OLD TABLE AS vecchie
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_analisi_dpi();
+
+-- ============================================================
+-- RICOSTRUZIONE
+-- Azzera gli aggregati e li ricalcola dalle tabelle (popolamento iniziale e
+-- riallineamento manuale: SELECT analisi_rischio_ricostruisci();)
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION analisi_rischio_ricostruisci()
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM analisi_rischio_mensile;
+
+    INSERT INTO analisi_rischio_mensile (
+        user_id, azienda_id, reparto, mese, n_esposizione,
+        n_minimo, n_medio, n_rilevante, n_alto, somma_lex, somma_energia, lex_max
+    )
+    SELECT
+        v.user_id, COALESCE(v.azienda_id, 0), COALESCE(v.reparto, ''),
+        date_trunc('month', COALESCE(v.data_misura, v.created_at::date))::date,
+        COUNT(*),
+        COUNT(*) FILTER (WHERE v.lex > 0 AND v.lex < 80),
+        COUNT(*) FILTER (WHERE v.lex >= 80 AND v.lex < 85),
+        COUNT(*) FILTER (WHERE v.lex >= 85 AND v.lex < 87),
+        COUNT(*) FILTER (WHERE v.lex >= 87),
+        COALESCE(SUM(v.lex::float8) FILTER (WHERE v.lex > 0), 0),
+        COALESCE(SUM(power(10, v.lex::float8 / 10)) FILTER (WHERE v.lex > 0), 0),
+        MAX(v.lex) FILTER (WHERE v.lex > 0)
+    FROM valutazioni_esposizione v
+    WHERE v.user_id IS NOT NULL
+    GROUP BY 1, 2, 3, 4;
+
+    INSERT INTO analisi_rischio_mensile AS a (
+        user_id, azienda_id, reparto, mese, n_dpi,
+        n_eccessiva, n_buona, n_ottimale, n_accettabile, n_insufficiente, somma_leff
+    )
+    SELECT
+        d.user_id, COALESCE(d.azienda_id, 0), COALESCE(d.reparto, ''),
+        date_trunc('month', d.created_at)::date,
+        COUNT(*),
+        COUNT(*) FILTER (WHERE d.leff > 0 AND d.leff < 65),
+        COUNT(*) FILTER (WHERE d.leff >= 65 AND d.leff < 70),
+        COUNT(*) FILTER (WHERE d.leff >= 70 AND d.leff <= 80),
+        COUNT(*) FILTER (WHERE d.leff > 80 AND d.leff <= 85),
+        COUNT(*) FILTER (WHERE d.leff > 85),
+        COALESCE(SUM(d.leff::float8) FILTER (WHERE d.leff > 0), 0)
+    FROM valutazioni_dpi d
+    WHERE d.user_id IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (user_id, azienda_id, reparto, mese) DO UPDATE SET
+        n_dpi = EXCLUDED.n_dpi,
+        n_eccessiva = EXCLUDED.n_eccessiva,
+        n_buona = EXCLUDED.n_buona,
+        n_ottimale = EXCLUDED.n_ottimale,
+        n_accettabile = EXCLUDED.n_accettabile,
+        n_insufficiente = EXCLUDED.n_insufficiente,
+        somma_leff = EXCLUDED.somma_leff,
+        updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT analisi_rischio_ricostruisci();
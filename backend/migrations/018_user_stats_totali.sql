@@ -0,0 +1,98 @@
+-- ============================================================
+-- Migration 018: Totali della lista utenti admin e indici per keyset
+-- Descrizione: Numero di utenti e amministratori in una riga mantenuta dai
+--              trigger (niente COUNT(*) a ogni pagina) e indici (chiave di
+--              ordinamento, id) per la paginazione keyset della lista utenti
+--              al posto di OFFSET.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS user_stats_totali (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    num_utenti INTEGER NOT NULL DEFAULT 0,
+    num_admin INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE user_stats_totali IS 'Riga unica con i totali della lista utenti admin, mantenuta dai trigger';
+
+-- Solo le scritture su users (rare) aggiornano questa riga: un trigger sulle
+-- aziende la renderebbe un lock condiviso da tutte le scritture di tutti gli
+-- utenti. Il totale delle aziende si somma da user_stats alla lettura.
+
+-- Le chiavi di ordinamento di ADMIN_USERS_SORT (main.py), con l'id come
+-- spareggio: WHERE (chiave, id) < (...) ORDER BY chiave, id scorre l'indice
+DROP INDEX IF EXISTS idx_users_created_at;
+DROP INDEX IF EXISTS idx_users_last_login;
+DROP INDEX IF EXISTS idx_user_stats_aziende;
+DROP INDEX IF EXISTS idx_user_stats_esposizione;
+DROP INDEX IF EXISTS idx_user_stats_dpi;
+
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id
+    ON users ((COALESCE(created_at, '-infinity'::timestamp)), id);
+CREATE INDEX IF NOT EXISTS idx_users_last_login_id
+    ON users ((COALESCE(last_login, '-infinity'::timestamp)), id);
+CREATE INDEX IF NOT EXISTS idx_users_nome_id ON users(nome, id);
+CREATE INDEX IF NOT EXISTS idx_user_stats_aziende_id ON user_stats(num_aziende, user_id);
+CREATE INDEX IF NOT EXISTS idx_user_stats_esposizione_id ON user_stats(num_valutazioni_esposizione, user_id);
+CREATE INDEX IF NOT EXISTS idx_user_stats_dpi_id ON user_stats(num_valutazioni_dpi, user_id);
+
+-- ============================================================
+-- TRIGGER
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION trg_user_stats_totali_users()
+RETURNS TRIGGER AS $$
+DECLARE
+    delta_utenti INTEGER := 0;
+    delta_admin INTEGER := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        delta_admin := delta_admin + CASE WHEN NEW.is_admin THEN 1 ELSE 0 END;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        delta_admin := delta_admin - CASE WHEN OLD.is_admin THEN 1 ELSE 0 END;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        delta_utenti := 1;
+    ELSIF TG_OP = 'DELETE' THEN
+        delta_utenti := -1;
+    END IF;
+
+    UPDATE user_stats_totali
+    SET num_utenti = GREATEST(num_utenti + delta_utenti, 0),
+        num_admin = GREATEST(num_admin + delta_admin, 0),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_stats_totali ON users;
+CREATE TRIGGER users_stats_totali
+    AFTER INSERT OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION trg_user_stats_totali_users();
+
+DROP TRIGGER IF EXISTS users_stats_totali_admin ON users;
+CREATE TRIGGER users_stats_totali_admin
+    AFTER UPDATE OF is_admin ON users
+    FOR EACH ROW WHEN (OLD.is_admin IS DISTINCT FROM NEW.is_admin)
+    EXECUTE FUNCTION trg_user_stats_totali_users();
+
+-- ============================================================
+-- POPOLAMENTO INIZIALE
+-- ============================================================
+
+-- La lista utenti ordina su user_stats con un JOIN: ogni utente deve avere la sua riga
+INSERT INTO user_stats (user_id)
+SELECT id FROM users
+ON CONFLICT (user_id) DO NOTHING;
+
+INSERT INTO user_stats_totali (id, num_utenti, num_admin)
+SELECT
+    TRUE,
+    (SELECT COUNT(*) FROM users),
+    (SELECT COUNT(*) FROM users WHERE is_admin)
+ON CONFLICT (id) DO UPDATE SET
+    num_utenti = EXCLUDED.num_utenti,
+    num_admin = EXCLUDED.num_admin,
+    updated_at = CURRENT_TIMESTAMP;
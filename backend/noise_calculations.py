@@ -0,0 +1,131 @@
+"""
+Calcoli di esposizione al rumore (equivalente di src/utils/noiseCalculations.ts)
+Le funzioni accettano scalari o array NumPy, così lo stesso codice valuta
+un singolo DPI o l'intero catalogo per molti lavoratori in una passata.
+Oltre al metodo HML del client include il metodo per bande d'ottava
+(EN ISO 4869-2).
+"""
+import numpy as np
+
+# Limiti superiori (inclusi) delle fasce di LEX del metodo HML di
+# calcolaAttenuazione e coefficienti (H, M, L) della PNR in ogni fascia
+HML_FASCE = np.array([80, 90, 95, 100, 105, 110])
+HML_COEFFICIENTI = np.array([
+    [-1 / 4, 1, -1 / 4],   # LEX <= 80:  M - H/4 - L/4
+    [-1 / 2, 1, -1 / 8],   # <= 90:      M - H/2 - L/8
+    [-1 / 4, 1, 0],        # <= 95:      M - H/4
+    [0, 1, 0],             # <= 100:     M
+    [1 / 4, 1, 0],         # <= 105:     M + H/4
+    [1 / 2, 1, 1 / 4],     # <= 110:     M + H/2 + L/4
+    [3 / 4, 1, 1 / 2],     # > 110:      M + 3H/4 + L/2
+])
+
+# Classi di rischio di getClasseRischio: LEX < 80, < 85, < 87, oltre
+RISCHIO_SOGLIE = np.array([80, 85, 87])
+RISCHIO_CLASSI = (
+    "MINIMO",
+    "MEDIO - Valore inferiore di azione",
+    "RILEVANTE - Valore superiore di azione",
+    "ALTO - Superamento valori limite",
+)
+
+# Fascia OTTIMALE di L'eff (UNI EN 458:2016)
+LEFF_OTTIMALE = (70.0, 80.0)
+
+PROTEZIONE_CLASSI = (
+    "ECCESSIVA - Rischio isolamento acustico",
+    "BUONA - Leggermente sovradimensionata",
+    "OTTIMALE - Protezione adeguata",
+    "ACCETTABILE - Protezione minima",
+    "INSUFFICIENTE - DPI inadeguato",
+)
+
+
+def classe_rischio(lex) -> np.ndarray:
+    """Indice in RISCHIO_CLASSI per ogni LEX (stesse soglie di getClasseRischio)"""
+    return np.searchsorted(RISCHIO_SOGLIE, np.asarray(lex, dtype=np.float64), side="right")
+
+
+def coefficienti_hml(lex) -> np.ndarray:
+    """Coefficienti (H, M, L) della PNR per ogni LEX: forma (..., 3)"""
+    fascia = np.searchsorted(HML_FASCE, np.asarray(lex, dtype=np.float64), side="left")
+    return HML_COEFFICIENTI[fascia]
+
+
+def pnr_hml(lex, hml) -> np.ndarray:
+    """
+    PNR del metodo HML come in calcolaAttenuazione
+
+    Args:
+        lex: LEX dei lavoratori, forma (W,)
+        hml: Valori H, M, L dei DPI, forma (P, 3)
+
+    Returns:
+        Matrice (W, P): un prodotto matriciale tra coefficienti e valori HML
+    """
+    return coefficienti_hml(lex) @ np.asarray(hml).T
+
+
+def classe_protezione(leff) -> np.ndarray:
+    """Indice in PROTEZIONE_CLASSI per ogni L'eff (stesse soglie del client)"""
+    leff = np.asarray(leff)
+    return np.select(
+        [leff < 65, leff < 70, leff <= 80, leff <= 85],
+        [0, 1, 2, 3],
+        default=4,
+    )
+
+
+# ==================== METODO PER BANDE D'OTTAVA ====================
+
+# Bande d'ottava (Hz) degli spettri di misura e dei dati di attenuazione
+OTTAVE_HZ = (63, 125, 250, 500, 1000, 2000, 4000, 8000)
+
+# Ponderazione A per banda (IEC 61672-1)
+PONDERAZIONE_A = np.array([-26.2, -16.1, -8.6, -3.2, 0.0, 1.2, 1.0, -1.1])
+
+
+def apv(mf, sf, alfa: float = 1.0) -> np.ndarray:
+    """
+    Valore di protezione presunto per banda: APVf = mf - alfa * sf
+    alfa = 1 corrisponde a un'efficacia di protezione dell'84%
+    """
+    return np.asarray(mf, dtype=np.float64) - alfa * np.asarray(sf, dtype=np.float64)
+
+
+def livello_a(spettri) -> np.ndarray:
+    """LA dB(A) di spettri non ponderati per ottava: forma (..., 8) -> (...)"""
+    spettri = np.asarray(spettri, dtype=np.float64)
+    return 10 * np.log10(np.sum(10 ** (0.1 * (spettri + PONDERAZIONE_A)), axis=-1))
+
+
+def livello_a_protetto(spettri, apv_dpi) -> np.ndarray:
+    """
+    L'A dB(A) sotto il protettore (EN ISO 4869-2, metodo per bande d'ottava)
+
+    L'A = 10 log10 Σf 10^(0.1 (Lf + Af - APVf)). Il termine di banda si separa
+    in 10^(0.1 (Lf + Af)) x 10^(-0.1 APVf), quindi tutti gli spettri contro
+    tutti i protettori sono un unico prodotto matriciale (N x 8) @ (8 x P).
+
+    Args:
+        spettri: Livelli non ponderati per banda, forma (N, 8)
+        apv_dpi: APV dei protettori, forma (P, 8)
+
+    Returns:
+        Matrice (N, P)
+    """
+    energia = 10 ** (0.1 * (np.atleast_2d(np.asarray(spettri, dtype=np.float64)) + PONDERAZIONE_A))
+    trasmissione = 10 ** (-0.1 * np.atleast_2d(np.asarray(apv_dpi, dtype=np.float64)))
+    return 10 * np.log10(energia @ trasmissione.T)
+
+
+def lex_8h(livelli, durate) -> np.ndarray:
+    """
+    LEX,8h = 10 log10(Σ 10^(Li/10) x ti/480) come calcolaLEX
+
+    Args:
+        livelli: Livelli delle attività, forma (N,) o (N, P)
+        durate: Durate in minuti, forma (N,)
+    """
+    pesi = np.asarray(durate, dtype=np.float64) / 480
+    return 10 * np.log10(pesi @ 10 ** (0.1 * np.asarray(livelli, dtype=np.float64)))
@@ -0,0 +1,166 @@
+"""
+Subscription Quota Enforcement
+Answers "can this user create X?" from the per-user user_quotas row
+(plan limits cached by trigger + incremental usage counters)
+"""
+
+from __future__ import annotations
+from fastapi import HTTPException
+from typing import Optional
+
+# Resource -> (usage column, limit column, monthly counter, limit multiplier)
+QUOTA_RESOURCES = {
+    'valutazione_esposizione': (
+        'usage_valutazioni_esposizione', 'max_valutazioni_esposizione_month', True, 1
+    ),
+    'valutazione_dpi': (
+        'usage_valutazioni_dpi', 'max_valutazioni_dpi_month', True, 1
+    ),
+    'azienda': ('usage_aziende', 'max_aziende', False, 1),
+    'storage': ('usage_storage_bytes', 'storage_mb', False, 1024 * 1024),
+}
+
+QUOTA_MESSAGES = {
+    'valutazione_esposizione': "Limite mensile di valutazioni esposizione raggiunto per il tuo piano",
+    'valutazione_dpi': "Limite mensile di valutazioni DPI raggiunto per il tuo piano",
+    'azienda': "Numero massimo di aziende raggiunto per il tuo piano",
+    'storage': "Spazio di archiviazione esaurito per il tuo piano",
+}
+
+_MONTH_START = "date_trunc('month', CURRENT_DATE)::date"
+
+
+def _current_usage_sql(usage_col: str, monthly: bool) -> str:
+    """Usage expression that treats monthly counters of a past period as zero"""
+    if monthly:
+        return f"(CASE WHEN periodo_inizio < {_MONTH_START} THEN 0 ELSE {usage_col} END)"
+    return usage_col
+
+
+def _build_consume_sql(resource: str) -> str:
+    usage_col, limit_col, monthly, multiplier = QUOTA_RESOURCES[resource]
+    current = _current_usage_sql(usage_col, monthly)
+
+    assignments = [f"{usage_col} = {current} + %(quantity)s"]
+    if monthly:
+        # Il cambio di mese azzera anche gli altri contatori mensili
+        for other, (other_col, _, other_monthly, _) in QUOTA_RESOURCES.items():
+            if other_monthly and other_col != usage_col:
+                assignments.append(f"{other_col} = {_current_usage_sql(other_col, True)}")
+        assignments.append(f"periodo_inizio = {_MONTH_START}")
+
+    return f"""
+        UPDATE user_quotas
+        SET {', '.join(assignments)}
+        WHERE user_id = %(user_id)s
+          AND attiva
+          AND (scadenza IS NULL OR scadenza > NOW())
+          AND ({limit_col} IS NULL OR {current} + %(quantity)s <= {limit_col}::bigint * {multiplier})
+        RETURNING {usage_col} AS usage, {limit_col} AS max
+    """
+
+
+def _build_check_sql(resource: str) -> str:
+    usage_col, limit_col, monthly, multiplier = QUOTA_RESOURCES[resource]
+    current = _current_usage_sql(usage_col, monthly)
+    return f"""
+        SELECT
+            attiva AND (scadenza IS NULL OR scadenza > NOW()) AS attiva,
+            {current} AS usage,
+            {limit_col} AS max,
+            ({limit_col} IS NULL OR {current} + %(quantity)s <= {limit_col}::bigint * {multiplier}) AS allowed
+        FROM user_quotas
+        WHERE user_id = %(user_id)s
+    """
+
+
+# SQL is built once at import: every check is a single-row statement on the PK
+_CONSUME_SQL = {resource: _build_consume_sql(resource) for resource in QUOTA_RESOURCES}
+_CHECK_SQL = {resource: _build_check_sql(resource) for resource in QUOTA_RESOURCES}
+
+
+def check_quota(cursor, user_id: int, resource: str, quantity: int = 1) -> dict:
+    """
+    Check (without consuming) whether the user can create `quantity` units of a resource
+
+    Args:
+        cursor: Open database cursor
+        user_id: Internal user ID
+        resource: One of QUOTA_RESOURCES
+        quantity: Units requested (bytes for 'storage')
+
+    Returns:
+        dict: {"allowed": bool, "usage": int, "max": Optional[int], "message": Optional[str]}
+    """
+    cursor.execute(_CHECK_SQL[resource], {'user_id': user_id, 'quantity': quantity})
+    row = cursor.fetchone()
+
+    if not row or not _get(row, 'attiva', 0):
+        return {'allowed': False, 'usage': 0, 'max': None, 'message': "Nessun abbonamento attivo"}
+
+    allowed = bool(_get(row, 'allowed', 3))
+    return {
+        'allowed': allowed,
+        'usage': _get(row, 'usage', 1),
+        'max': _get(row, 'max', 2),
+        'message': None if allowed else QUOTA_MESSAGES[resource],
+    }
+
+
+def consume_quota(cursor, user_id: int, resource: str, quantity: int = 1) -> None:
+    """
+    Atomically consume quota inside the caller's transaction
+
+    The conditional UPDATE locks the user's quota row, so concurrent creates
+    are serialized and can never exceed the limit. If the caller rolls back,
+    the consumed units are rolled back with it.
+
+    Raises:
+        HTTPException 403 if there is no active subscription or the limit is reached
+    """
+    cursor.execute(_CONSUME_SQL[resource], {'user_id': user_id, 'quantity': quantity})
+    if cursor.fetchone():
+        return
+
+    # Percorso di errore: distingue "limite raggiunto" da "nessun abbonamento"
+    status = check_quota(cursor, user_id, resource, quantity)
+    raise HTTPException(status_code=403, detail=status['message'] or QUOTA_MESSAGES[resource])
+
+
+# Boolean plan flags that can be checked with has_feature()
+PLAN_FEATURES = {
+    'feature_archivio_documenti',
+    'feature_export_data',
+    'feature_multi_user',
+    'feature_api_access',
+    'feature_white_label',
+    'feature_priority_support',
+}
+
+
+def has_feature(cursor, user_id: int, feature: str) -> bool:
+    """
+    Whether the user's active (non expired) plan includes a feature flag
+    """
+    if feature not in PLAN_FEATURES:
+        raise ValueError(f"Unknown plan feature: {feature}")
+
+    cursor.execute(f"""
+        SELECT sp.{feature} AS enabled
+        FROM user_quotas uq
+        JOIN subscription_plans sp ON sp.id = uq.plan_id
+        WHERE uq.user_id = %s
+          AND uq.attiva
+          AND (uq.scadenza IS NULL OR uq.scadenza > NOW())
+    """, (user_id,))
+    row = cursor.fetchone()
+    return bool(row and _get(row, 'enabled', 0))
+
+
+def _get(row, key: str, index: int) -> Optional[int]:
+    """Read a column from either a RealDictCursor row or a tuple row"""
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+# Export
+__all__ = ['QUOTA_RESOURCES', 'PLAN_FEATURES', 'check_quota', 'consume_quota', 'has_feature']
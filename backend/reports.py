@@ -0,0 +1,564 @@
+"""
+Report delle valutazioni generati lato server
+I dati arrivano dalle righe salvate (valutazioni_*, misurazioni, aziende), il
+rendering gira in un pool di processi e l'output è memorizzato in una cache su
+disco indicizzata dall'hash del contenuto: una valutazione non modificata viene
+servita direttamente dalla cache.
+"""
+from concurrent.futures import ProcessPoolExecutor, Future
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+from xml.sax.saxutils import escape
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import zipfile
+
+from dpi_database import nome_dpi
+
+logger = logging.getLogger(__name__)
+
+# Incrementare quando cambia il layout: invalida tutta la cache
+RENDERER_VERSION = "2"
+
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+REPORT_RENDER_TIMEOUT = float(os.getenv("REPORT_RENDER_TIMEOUT", "60"))
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "report_cache"))
+REPORT_CACHE_MAX_MB = float(os.getenv("REPORT_CACHE_MAX_MB", "512"))
+
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+# tipo_file della tabella documenti per ogni formato
+TIPI_FILE = {"pdf": "pdf", "docx": "word"}
+
+REPORT_FILENAMES = {
+    "esposizione": "Report_Rumore_{id}.{ext}",
+    "dpi": "Valutazione_DPI_{id}.{ext}",
+}
+
+# ==================== DATI ====================
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _row(row) -> dict:
+    return {key: _json_value(value) for key, value in dict(row).items()}
+
+
+def load_report_data(cursor, tipo: str, valutazione_id: int) -> Optional[dict]:
+    """
+    Legge valutazione, misurazioni e azienda necessarie al report
+
+    Args:
+        cursor: Cursore RealDictCursor
+        tipo: 'esposizione' oppure 'dpi'
+        valutazione_id: Id della valutazione
+
+    Returns:
+        Dati serializzabili in JSON, None se la valutazione non esiste
+    """
+    tabella = "valutazioni_esposizione" if tipo == "esposizione" else "valutazioni_dpi"
+    cursor.execute(f"SELECT * FROM {tabella} WHERE id = %s", (valutazione_id,))
+    valutazione = cursor.fetchone()
+    if not valutazione:
+        return None
+
+    misurazioni = []
+    if tipo == "esposizione":
+        cursor.execute("""
+            SELECT attivita, leq, durata, lpicco
+            FROM misurazioni WHERE valutazione_id = %s ORDER BY ordine, id
+        """, (valutazione_id,))
+        misurazioni = [_row(m) for m in cursor.fetchall()]
+
+    return {
+        "tipo": tipo,
+        "valutazione": _row(valutazione),
+        "misurazioni": misurazioni,
+        "azienda": _load_azienda(cursor, valutazione["azienda_id"]),
+    }
+
+
+def load_azienda_report_data(cursor, azienda_id: int, user_id: Optional[int] = None, tipi=("esposizione", "dpi")) -> list:
+    """
+    Dati dei report di tutte le valutazioni di un'azienda con un numero fisso
+    di query (misurazioni lette in blocco). Stesso formato di load_report_data,
+    quindi stesso hash e stessa voce di cache.
+    """
+    azienda = _load_azienda(cursor, azienda_id)
+    filtro_utente = " AND user_id = %s" if user_id is not None else ""
+    params = (azienda_id, user_id) if user_id is not None else (azienda_id,)
+
+    datasets = []
+    for tipo in tipi:
+        tabella = "valutazioni_esposizione" if tipo == "esposizione" else "valutazioni_dpi"
+        cursor.execute(f"SELECT * FROM {tabella} WHERE azienda_id = %s{filtro_utente} ORDER BY id", params)
+        valutazioni = cursor.fetchall()
+
+        misurazioni = {}
+        if tipo == "esposizione" and valutazioni:
+            cursor.execute("""
+                SELECT valutazione_id, attivita, leq, durata, lpicco
+                FROM misurazioni WHERE valutazione_id = ANY(%s)
+                ORDER BY valutazione_id, ordine, id
+            """, ([v["id"] for v in valutazioni],))
+            for m in cursor.fetchall():
+                m = _row(m)
+                misurazioni.setdefault(m.pop("valutazione_id"), []).append(m)
+
+        for valutazione in valutazioni:
+            datasets.append({
+                "tipo": tipo,
+                "valutazione": _row(valutazione),
+                "misurazioni": misurazioni.get(valutazione["id"], []),
+                "azienda": azienda,
+            })
+    return datasets
+
+
+def _load_azienda(cursor, azienda_id: Optional[int]) -> Optional[dict]:
+    if not azienda_id:
+        return None
+    cursor.execute("""
+        SELECT ragione_sociale, partita_iva, codice_fiscale, indirizzo,
+               citta, cap, provincia, rappresentante_legale
+        FROM aziende WHERE id = %s
+    """, (azienda_id,))
+    row = cursor.fetchone()
+    return _row(row) if row else None
+
+
+def content_hash(data: dict, formato: str) -> str:
+    """Hash SHA-256 del contenuto del report (dati + formato + versione del renderer)"""
+    payload = json.dumps(
+        {"v": RENDERER_VERSION, "formato": formato, "data": data},
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# ==================== CACHE ====================
+
+class RenderCache:
+    """Cache su disco dei report, indicizzata per hash; eviction LRU per dimensione"""
+
+    PRUNE_EVERY = 50
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def get(self, key: str, ext: str) -> Optional[str]:
+        path = self.path(key, ext)
+        try:
+            os.utime(path)  # ultimo accesso per l'eviction
+            return path
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, ext: str, content: bytes) -> str:
+        path = self.path(key, ext)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)  # atomico: i lettori non vedono file parziali
+
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return path
+
+    def prune(self):
+        """Elimina i report meno usati finché la cache rientra nel limite"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+render_cache = RenderCache(REPORT_CACHE_DIR, int(REPORT_CACHE_MAX_MB * 1024 * 1024))
+
+# ==================== POOL DI RENDERING ====================
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_inflight = {}
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Pool di processi creato al primo utilizzo (spawn: nessun lock ereditato dal server)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=REPORT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def shutdown_pool():
+    """Arresta il pool (chiamato allo shutdown del server)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _init_worker():
+    # Import dei moduli di rendering e compilazione del template DOCX una
+    # sola volta per processo
+    import reportlab.platypus  # noqa: F401
+    from reports_docx import template_bytes
+    template_bytes()
+
+
+def _render(formato: str, data: dict) -> bytes:
+    """Entry point eseguito nei processi del pool"""
+    if formato == "pdf":
+        return render_pdf(data)
+    if formato == "docx":
+        from reports_docx import render_docx
+        return render_docx(data)
+    raise ValueError(f"Formato report non supportato: {formato}")
+
+
+def render_report(data: dict, formato: str) -> tuple:
+    """
+    Restituisce (path, hash) del report, generandolo solo se non è in cache
+    Richieste concorrenti per lo stesso contenuto attendono un unico rendering
+    """
+    key = content_hash(data, formato)
+    path = render_cache.get(key, formato)
+    if path:
+        return path, key
+
+    with _pool_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+
+    if not owner:
+        return future.result(timeout=REPORT_RENDER_TIMEOUT), key
+
+    try:
+        content = get_pool().submit(_render, formato, data).result(timeout=REPORT_RENDER_TIMEOUT)
+        path = render_cache.put(key, formato, content)
+        future.set_result(path)
+        return path, key
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _pool_lock:
+            _inflight.pop(key, None)
+
+def report_filename(data: dict, formato: str) -> str:
+    return REPORT_FILENAMES[data["tipo"]].format(id=data["valutazione"]["id"], ext=formato)
+
+
+def attach_report(cursor, user_id: int, data: dict, formato: str, path: str, key: str) -> int:
+    """
+    Allega il report alla valutazione come documento (upload su B2 + riga in
+    documenti, consumando la quota storage). Se lo stesso contenuto è già
+    allegato restituisce il documento esistente. Il commit è del chiamante.
+
+    Returns:
+        Id del documento
+    """
+    # Import locali: questo modulo è importato anche dai processi di rendering
+    from quotas import consume_quota
+    from storage import storage
+
+    colonna = "valutazione_esposizione_id" if data["tipo"] == "esposizione" else "valutazione_dpi_id"
+    valutazione_id = data["valutazione"]["id"]
+    cursor.execute(
+        f"SELECT id FROM documenti WHERE {colonna} = %s AND content_hash = %s",
+        (valutazione_id, key)
+    )
+    existing = cursor.fetchone()
+    if existing:
+        return existing["id"]
+
+    with open(path, "rb") as f:
+        content = f.read()
+    consume_quota(cursor, user_id, "storage", len(content))
+
+    nome_file = report_filename(data, formato)
+    url = storage.upload_bytes(content, nome_file, MEDIA_TYPES[formato])
+    cursor.execute(
+        f"""
+        INSERT INTO documenti
+        ({colonna}, nome_file, url, tipo_file, user_id, dimensione_bytes, content_hash)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+        """,
+        (valutazione_id, nome_file, url, TIPI_FILE[formato], user_id, len(content), key)
+    )
+    return cursor.fetchone()["id"]
+
+
+def build_archive(entries: list, archive_path: str):
+    """
+    Scrive uno ZIP con i report generati
+    entries: lista di (nome nel file zip, path del report in cache)
+    """
+    # I formati PDF/DOCX sono già compressi: ZIP_STORED evita lavoro inutile
+    tmp_path = archive_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, path in entries:
+            archive.write(path, arcname=name)
+    os.replace(tmp_path, archive_path)
+
+# ==================== RENDERING PDF ====================
+
+def _num(value, decimals: int = 1) -> str:
+    try:
+        return f"{float(value):.{decimals}f}"
+    except (TypeError, ValueError):
+        return "-"
+
+
+def _data_it(value) -> str:
+    """Data ISO in formato italiano (gg/mm/aaaa)"""
+    if not value:
+        return "-"
+    return datetime.fromisoformat(value).strftime("%d/%m/%Y")
+
+
+def _colore_rischio(classe: str):
+    classe = (classe or "").lower()
+    if "minimo" in classe:
+        return (220, 252, 231)
+    if "medio" in classe:
+        return (254, 243, 199)
+    if "rilevante" in classe:
+        return (254, 215, 170)
+    return (254, 226, 226)
+
+
+def _colore_protezione(protezione: str):
+    protezione = protezione or ""
+    if "OTTIMALE" in protezione:
+        return (220, 252, 231)
+    if "INSUFFICIENTE" in protezione:
+        return (254, 226, 226)
+    if "BUONA" in protezione:
+        return (224, 242, 254)
+    if "ACCETTABILE" in protezione:
+        return (254, 243, 199)
+    return (254, 215, 170)
+
+
+def render_pdf(data: dict) -> bytes:
+    """Report PDF con lo stesso contenuto di src/utils/pdfUtils.ts"""
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    def rgb(r, g, b):
+        return colors.Color(r / 255, g / 255, b / 255)
+
+    def para(text, style):
+        # Paragraph interpreta il testo come markup (<b>, <font>, <img src>): i valori
+        # inseriti dall'utente (attività, mansione, azienda...) vanno passati come testo
+        return Paragraph(escape(text), style)
+
+    styles = getSampleStyleSheet()
+    base = ParagraphStyle("base", parent=styles["Normal"], fontName="Helvetica", fontSize=9, leading=12)
+    bold = ParagraphStyle("bold", parent=base, fontName="Helvetica-Bold")
+    section = ParagraphStyle("section", parent=bold, fontSize=12, leading=16, textColor=rgb(75, 85, 99), spaceBefore=8, spaceAfter=4)
+    note = ParagraphStyle("note", parent=base, fontName="Helvetica-Oblique", fontSize=8, textColor=rgb(107, 114, 128))
+    subtitle = ParagraphStyle("subtitle", parent=base, fontSize=10, alignment=TA_CENTER, textColor=rgb(107, 114, 128))
+    box_label = ParagraphStyle("box_label", parent=base, alignment=TA_CENTER)
+    box_value = ParagraphStyle("box_value", parent=bold, fontSize=16, leading=20, alignment=TA_CENTER)
+
+    esposizione = data["tipo"] == "esposizione"
+    val = data["valutazione"]
+    accento = rgb(30, 64, 175) if esposizione else rgb(124, 58, 237)
+    titolo = "REPORT VALUTAZIONE RISCHIO RUMORE" if esposizione else "VALUTAZIONE DPI UDITIVI"
+    sottotitolo = "D.Lgs. 81/2008 - Titolo VIII Capo II" if esposizione else "Metodo HML - UNI EN 458:2016"
+    data_valutazione = _data_it(val.get("created_at"))
+
+    def grid(rows, widths, header_color=accento, extra=()):
+        table = Table(rows, colWidths=[w * mm for w in widths])
+        table.setStyle(TableStyle([
+            ("GRID", (0, 0), (-1, -1), 0.5, rgb(200, 200, 200)),
+            ("BACKGROUND", (0, 0), (-1, 0), header_color),
+            ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+            ("FONTSIZE", (0, 0), (-1, -1), 9),
+            ("ALIGN", (1, 0), (-1, -1), "CENTER"),
+            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+            *extra,
+        ]))
+        return table
+
+    def info_box(rows, background):
+        table = Table(
+            [[para(label, bold), para(value or "-", base)] for label, value in rows],
+            colWidths=[35 * mm, 145 * mm],
+        )
+        table.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, -1), background),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]))
+        return table
+
+    def value_boxes(boxes):
+        cells = [[para(label, box_label), para(value, box_value)] for label, value, _, _ in boxes]
+        table = Table([[Table([[c[0]], [c[1]]]) for c in cells]], colWidths=[85 * mm] * len(boxes))
+        style = [("VALIGN", (0, 0), (-1, -1), "MIDDLE"), ("TOPPADDING", (0, 0), (-1, -1), 6), ("BOTTOMPADDING", (0, 0), (-1, -1), 8)]
+        for i, (_, _, background, border) in enumerate(boxes):
+            style += [("BACKGROUND", (i, 0), (i, 0), background), ("BOX", (i, 0), (i, 0), 1, border)]
+        table.setStyle(TableStyle(style))
+        return table
+
+    def highlight(label, value, background):
+        table = Table([[para(label, bold)], [para(value, ParagraphStyle("hl", parent=bold, fontSize=11, leading=14))]], colWidths=[170 * mm])
+        table.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, -1), background),
+            ("BOX", (0, 0), (-1, -1), 1.5, rgb(5, 150, 105)),
+        ]))
+        return table
+
+    story = [
+        para(titolo, ParagraphStyle("title", parent=bold, fontSize=18, leading=22, alignment=TA_CENTER, textColor=accento)),
+        para(sottotitolo, subtitle),
+        Spacer(1, 8 * mm),
+    ]
+
+    azienda = data.get("azienda")
+    if azienda:
+        righe = [
+            ("AZIENDA:", azienda["ragione_sociale"]),
+            ("P.IVA / C.F.:", f"{azienda['partita_iva']} / {azienda['codice_fiscale']}"),
+            ("Indirizzo:", f"{azienda['indirizzo']}, {azienda['cap']} {azienda['citta']} ({azienda['provincia']})"),
+        ]
+        if azienda.get("rappresentante_legale"):
+            righe.append(("Rapp. Legale:", azienda["rappresentante_legale"]))
+        story += [info_box(righe, rgb(245, 245, 245)), Spacer(1, 4 * mm)]
+
+    righe = [("Data:", data_valutazione)]
+    if val.get("mansione"):
+        righe.append(("Mansione:", val["mansione"]))
+    if val.get("reparto"):
+        righe.append(("Reparto:", val["reparto"]))
+    story.append(info_box(righe, rgb(239, 246, 255) if esposizione else rgb(250, 245, 255)))
+
+    if esposizione:
+        misurazioni = data["misurazioni"]
+        story += [
+            para("Dati di Misurazione", section),
+            grid(
+                [["Attività/Postazione", "LEQ dB(A)", "Durata (min)", "Lpicco,C dB(C)"]] + [
+                    [para(m["attivita"] or "-", base), m["leq"] or "-", m["durata"] or "-", m["lpicco"] or "-"]
+                    for m in misurazioni
+                ],
+                [80, 30, 35, 35],
+            ),
+            para("Risultati della Valutazione", section),
+            value_boxes([
+                ("Livello di Esposizione Giornaliera", f"LEX,8h = {_num(val.get('lex'))} dB(A)", rgb(240, 249, 255), rgb(59, 130, 246)),
+                ("Livello di Picco Massimo", f"Lpicco,C = {_num(val.get('lpicco'))} dB(C)", rgb(250, 245, 255), rgb(124, 58, 237)),
+            ]),
+            Spacer(1, 6 * mm),
+            highlight("CLASSIFICAZIONE DEL RISCHIO", val.get("classe_rischio") or "-", rgb(*_colore_rischio(val.get("classe_rischio")))),
+            PageBreak(),
+            para("Valori Limite di Riferimento (D.Lgs. 81/2008)", section),
+            grid([
+                ["Livello di Azione/Limite", "LEX,8h", "Lpicco,C"],
+                ["Valore inferiore di azione", "80 dB(A)", "135 dB(C)"],
+                ["Valore superiore di azione", "85 dB(A)", "137 dB(C)"],
+                ["Valore limite di esposizione", "87 dB(A)", "140 dB(C)"],
+            ], [90, 45, 45]),
+            Spacer(1, 6 * mm),
+        ]
+        durata_totale = sum(float(m["durata"] or 0) for m in misurazioni)
+        story += [
+            para("Formula: LEX,8h = 10 × log10(Σ(10^(LEQi/10) × ti/480))", note),
+            para(f"Durata totale misurata: {durata_totale:g} minuti", note),
+        ]
+    else:
+        lex_dpi = _num(val.get("lex_per_dpi"))
+        story += [
+            para("Dispositivo di Protezione Individuale", section),
+            info_box([("DPI:", nome_dpi(val.get("dpi_selezionato")))], rgb(243, 232, 255)),
+            para("Valori di Attenuazione Sonora (HML)", section),
+            grid([
+                ["H (High) - Alte freq.", "M (Medium) - Medie freq.", "L (Low) - Basse freq."],
+                [f"{_num(val.get('h'))} dB", f"{_num(val.get('m'))} dB", f"{_num(val.get('l'))} dB"],
+            ], [56.67, 56.67, 56.66], extra=[("ALIGN", (0, 0), (-1, -1), "CENTER"), ("FONTSIZE", (0, 1), (-1, 1), 12)]),
+            Spacer(1, 4 * mm),
+            para(f"Livello di Rumore da Attenuare: LEX,8h = {lex_dpi} dB(A)", bold),
+            para("Risultati della Valutazione", section),
+            value_boxes([
+                ("Attenuazione Prevista (PNR)", f"{_num(val.get('pnr'))} dB", rgb(219, 234, 254), rgb(59, 130, 246)),
+                ("Livello Effettivo (L'eff)", f"{_num(val.get('leff'))} dB(A)", rgb(233, 213, 255), rgb(124, 58, 237)),
+            ]),
+            Spacer(1, 6 * mm),
+            highlight("VALUTAZIONE PROTEZIONE", val.get("protezione_adeguata") or "-", rgb(*_colore_protezione(val.get("protezione_adeguata")))),
+            para("Criteri di Interpretazione (UNI EN 458:2016)", section),
+            grid([
+                ["Livello L'eff", "Valutazione", "Note"],
+                ["< 65 dB(A)", "ECCESSIVA", "Rischio isolamento acustico"],
+                ["65-70 dB(A)", "BUONA", "Protezione sovradimensionata"],
+                ["70-80 dB(A)", "OTTIMALE", "Range ideale - Protezione adeguata"],
+                ["80-85 dB(A)", "ACCETTABILE", "Protezione al limite inferiore"],
+                ["> 85 dB(A)", "INSUFFICIENTE", "DPI inadeguato"],
+            ], [35, 45, 90], extra=[("BACKGROUND", (0, 3), (-1, 3), rgb(220, 252, 231))]),
+            Spacer(1, 6 * mm),
+            para(f"Calcolo: L'eff = LEX,8h - PNR = {lex_dpi} - {_num(val.get('pnr'))} = {_num(val.get('leff'))} dB(A)", note),
+            para("Il Metodo HML utilizza i valori H, M, L per calcolare l'attenuazione prevista", note),
+        ]
+
+    story.append(para(f"Valutazione del {data_valutazione}", note))
+
+    buffer = io.BytesIO()
+    # invariant=True: stesso input, stessi byte (niente data di creazione/ID casuali)
+    doc = SimpleDocTemplate(
+        buffer, pagesize=A4, invariant=True,
+        leftMargin=15 * mm, rightMargin=15 * mm, topMargin=15 * mm, bottomMargin=15 * mm,
+        title=titolo,
+    )
+    doc.build(story)
+    return buffer.getvalue()
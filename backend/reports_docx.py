@@ -0,0 +1,228 @@
+"""
+Report DOCX delle valutazioni (equivalente di src/utils/wordUtils.ts)
+Il template di base (margini, stili, tabelle statiche) viene compilato una
+sola volta per processo del pool; ogni report parte da una copia in memoria.
+"""
+from datetime import datetime
+from functools import lru_cache
+import io
+
+from docx import Document
+from docx.enum.table import WD_TABLE_ALIGNMENT
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.shared import Mm, Pt, RGBColor
+
+from dpi_database import nome_dpi
+
+VALORI_LIMITE = [
+    ("Livello di Azione/Limite", "LEX,8h", "Lpicco,C"),
+    ("Valore inferiore di azione", "80 dB(A)", "135 dB(C)"),
+    ("Valore superiore di azione", "85 dB(A)", "137 dB(C)"),
+    ("Valore limite di esposizione", "87 dB(A)", "140 dB(C)"),
+]
+
+CRITERI_EN458 = [
+    ("Livello L'eff", "Valutazione", "Note"),
+    ("< 65 dB(A)", "ECCESSIVA", "Rischio isolamento acustico"),
+    ("65-70 dB(A)", "BUONA", "Protezione sovradimensionata"),
+    ("70-80 dB(A)", "OTTIMALE ✓", "Range ideale - Protezione adeguata"),
+    ("80-85 dB(A)", "ACCETTABILE", "Protezione al limite inferiore"),
+    ("> 85 dB(A)", "INSUFFICIENTE", "DPI inadeguato"),
+]
+
+
+@lru_cache(maxsize=1)
+def template_bytes() -> bytes:
+    """Template compilato: pagina A4, margini e stili del report"""
+    doc = Document()
+    section = doc.sections[0]
+    section.page_width, section.page_height = Mm(210), Mm(297)
+    for side in ("left_margin", "right_margin", "top_margin", "bottom_margin"):
+        setattr(section, side, Mm(20))
+
+    normal = doc.styles["Normal"]
+    normal.font.name = "Calibri"
+    normal.font.size = Pt(10)
+    for name, size, color in (("Heading 1", 18, (30, 64, 175)), ("Heading 2", 12, (75, 85, 99))):
+        style = doc.styles[name]
+        style.font.size = Pt(size)
+        style.font.bold = True
+        style.font.color.rgb = RGBColor(*color)
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _num(value, decimals: int = 1) -> str:
+    try:
+        return f"{float(value):.{decimals}f}"
+    except (TypeError, ValueError):
+        return "-"
+
+
+def _data_it(value) -> str:
+    if not value:
+        return "-"
+    return datetime.fromisoformat(value).strftime("%d/%m/%Y")
+
+
+def _shade(cell, hex_color: str):
+    shading = OxmlElement("w:shd")
+    shading.set(qn("w:val"), "clear")
+    shading.set(qn("w:fill"), hex_color)
+    cell._tc.get_or_add_tcPr().append(shading)
+
+
+def _cell(cell, text, bold=False, center=False, size=None):
+    paragraph = cell.paragraphs[0]
+    run = paragraph.add_run(text if text not in (None, "") else "-")
+    run.bold = bold
+    if size:
+        run.font.size = Pt(size)
+    if center:
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+
+def _table(doc, rows, header=True, center_from=1, header_fill="1E40AF"):
+    table = doc.add_table(rows=len(rows), cols=len(rows[0]))
+    table.style = "Table Grid"
+    table.alignment = WD_TABLE_ALIGNMENT.CENTER
+    for r, values in enumerate(rows):
+        for c, value in enumerate(values):
+            cell = table.cell(r, c)
+            is_header = header and r == 0
+            _cell(cell, value, bold=is_header, center=is_header or c >= center_from)
+            if is_header:
+                _shade(cell, header_fill)
+                cell.paragraphs[0].runs[0].font.color.rgb = RGBColor(255, 255, 255)
+    return table
+
+
+def _label_table(doc, rows):
+    table = doc.add_table(rows=len(rows), cols=2)
+    table.style = "Table Grid"
+    for r, (label, value) in enumerate(rows):
+        _cell(table.cell(r, 0), label, bold=True)
+        _cell(table.cell(r, 1), value)
+    return table
+
+
+def _value_boxes(doc, boxes):
+    table = doc.add_table(rows=2, cols=len(boxes))
+    table.style = "Table Grid"
+    for c, (label, value, fill) in enumerate(boxes):
+        _cell(table.cell(0, c), label, center=True)
+        _cell(table.cell(1, c), value, bold=True, center=True, size=16)
+        _shade(table.cell(0, c), fill)
+        _shade(table.cell(1, c), fill)
+    return table
+
+
+def _note(doc, text):
+    run = doc.add_paragraph().add_run(text)
+    run.italic = True
+    run.font.size = Pt(8)
+    run.font.color.rgb = RGBColor(107, 114, 128)
+
+
+def render_docx(data: dict) -> bytes:
+    """Report Word con lo stesso contenuto di src/utils/wordUtils.ts"""
+    doc = Document(io.BytesIO(template_bytes()))
+    esposizione = data["tipo"] == "esposizione"
+    val = data["valutazione"]
+    data_valutazione = _data_it(val.get("created_at"))
+
+    title = doc.add_heading("REPORT VALUTAZIONE RISCHIO RUMORE" if esposizione else "VALUTAZIONE DPI UDITIVI", level=1)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    subtitle = doc.add_paragraph("D.Lgs. 81/2008 - Titolo VIII Capo II" if esposizione else "Metodo HML - UNI EN 458:2016")
+    subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    azienda = data.get("azienda")
+    if azienda:
+        doc.add_heading("AZIENDA", level=2)
+        righe = [
+            ("Ragione Sociale:", azienda["ragione_sociale"]),
+            ("P.IVA:", azienda["partita_iva"]),
+            ("Codice Fiscale:", azienda["codice_fiscale"]),
+            ("Indirizzo:", f"{azienda['indirizzo']}, {azienda['cap']} {azienda['citta']} ({azienda['provincia']})"),
+        ]
+        if azienda.get("rappresentante_legale"):
+            righe.append(("Rappresentante Legale:", azienda["rappresentante_legale"]))
+        _label_table(doc, righe)
+
+    doc.add_heading("INFORMAZIONI GENERALI", level=2)
+    righe = [("Data:", data_valutazione)]
+    if val.get("mansione"):
+        righe.append(("Mansione:", val["mansione"]))
+    if val.get("reparto"):
+        righe.append(("Reparto:", val["reparto"]))
+    _label_table(doc, righe)
+
+    if esposizione:
+        misurazioni = data["misurazioni"]
+        doc.add_heading("DATI DI MISURAZIONE", level=2)
+        _table(doc, [("Attività/Postazione", "LEQ dB(A)", "Durata (min)", "Lpicco,C dB(C)")] + [
+            (m["attivita"], m["leq"], m["durata"], m["lpicco"]) for m in misurazioni
+        ])
+
+        doc.add_heading("RISULTATI DELLA VALUTAZIONE", level=2)
+        _value_boxes(doc, [
+            ("Livello di Esposizione Giornaliera", f"LEX,8h = {_num(val.get('lex'))} dB(A)", "F0F9FF"),
+            ("Livello di Picco Massimo", f"Lpicco,C = {_num(val.get('lpicco'))} dB(C)", "FAF5FF"),
+        ])
+
+        doc.add_heading("CLASSIFICAZIONE DEL RISCHIO", level=2)
+        paragraph = doc.add_paragraph()
+        paragraph.add_run(val.get("classe_rischio") or "-").bold = True
+
+        doc.add_page_break()
+        doc.add_heading("VALORI LIMITE DI RIFERIMENTO (D.Lgs. 81/2008)", level=2)
+        _table(doc, VALORI_LIMITE)
+
+        doc.add_paragraph()
+        durata_totale = sum(float(m["durata"] or 0) for m in misurazioni)
+        _note(doc, "Formula: LEX,8h = 10 × log₁₀(Σ(10^(LEQi/10) × ti/480))")
+        _note(doc, f"Durata totale misurata: {durata_totale:g} minuti")
+    else:
+        lex_dpi = _num(val.get("lex_per_dpi"))
+        doc.add_heading("DISPOSITIVO DI PROTEZIONE INDIVIDUALE", level=2)
+        doc.add_paragraph().add_run(nome_dpi(val.get("dpi_selezionato"))).bold = True
+
+        doc.add_heading("VALORI DI ATTENUAZIONE SONORA (HML)", level=2)
+        _table(doc, [
+            ("H (High)\nAlte frequenze", "M (Medium)\nMedie frequenze", "L (Low)\nBasse frequenze"),
+            (f"{_num(val.get('h'))} dB", f"{_num(val.get('m'))} dB", f"{_num(val.get('l'))} dB"),
+        ], center_from=0, header_fill="7C3AED")
+
+        paragraph = doc.add_paragraph()
+        paragraph.add_run("Livello di Rumore da Attenuare: ").bold = True
+        run = paragraph.add_run(f"LEX,8h = {lex_dpi} dB(A)")
+        run.bold = True
+        run.font.size = Pt(12)
+
+        doc.add_heading("RISULTATI DELLA VALUTAZIONE", level=2)
+        _value_boxes(doc, [
+            ("Attenuazione Prevista (PNR)", f"{_num(val.get('pnr'))} dB", "DBEAFE"),
+            ("Livello Effettivo (L'eff)", f"{_num(val.get('leff'))} dB(A)", "E9D5FF"),
+        ])
+
+        doc.add_heading("VALUTAZIONE PROTEZIONE", level=2)
+        doc.add_paragraph().add_run(val.get("protezione_adeguata") or "-").bold = True
+
+        doc.add_heading("CRITERI DI INTERPRETAZIONE (UNI EN 458:2016)", level=2)
+        table = _table(doc, CRITERI_EN458, center_from=0, header_fill="7C3AED")
+        for cell in table.rows[3].cells:
+            _shade(cell, "DCFCE7")
+
+        doc.add_paragraph()
+        _note(doc, f"Calcolo: L'eff = LEX,8h - PNR = {lex_dpi} - {_num(val.get('pnr'))} = {_num(val.get('leff'))} dB(A)")
+        _note(doc, "Il Metodo HML utilizza i valori H, M, L per calcolare l'attenuazione prevista")
+
+    _note(doc, f"Valutazione del {data_valutazione}")
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,197 @@
+"""
+Analisi "what-if" per rientrare sotto un valore d'azione
+Le attività di una o più valutazioni sono array piatti con l'indice della
+valutazione (gruppo): ogni calcolo è un'unica operazione vettoriale su
+tutte le attività di tutte le valutazioni, quindi la modalità per azienda
+costa come quella per singola valutazione.
+
+Con E_i = T_i/480 · 10^(0.1 L_i) e E* = 10^(0.1 LEX*):
+- durata massima dell'attività i (le altre invariate): (E* - (E - E_i)) · 480 / 10^(0.1 L_i)
+- riduzione di Leq dell'attività i da sola: 10 log10(E_i / (E* - (E - E_i)))
+- piano ottimo sui livelli: min Σ w_i ΔL_i con ΔL_i <= massimo, risolto dalle
+  condizioni KKT (E_i 10^(-0.1 ΔL_i) proporzionale a w_i per le attività non ai limiti)
+  con una bisezione sul moltiplicatore, vettoriale su tutti i gruppi
+- piano ottimo sulle durate: zaino frazionario (minuti tolti prima dove
+  ogni minuto vale più energia per unità di peso), con cumulate per gruppo
+"""
+from collections import OrderedDict
+import math
+import os
+import threading
+
+import numpy as np
+
+# Risultati tenuti in memoria per worker (chiave: hash degli ingressi)
+RIDUZIONE_CACHE_MAX = int(os.getenv("RIDUZIONE_CACHE_MAX", "1000"))
+
+# Iterazioni della bisezione: l'intervallo iniziale si riduce di 2^-60
+_ITERAZIONI = 60
+
+# Allargamenti massimi (10 dB ciascuno) dell'estremo superiore della bisezione
+_ESPANSIONI = 30
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _energie(leq, durata, gruppo, n_gruppi: int) -> tuple:
+    leq = np.asarray(leq, dtype=np.float64)
+    durata = np.asarray(durata, dtype=np.float64)
+    gruppo = np.asarray(gruppo, dtype=np.int64)
+    energia = durata / 480 * 10 ** (0.1 * leq)
+    return leq, durata, gruppo, energia, np.bincount(gruppo, weights=energia, minlength=n_gruppi)
+
+
+def _lex(energia_gruppo: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore"):
+        return np.where(energia_gruppo > 0, 10 * np.log10(energia_gruppo), np.nan)
+
+
+def analisi(leq, durata, gruppo, n_gruppi: int, obiettivi) -> dict:
+    """
+    Durata massima e riduzione di Leq di ogni attività presa da sola
+
+    Returns:
+        lex: (G,), riduzione_uniforme: (G, K) dB su tutte le attività,
+        durata_max: (M, K) minuti, riduzione_leq: (M, K) dB (NaN = non basta
+        intervenire solo su questa attività)
+    """
+    leq, durata, gruppo, energia, energia_gruppo = _energie(leq, durata, gruppo, n_gruppi)
+    obiettivi = np.asarray(obiettivi, dtype=np.float64)
+    lex = _lex(energia_gruppo)
+
+    # Energia che l'attività può ancora avere, per ogni obiettivo: (M, K)
+    disponibile = 10 ** (0.1 * obiettivi)[None, :] - (energia_gruppo[gruppo] - energia)[:, None]
+    positiva = disponibile > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        durata_max = np.where(positiva, disponibile * 480 / 10 ** (0.1 * leq)[:, None], 0.0)
+        riduzione = np.where(positiva, np.maximum(10 * np.log10(energia[:, None] / disponibile), 0.0), np.nan)
+
+    return {
+        "lex": lex,
+        "riduzione_uniforme": np.maximum(np.nan_to_num(lex)[:, None] - obiettivi[None, :], 0.0),
+        "durata_max": durata_max,
+        "riduzione_leq": riduzione,
+    }
+
+
+def ottimizza_livelli(leq, durata, gruppo, n_gruppi: int, obiettivo: float,
+                      riduzione_max=None, peso=None) -> dict:
+    """
+    Riduzioni di Leq per attività di costo minimo Σ peso_i · ΔL_i che portano
+    ogni gruppo a LEX <= obiettivo, con 0 <= ΔL_i <= riduzione_max_i
+
+    Returns:
+        riduzione: (M,) dB, lex: (G,) dopo le riduzioni, fattibile: (G,)
+    """
+    leq, durata, gruppo, energia, energia_gruppo = _energie(leq, durata, gruppo, n_gruppi)
+    m = len(leq)
+    massimo = np.full(m, np.inf) if riduzione_max is None else np.asarray(riduzione_max, dtype=np.float64)
+    peso = np.ones(m) if peso is None else np.asarray(peso, dtype=np.float64)
+    bersaglio = 10 ** (0.1 * obiettivo)
+    attive = energia > 0
+
+    # Per un moltiplicatore log10(mu): ΔL_i = clip(10 (log10 mu + log10(E_i / w_i)), 0, max_i)
+    with np.errstate(divide="ignore"):
+        base = np.where(attive, np.log10(energia / peso), -np.inf)
+
+    def riduzioni(log_mu):
+        return np.where(attive, np.clip(10 * (log_mu[gruppo] + base), 0, massimo), 0.0)
+
+    def residua(delta):
+        return np.bincount(gruppo, weights=energia * 10 ** (-0.1 * delta), minlength=n_gruppi)
+
+    # Estremi: con basso nessuna attività è ridotta, con alto tutte sono al massimo
+    finito = np.where(attive, base, np.nan)
+    basso = np.full(n_gruppi, np.inf)
+    alto = np.full(n_gruppi, -np.inf)
+    np.fmin.at(basso, gruppo, -finito)
+    np.fmax.at(alto, gruppo, -finito + np.where(np.isinf(massimo), 0.0, massimo) / 10)
+    basso = np.where(np.isfinite(basso), basso, 0.0)
+    alto = np.where(np.isfinite(alto), alto, 0.0)
+    # Con attività senza limite alto può non bastare: si allarga di 10 dB alla volta
+    illimitato = np.zeros(n_gruppi, dtype=bool)
+    np.logical_or.at(illimitato, gruppo, np.isinf(massimo) & attive)
+    for _ in range(_ESPANSIONI):
+        da_allargare = illimitato & (residua(riduzioni(alto)) > bersaglio)
+        if not da_allargare.any():
+            break
+        alto = np.where(da_allargare, alto + 1, alto)
+
+    for _ in range(_ITERAZIONI):
+        medio = (basso + alto) / 2
+        sopra = residua(riduzioni(medio)) > bersaglio
+        basso = np.where(sopra, medio, basso)
+        alto = np.where(sopra, alto, medio)
+
+    # Gruppi già sotto l'obiettivo: nessun intervento
+    gia_conformi = energia_gruppo <= bersaglio
+    delta = np.where(gia_conformi[gruppo], 0.0, riduzioni(alto))
+    energia_finale = residua(delta)
+    return {
+        "riduzione": delta,
+        "lex": _lex(energia_finale),
+        "fattibile": energia_finale <= bersaglio * (1 + 1e-9),
+    }
+
+
+def ottimizza_durate(leq, durata, gruppo, n_gruppi: int, obiettivo: float,
+                     durata_min=None, peso=None, leq_sostituzione=None) -> dict:
+    """
+    Minuti da togliere alle attività (costo minimo Σ peso_i · minuti_i) per
+    portare ogni gruppo a LEX <= obiettivo, con durata_i >= durata_min_i.
+    Con leq_sostituzione i minuti tolti sono passati a quel livello (es. pausa).
+
+    Returns:
+        minuti: (M,) tolti a ogni attività, lex: (G,) dopo, fattibile: (G,)
+    """
+    leq, durata, gruppo, energia, energia_gruppo = _energie(leq, durata, gruppo, n_gruppi)
+    m = len(leq)
+    durata_min = np.zeros(m) if durata_min is None else np.minimum(np.asarray(durata_min, dtype=np.float64), durata)
+    peso = np.ones(m) if peso is None else np.asarray(peso, dtype=np.float64)
+    fondo = 0.0 if leq_sostituzione is None else 10 ** (0.1 * leq_sostituzione)
+
+    # Energia risparmiata per minuto tolto e minuti disponibili
+    risparmio = np.maximum((10 ** (0.1 * leq) - fondo) / 480, 0.0)
+    disponibili = np.where(risparmio > 0, np.maximum(durata - durata_min, 0.0), 0.0)
+    capacita = risparmio * disponibili
+    deficit = np.maximum(energia_gruppo - 10 ** (0.1 * obiettivo), 0.0)
+
+    # Ordine per gruppo e per risparmio per unità di peso decrescente
+    ordine = np.lexsort((-risparmio / peso, gruppo))
+    cumulata = np.cumsum(capacita[ordine])
+    inizio_gruppo = np.searchsorted(gruppo[ordine], np.arange(n_gruppi))
+    precedente = np.concatenate(([0.0], cumulata))[inizio_gruppo][gruppo[ordine]]
+    prima = cumulata - capacita[ordine] - precedente   # capacità delle attività migliori
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        presi = np.clip((deficit[gruppo[ordine]] - prima) / risparmio[ordine], 0, disponibili[ordine])
+    minuti = np.zeros(m)
+    minuti[ordine] = np.nan_to_num(presi)
+
+    energia_finale = energia_gruppo - np.bincount(gruppo, weights=minuti * risparmio, minlength=n_gruppi)
+    return {
+        "minuti": minuti,
+        "lex": _lex(energia_finale),
+        "fattibile": energia_finale <= 10 ** (0.1 * obiettivo) * (1 + 1e-9),
+    }
+
+
+def cached(chiave: str, calcola):
+    """Risultato di calcola() memorizzato per `chiave` (hash degli ingressi)"""
+    with _lock:
+        if chiave in _cache:
+            _cache.move_to_end(chiave)
+            return _cache[chiave]
+    risultato = calcola()
+    with _lock:
+        _cache[chiave] = risultato
+        while len(_cache) > RIDUZIONE_CACHE_MAX:
+            _cache.popitem(last=False)
+    return risultato
+
+
+def arrotonda(valore, cifre: int = 1):
+    """float arrotondato, None per NaN/infinito (per le risposte JSON)"""
+    valore = float(valore)
+    return round(valore, cifre) if math.isfinite(valore) else None
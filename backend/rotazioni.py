@@ -0,0 +1,278 @@
+"""
+Pianificazione delle rotazioni tra mansioni di un reparto
+Il turno di ogni lavoratore è diviso in slot; il problema è assegnare gli
+slot richiesti da ogni attività (fabbisogno) ai lavoratori abilitati senza
+superarne il turno, in modo che il LEX,8h più alto sia il minimo possibile.
+Il LEX dipende solo da quanti slot di ogni attività ha un lavoratore, non
+dall'ordine, quindi la soluzione è una matrice di conteggi (lavoratori x attività).
+
+1. Costruzione greedy: gli slot delle attività più rumorose per primi, ognuno
+   al lavoratore abilitato con meno energia accumulata (gli slot di
+   un'attività sono distribuiti insieme, senza un ciclo per slot).
+2. Ricerca locale: spostamenti di uno slot e scambi tra due lavoratori che
+   riducono Σ E_w² (energia di ogni lavoratore al quadrato: premia il
+   bilanciamento e non ha i plateau del solo massimo). Ogni iterazione valuta
+   con NumPy tutti i lavoratori destinazione insieme.
+"""
+from typing import Callable, Optional
+import time
+
+import numpy as np
+
+
+class RotazioneImpossibile(ValueError):
+    """Il fabbisogno non può essere coperto dai lavoratori abilitati"""
+
+
+def _riempi(energia_lav: np.ndarray, residua: np.ndarray, candidati: np.ndarray, e: float, n: int) -> np.ndarray:
+    """
+    Slot per lavoratore quando n slot di energia e vanno, uno alla volta, al
+    candidato con meno energia: calcolati insieme invece che slot per slot
+    """
+    k = np.zeros(len(energia_lav), dtype=np.int64)
+    indici = np.flatnonzero(candidati)
+    if not n:
+        return k
+    if e <= 0:
+        # Chi riceve uno slot resta il meno carico: si riempiono i turni in ordine di energia
+        for w in indici[np.argsort(energia_lav[indici], kind="stable")]:
+            k[w] = min(int(residua[w]), n)
+            n -= k[w]
+            if not n:
+                break
+        return k
+    # Il j-esimo slot di w arriva quando la sua energia è E_w + j e: si assegnano gli
+    # n valori più piccoli di {E_w + j e, j < residua_w}, trovando la soglia per bisezione
+    base, limite = energia_lav[indici], residua[indici]
+
+    def fino_a(soglia):
+        return np.clip(np.floor((soglia - base) / e).astype(np.int64) + 1, 0, limite)
+
+    # alto = oltre l'ultimo slot di ognuno: fino_a(alto) assegna tutta la capacità
+    basso, alto = float(base.min()) - e, float((base + limite * e).max())
+    for _ in range(200):
+        medio = (basso + alto) / 2
+        if medio in (basso, alto):
+            break
+        if fino_a(medio).sum() >= n:
+            alto = medio
+        else:
+            basso = medio
+    assegnati = fino_a(basso)
+    # Slot restanti (valori in (basso, alto]): ai primi lavoratori, come argmin
+    extra = fino_a(alto) - assegnati
+    restanti = n - int(assegnati.sum())
+    assegnati += np.minimum(extra, np.maximum(restanti - (np.cumsum(extra) - extra), 0))
+    k[indici] = assegnati
+    return k
+
+
+def _greedy(energia: np.ndarray, fabbisogno: np.ndarray, capacita: np.ndarray,
+            abilitato: np.ndarray, base: np.ndarray, ordine) -> np.ndarray:
+    n_lav, n_att = abilitato.shape
+    conteggi = np.zeros((n_lav, n_att), dtype=np.int64)
+    residua = capacita.astype(np.int64).copy()
+    energia_lav = base.copy()
+    for a in ordine:
+        n = int(fabbisogno[a])
+        if not n:
+            continue
+        candidati = abilitato[:, a] & (residua > 0)
+        if residua[candidati].sum() < n:
+            return None
+        k = _riempi(energia_lav, residua, candidati, float(energia[a]), n)
+        conteggi[:, a] += k
+        residua -= k
+        energia_lav += k * energia[a]
+    return conteggi
+
+
+def costruisci(energia, fabbisogno, capacita, abilitato, base=None) -> np.ndarray:
+    """
+    Assegnazione iniziale greedy (base: energia di partenza di ogni lavoratore)
+
+    Raises:
+        RotazioneImpossibile: un'attività resta senza lavoratori abilitati liberi
+    """
+    energia = np.asarray(energia, dtype=np.float64)
+    abilitato = np.asarray(abilitato, dtype=bool)
+    base = np.zeros(abilitato.shape[0]) if base is None else np.asarray(base, dtype=np.float64)
+    if np.asarray(fabbisogno).sum() > np.asarray(capacita).sum():
+        raise RotazioneImpossibile("Il fabbisogno supera la somma dei turni dei lavoratori")
+    # Prima le attività più rumorose; se così non si copre tutto, prima le
+    # attività con meno lavoratori abilitati
+    for ordine in (np.argsort(-energia), np.lexsort((-energia, abilitato.sum(axis=0)))):
+        conteggi = _greedy(energia, fabbisogno, capacita, abilitato, base, ordine)
+        if conteggi is not None:
+            return conteggi
+    if any(fabbisogno[a] and not abilitato[:, a].any() for a in range(len(energia))):
+        raise RotazioneImpossibile("Attività con fabbisogno senza lavoratori abilitati")
+    raise RotazioneImpossibile("Lavoratori abilitati insufficienti per il fabbisogno")
+
+
+def _sbloccati(lavoratori: np.ndarray, partner: int, conteggi: np.ndarray, energia: np.ndarray,
+               energia_lav: np.ndarray, liberi: np.ndarray, abilitato: np.ndarray,
+               differenza: np.ndarray, tolleranza: float) -> np.ndarray:
+    """
+    Quali lavoratori (bloccati) hanno ora una mossa migliorativa verso partner
+    Gli altri loro spostamenti e scambi non sono cambiati: stessi criteri di migliora
+    """
+    delta = energia_lav[partner] - energia_lav[lavoratori]
+    presenti = conteggi[lavoratori] > 0
+    sblocca = np.zeros(len(lavoratori), dtype=bool)
+    if liberi[partner] > 0:
+        guadagno = 2 * energia[None, :] * (delta[:, None] + energia[None, :])
+        sblocca |= (presenti & abilitato[partner][None, :] & (guadagno < -tolleranza)).any(axis=1)
+    # Scambi: il lavoratore cede a (abilitato per partner), riceve b (presente in partner)
+    d = differenza[None, :, :]
+    guadagno = 2 * d * (delta[:, None, None] + d)
+    possibili = ((presenti & abilitato[partner][None, :])[:, :, None]
+                 & (abilitato[lavoratori] & (conteggi[partner] > 0)[None, :])[:, None, :]
+                 & (d > 0))
+    sblocca |= (possibili & (guadagno < -tolleranza)).any(axis=(1, 2))
+    return sblocca
+
+
+def migliora(conteggi: np.ndarray, energia, capacita, abilitato, scadenza: float,
+             progresso: Optional[Callable[[float], None]] = None, base=None,
+             max_iterazioni: int = 100_000) -> tuple:
+    """
+    Ricerca locale a miglioramento (spostamenti e scambi di slot) fino a un
+    ottimo locale, alla scadenza (time.monotonic()) o a max_iterazioni
+
+    Returns:
+        (conteggi, iterazioni eseguite)
+    """
+    conteggi = conteggi.copy()
+    energia = np.asarray(energia, dtype=np.float64)
+    abilitato = np.asarray(abilitato, dtype=bool)
+    capacita = np.asarray(capacita, dtype=np.int64)
+    energia_lav = conteggi @ energia
+    if base is not None:
+        energia_lav = energia_lav + np.asarray(base, dtype=np.float64)
+    liberi = capacita - conteggi.sum(axis=1)
+    # Differenze e_a - e_b per gli scambi (a dal lavoratore carico, b dall'altro)
+    differenza = energia[:, None] - energia[None, :]
+    # Guadagni più piccoli sono errori di arrotondamento (le energie arrivano a 1e10):
+    # accettarli farebbe ciclare la ricerca su mosse a guadagno nullo
+    tolleranza = 1e-9 * float(np.abs(energia).max(initial=0.0)) * float(np.abs(energia_lav).max(initial=1.0))
+
+    iterazioni = 0
+    inizio = time.monotonic()
+    bloccati = np.zeros(len(energia_lav), dtype=bool)   # lavoratori senza mosse migliorative
+    while iterazioni < max_iterazioni and time.monotonic() < scadenza:
+        iterazioni += 1
+        candidati = np.where(bloccati, -np.inf, energia_lav)
+        w1 = int(np.argmax(candidati))
+        if not np.isfinite(candidati[w1]):
+            break
+        e1 = energia_lav[w1]
+
+        migliore, mossa = 0.0, None
+        # Spostamento di uno slot di a da w1 a w2: ΔΣE² = 2 e_a (E2 - E1 + e_a)
+        for a in np.flatnonzero(conteggi[w1]):
+            possibili = abilitato[:, a] & (liberi > 0)
+            possibili[w1] = False
+            if not possibili.any():
+                continue
+            guadagno = np.where(possibili, 2 * energia[a] * (energia_lav - e1 + energia[a]), np.inf)
+            w2 = int(np.argmin(guadagno))
+            if guadagno[w2] < migliore - tolleranza:
+                migliore, mossa = guadagno[w2], ("sposta", a, w2, None)
+        # Scambio di a (da w1) con b (da w2): ΔΣE² = 2 d (E2 - E1 + d), d = e_a - e_b > 0;
+        # per ogni a tutte le coppie (w2, b) in un'unica matrice (W, A)
+        for a in np.flatnonzero(conteggi[w1]):
+            d = differenza[a]
+            colonne = (d > 0) & abilitato[w1]
+            if not colonne.any():
+                continue
+            possibili = abilitato[:, a, None] & (conteggi > 0) & colonne[None, :]
+            possibili[w1] = False
+            guadagno = np.where(possibili, 2 * d[None, :] * (energia_lav[:, None] - e1 + d[None, :]), np.inf)
+            w2, b = np.unravel_index(int(np.argmin(guadagno)), guadagno.shape)
+            if guadagno[w2, b] < migliore - tolleranza:
+                migliore, mossa = guadagno[w2, b], ("scambia", a, int(w2), int(b))
+
+        if mossa is None:
+            bloccati[w1] = True
+            continue
+        tipo, a, w2, b = mossa
+        conteggi[w1, a] -= 1
+        conteggi[w2, a] += 1
+        if tipo == "sposta":
+            liberi[w1] += 1
+            liberi[w2] -= 1
+            energia_lav[w1] -= energia[a]
+            energia_lav[w2] += energia[a]
+        else:
+            conteggi[w2, b] -= 1
+            conteggi[w1, b] += 1
+            energia_lav[w1] -= differenza[a, b]
+            energia_lav[w2] += differenza[a, b]
+        # Solo w1 e w2 sono cambiati: si sbloccano loro e chi ora ha una mossa verso di loro
+        bloccati[w1] = bloccati[w2] = False
+        fermi = np.flatnonzero(bloccati)
+        if len(fermi):
+            for partner in (w1, w2):
+                fermi = fermi[~_sbloccati(fermi, partner, conteggi, energia, energia_lav,
+                                          liberi, abilitato, differenza, tolleranza)]
+            bloccati[:] = False
+            bloccati[fermi] = True
+
+        if progresso is not None and iterazioni % 100 == 0:
+            durata = scadenza - inizio
+            progresso(min((time.monotonic() - inizio) / durata, 1.0) if durata > 0 else 1.0)
+    return conteggi, iterazioni
+
+
+def lex_lavoratori(conteggi: np.ndarray, energia_slot, energia_base) -> np.ndarray:
+    """LEX,8h di ogni lavoratore: energia degli slot assegnati più quella di base (riposo)"""
+    energia_lav = conteggi @ np.asarray(energia_slot, dtype=np.float64) + np.asarray(energia_base, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        return np.where(energia_lav > 0, 10 * np.log10(energia_lav), np.nan)
+
+
+def pianifica(leq, fabbisogno, turni, abilitato, slot: float = 15.0, leq_riposo: Optional[float] = None,
+              tempo_max: float = 5.0, progresso: Optional[Callable[[float], None]] = None) -> dict:
+    """
+    Rotazione che minimizza il LEX,8h più alto del reparto
+
+    Args:
+        leq: (A,) Leq di ogni attività
+        fabbisogno: (A,) minuti per turno da coprire per attività (arrotondati per eccesso allo slot)
+        turni: (W,) minuti di turno di ogni lavoratore
+        abilitato: (W, A) attività che ogni lavoratore può svolgere
+        leq_riposo: livello dei minuti di turno senza attività assegnata (None = nessuna esposizione)
+        progresso: chiamata con la frazione completata (0-1)
+
+    Returns:
+        conteggi: (W, A) slot assegnati, lex: (W,), iterazioni
+
+    Raises:
+        RotazioneImpossibile: fabbisogno non copribile
+    """
+    leq = np.asarray(leq, dtype=np.float64)
+    turni = np.asarray(turni, dtype=np.float64)
+    slot_fabbisogno = np.ceil(np.asarray(fabbisogno, dtype=np.float64) / slot - 1e-9).astype(np.int64)
+    capacita = np.floor(turni / slot + 1e-9).astype(np.int64)
+
+    # Uno slot di attività prende il posto di uno slot di riposo
+    riposo = 0.0 if leq_riposo is None else 10 ** (0.1 * leq_riposo)
+    energia_slot = slot / 480 * (10 ** (0.1 * leq) - riposo)
+    energia_base = turni / 480 * riposo
+
+    conteggi = costruisci(energia_slot, slot_fabbisogno, capacita, abilitato, energia_base)
+    if progresso is not None:
+        progresso(0.1)
+    conteggi, iterazioni = migliora(
+        conteggi, energia_slot, capacita, abilitato, time.monotonic() + tempo_max,
+        None if progresso is None else (lambda f: progresso(0.1 + 0.85 * f)),
+        base=energia_base,
+    )
+    if progresso is not None:
+        progresso(1.0)
+    return {
+        "conteggi": conteggi,
+        "lex": lex_lavoratori(conteggi, energia_slot, energia_base),
+        "iterazioni": iterazioni,
+    }
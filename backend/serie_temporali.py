@@ -0,0 +1,278 @@
+"""
+Serie temporali grezze dei fonometri/dosimetri (Leq e Lpicco per campione)
+Le serie non sono righe SQL: ogni serie è un oggetto binario nello storage
+(prefisso serie/), collegato alla valutazione da valutazioni_esposizione.serie_key.
+
+Formato SRT2 (little endian):
+    intestazione   magic, campioni, intervallo (s), campioni per blocco,
+                   numero di blocchi, presenza del Lpicco
+    indice         per blocco: offset e lunghezza nel file, campioni validi,
+                   Leq min/max, Lpicco max, somma delle energie 10^(0.1 Leq)
+    blocchi        zlib(Leq float32 + Lpicco float32) di ogni blocco
+
+Intestazione e indice stanno in poche centinaia di byte: un aggregato su un
+intervallo usa l'indice per i blocchi interamente compresi e legge (con
+richieste HTTP Range) solo i blocchi ai bordi; le letture di un intervallo
+scaricano solo i blocchi che lo coprono, contigui in un'unica richiesta.
+"""
+import math
+import os
+import struct
+import uuid
+import zlib
+
+import numpy as np
+
+from storage import storage
+
+SERIE_PREFIX = "serie/"
+
+# Campioni per blocco compresso (3600 = un'ora a 1 s)
+SERIE_CHUNK_CAMPIONI = int(os.getenv("SERIE_CHUNK_CAMPIONI", "3600"))
+
+_MAGIC = b"SRT2"
+_MAGIC_V1 = b"SRT1"
+# magic, campioni, intervallo, campioni per blocco, blocchi, ha_picco
+_HEADER = struct.Struct("<4sIfIIB3x")
+# Formato SRT1 (un unico blocco compresso, senza indice)
+_HEADER_V1 = struct.Struct("<4sIfB")
+
+_INDICE = np.dtype([
+    ("offset", "<u8"),
+    ("lunghezza", "<u4"),
+    ("validi", "<u4"),
+    ("leq_min", "<f4"),
+    ("leq_max", "<f4"),
+    ("picco_max", "<f4"),
+    ("energia", "<f8"),
+])
+
+
+def _riduci(blocchi: np.ndarray, funzione) -> np.ndarray:
+    """min/max per riga ignorando i NaN; NaN per le righe senza valori"""
+    validi = ~np.isnan(blocchi)
+    neutro = np.inf if funzione is np.minimum else -np.inf
+    risultato = funzione.reduce(np.where(validi, blocchi, neutro), axis=1)
+    return np.where(validi.any(axis=1), risultato, np.nan)
+
+
+def codifica(leq, lpicco, intervallo: float, campioni_blocco: int = SERIE_CHUNK_CAMPIONI) -> bytes:
+    """Serie (NaN = campione mancante) nel formato SRT2"""
+    leq = np.asarray(leq, dtype="<f4")
+    ha_picco = lpicco is not None
+    picco = np.asarray(lpicco, dtype="<f4") if ha_picco else None
+    n = len(leq)
+    blocchi = math.ceil(n / campioni_blocco)
+
+    # Riepiloghi di tutti i blocchi in una passata su una matrice (blocchi, campioni_blocco)
+    matrice = np.full(blocchi * campioni_blocco, np.nan, dtype=np.float64)
+    matrice[:n] = leq
+    matrice = matrice.reshape(blocchi, campioni_blocco)
+    indice = np.zeros(blocchi, dtype=_INDICE)
+    indice["validi"] = np.count_nonzero(~np.isnan(matrice), axis=1)
+    indice["leq_min"] = _riduci(matrice, np.minimum)
+    indice["leq_max"] = _riduci(matrice, np.maximum)
+    indice["energia"] = np.nansum(10 ** (0.1 * matrice), axis=1)
+    if ha_picco:
+        matrice_picco = np.full(blocchi * campioni_blocco, np.nan, dtype=np.float64)
+        matrice_picco[:n] = picco
+        indice["picco_max"] = _riduci(matrice_picco.reshape(blocchi, campioni_blocco), np.maximum)
+    else:
+        indice["picco_max"] = np.nan
+
+    compressi = []
+    for b in range(blocchi):
+        parte = slice(b * campioni_blocco, (b + 1) * campioni_blocco)
+        payload = leq[parte].tobytes() + (picco[parte].tobytes() if ha_picco else b"")
+        compressi.append(zlib.compress(payload, 6))
+    indice["lunghezza"] = [len(c) for c in compressi]
+    inizio_dati = _HEADER.size + blocchi * _INDICE.itemsize
+    lunghezze = indice["lunghezza"].astype(np.uint64)
+    indice["offset"] = inizio_dati + np.cumsum(lunghezze) - lunghezze
+
+    header = _HEADER.pack(_MAGIC, n, intervallo, campioni_blocco, blocchi, ha_picco)
+    return header + indice.tobytes() + b"".join(compressi)
+
+
+def _decodifica_v1(data: bytes) -> tuple:
+    _, campioni, intervallo, ha_picco = _HEADER_V1.unpack_from(data)
+    valori = np.frombuffer(zlib.decompress(data[_HEADER_V1.size:]), dtype="<f4")
+    return valori[:campioni], (valori[campioni:] if ha_picco else None), intervallo
+
+
+class Serie:
+    """
+    Lettore di una serie SRT2
+
+    Args:
+        leggi: Funzione (offset, lunghezza) -> bytes sulla sorgente
+               (richiesta Range sullo storage o slicing di bytes in memoria)
+    """
+
+    def __init__(self, leggi):
+        self._leggi = leggi
+        magic, self.campioni, self.intervallo, self.campioni_blocco, blocchi, self.ha_picco = \
+            _HEADER.unpack(leggi(0, _HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError("Formato della serie temporale non riconosciuto")
+        self.indice = np.frombuffer(leggi(_HEADER.size, blocchi * _INDICE.itemsize), dtype=_INDICE)
+        self.letture = 0  # richieste di blocchi eseguite (diagnostica)
+
+    @property
+    def durata(self) -> float:
+        """Secondi coperti dalla serie"""
+        return self.campioni * self.intervallo
+
+    def _intervallo_campioni(self, inizio: float, fine) -> tuple:
+        """Campioni [i0, i1) che cadono in [inizio, fine) secondi"""
+        i0 = min(max(int(math.floor(inizio / self.intervallo)), 0), self.campioni)
+        i1 = self.campioni if fine is None else min(max(int(math.ceil(fine / self.intervallo)), i0), self.campioni)
+        return i0, i1
+
+    def _blocchi(self, primo: int, ultimo: int) -> tuple:
+        """(leq, lpicco) dei blocchi primo..ultimo inclusi, con una sola lettura"""
+        voci = self.indice[primo:ultimo + 1]
+        inizio = int(voci["offset"][0])
+        data = self._leggi(inizio, int(voci["offset"][-1] + voci["lunghezza"][-1]) - inizio)
+        self.letture += 1
+        leq, picco = [], []
+        for voce in voci:
+            posizione = int(voce["offset"]) - inizio
+            valori = np.frombuffer(zlib.decompress(data[posizione:posizione + int(voce["lunghezza"])]), dtype="<f4")
+            if self.ha_picco:
+                meta = len(valori) // 2
+                leq.append(valori[:meta])
+                picco.append(valori[meta:])
+            else:
+                leq.append(valori)
+        return np.concatenate(leq), (np.concatenate(picco) if self.ha_picco else None)
+
+    def _leggi_campioni(self, i0: int, i1: int) -> tuple:
+        if i0 >= i1:
+            vuoto = np.zeros(0, dtype=np.float32)
+            return vuoto, (vuoto if self.ha_picco else None)
+        primo, ultimo = i0 // self.campioni_blocco, (i1 - 1) // self.campioni_blocco
+        leq, picco = self._blocchi(primo, ultimo)
+        parte = slice(i0 - primo * self.campioni_blocco, i1 - primo * self.campioni_blocco)
+        return leq[parte], (picco[parte] if picco is not None else None)
+
+    def leggi(self, inizio: float = 0, fine=None) -> tuple:
+        """(leq, lpicco o None) dei campioni in [inizio, fine) secondi"""
+        return self._leggi_campioni(*self._intervallo_campioni(inizio, fine))
+
+    def aggrega(self, inizio: float = 0, fine=None) -> dict:
+        """
+        Leq energetico, Leq min/max e Lpicco max in [inizio, fine) secondi
+        I blocchi interi usano solo l'indice; si leggono al massimo i due blocchi di bordo
+        """
+        i0, i1 = self._intervallo_campioni(inizio, fine)
+        blocco = self.campioni_blocco
+        # Blocchi [primo, oltre) interamente compresi in [i0, i1); l'ultimo
+        # blocco può essere più corto ed è intero se i1 arriva alla fine
+        primo = -(-i0 // blocco)
+        oltre = len(self.indice) if i1 == self.campioni else i1 // blocco
+        if primo < oltre:
+            interi = self.indice[primo:oltre]
+            bordi = [(i0, primo * blocco), (oltre * blocco, i1)]
+        else:
+            interi = self.indice[:0]
+            bordi = [(i0, i1)]
+
+        validi = int(interi["validi"].sum())
+        energia = float(interi["energia"].sum())
+        minimi = list(interi["leq_min"])
+        massimi = list(interi["leq_max"])
+        picchi = list(interi["picco_max"])
+
+        for a, b in bordi:
+            if a >= b:
+                continue
+            leq, picco = self._leggi_campioni(a, b)
+            leq = leq[~np.isnan(leq)].astype(np.float64)
+            validi += len(leq)
+            energia += float(np.sum(10 ** (0.1 * leq)))
+            if len(leq):
+                minimi.append(leq.min())
+                massimi.append(leq.max())
+            if picco is not None and np.any(~np.isnan(picco)):
+                picchi.append(np.nanmax(picco))
+
+        def _estremo(valori, funzione):
+            valori = [float(v) for v in valori if not np.isnan(v)]
+            return round(funzione(valori), 1) if valori else None
+
+        return {
+            "inizio": i0 * self.intervallo,
+            "fine": i1 * self.intervallo,
+            "campioni": validi,
+            "durata": round(validi * self.intervallo / 60, 2),
+            "leq": round(10 * math.log10(energia / validi), 1) if validi else None,
+            "leq_min": _estremo(minimi, min),
+            "leq_max": _estremo(massimi, max),
+            "lpicco": _estremo(picchi, max),
+        }
+
+    def profilo(self, inizio: float, fine, passo: float) -> dict:
+        """
+        Ricampionamento a `passo` secondi (Leq energetico e massimi per intervallo)
+        Legge solo i blocchi che coprono [inizio, fine)
+        """
+        leq, picco = self.leggi(inizio, fine)
+        i0, _ = self._intervallo_campioni(inizio, fine)
+        per_intervallo = max(int(round(passo / self.intervallo)), 1)
+        n = math.ceil(len(leq) / per_intervallo)
+
+        def _matrice(valori):
+            m = np.full(n * per_intervallo, np.nan)
+            m[:len(valori)] = valori
+            return m.reshape(n, per_intervallo)
+
+        matrice = _matrice(leq)
+        validi = np.count_nonzero(~np.isnan(matrice), axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            leq_intervallo = 10 * np.log10(np.nansum(10 ** (0.1 * matrice), axis=1) / validi)
+
+        def _lista(valori):
+            return [None if np.isnan(v) else round(float(v), 1) for v in valori]
+
+        return {
+            "passo": per_intervallo * self.intervallo,
+            "tempo": [round((i0 + i * per_intervallo) * self.intervallo, 3) for i in range(n)],
+            "leq": _lista(np.where(validi > 0, leq_intervallo, np.nan)),
+            "leq_max": _lista(_riduci(matrice, np.maximum)),
+            "lpicco": _lista(_riduci(_matrice(picco), np.maximum)) if picco is not None else None,
+        }
+
+
+def da_bytes(data: bytes) -> Serie:
+    """Serie da un oggetto già in memoria (anche nel vecchio formato SRT1)"""
+    if data[:4] == _MAGIC_V1:
+        leq, picco, intervallo = _decodifica_v1(data)
+        data = codifica(leq, picco, intervallo)
+    return Serie(lambda offset, lunghezza: data[offset:offset + lunghezza])
+
+
+# Byte letti alla prima richiesta: intestazione e indice di oltre 100 blocchi
+_PRIMA_LETTURA = 4096
+
+
+def apri(file_key: str) -> Serie:
+    """Serie salvata nello storage, letta a richieste Range"""
+    intestazione = storage.read_range(file_key, 0, _PRIMA_LETTURA)
+    if intestazione[:4] == _MAGIC_V1:
+        body = storage.open_object(file_key)
+        try:
+            return da_bytes(body.read())
+        finally:
+            body.close()
+    return Serie(lambda offset, lunghezza: (
+        intestazione[offset:offset + lunghezza] if offset + lunghezza <= len(intestazione)
+        else storage.read_range(file_key, offset, lunghezza)
+    ))
+
+
+def carica(content: bytes) -> str:
+    """Carica nello storage una serie già codificata (codifica): chiave dell'oggetto"""
+    file_key = f"{SERIE_PREFIX}{uuid.uuid4()}.srt"
+    storage.upload_object(file_key, content, "application/octet-stream")
+    return file_key
@@ -3,6 +3,10 @@ from botocore.exceptions import ClientError
 import os
 from fastapi import UploadFile, HTTPException
 import uuid
+import logging
+from metrics import track_external
+
+logger = logging.getLogger(__name__)
 
 class B2Storage:
     def __init__(self):
@@ -12,7 +16,7 @@ class B2Storage:
         self.bucket_name = os.getenv("B2_BUCKET_NAME")
 
         if not all([self.endpoint_url, self.key_id, self.application_key, self.bucket_name]):
-            print("⚠️  WARNING: B2 Storage credentials not fully configured.")
+            logger.warning("B2 Storage credentials not fully configured")
             self.s3_client = None
         else:
             try:
@@ -23,7 +27,7 @@ class B2Storage:
                     aws_secret_access_key=self.application_key
                 )
             except Exception as e:
-                print(f"❌ Error initializing B2 client: {e}")
+                logger.error("Error initializing B2 client", extra={"error": str(e)})
                 self.s3_client = None
 
     def upload_file(self, file: UploadFile) -> str:
@@ -39,30 +43,77 @@ class B2Storage:
 
         try:
             # Upload the file
-            self.s3_client.upload_fileobj(
-                file.file,
-                self.bucket_name,
-                unique_filename,
-                ExtraArgs={'ContentType': file.content_type}
-            )
-
-            # For Backblaze B2, construct the Friendly URL format
-            # Format: https://<bucket-name>.s3.<region>.backblazeb2.com/<key>
-            # Extract region from endpoint (e.g., s3.eu-central-003.backblazeb2.com -> eu-central-003)
-            region = self.endpoint_url.replace("https://s3.", "").replace(".backblazeb2.com", "")
+            with track_external("b2", "upload_file"):
+                self.s3_client.upload_fileobj(
+                    file.file,
+                    self.bucket_name,
+                    unique_filename,
+                    ExtraArgs={'ContentType': file.content_type}
+                )
 
-            # Try friendly URL format first (works if bucket has public access)
-            url = f"https://{self.bucket_name}.s3.{region}.backblazeb2.com/{unique_filename}"
-
-            return url
+            return self.public_url(unique_filename)
 
         except ClientError as e:
-            print(f"Error uploading file: {e}")
+            logger.error("Error uploading file", extra={"error": str(e)})
             raise HTTPException(status_code=500, detail="Failed to upload file to storage")
         except Exception as e:
-            print(f"Unexpected error: {e}")
+            logger.exception("Unexpected error during upload")
             raise HTTPException(status_code=500, detail="An unexpected error occurred during upload")
 
+    def upload_bytes(self, content: bytes, filename: str, content_type: str) -> str:
+        """
+        Uploads in-memory content (e.g. a generated report) and returns its URL
+        """
+        if not self.s3_client:
+            raise HTTPException(status_code=503, detail="Storage service unavailable")
+
+        file_extension = filename.split(".")[-1] if "." in filename else ""
+        unique_filename = f"{uuid.uuid4()}.{file_extension}"
+
+        try:
+            with track_external("b2", "upload_file"):
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=unique_filename,
+                    Body=content,
+                    ContentType=content_type
+                )
+            return self.public_url(unique_filename)
+        except ClientError as e:
+            logger.error("Error uploading file", extra={"error": str(e)})
+            raise HTTPException(status_code=500, detail="Failed to upload file to storage")
+
+    def upload_object(self, file_key: str, content: bytes, content_type: str) -> None:
+        """
+        Uploads in-memory content under a caller-chosen key (e.g. "serie/<uuid>.srt")
+        """
+        if not self.s3_client:
+            raise HTTPException(status_code=503, detail="Storage service unavailable")
+
+        try:
+            with track_external("b2", "upload_file"):
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=file_key,
+                    Body=content,
+                    ContentType=content_type
+                )
+        except ClientError as e:
+            logger.error("Error uploading file", extra={"error": str(e)})
+            raise HTTPException(status_code=500, detail="Failed to upload file to storage")
+
+    def public_url(self, file_key: str) -> str:
+        """
+        Friendly URL of an object (the last path segment is the object key)
+        """
+        # For Backblaze B2, construct the Friendly URL format
+        # Format: https://<bucket-name>.s3.<region>.backblazeb2.com/<key>
+        # Extract region from endpoint (e.g., s3.eu-central-003.backblazeb2.com -> eu-central-003)
+        region = self.endpoint_url.replace("https://s3.", "").replace(".backblazeb2.com", "")
+
+        # Try friendly URL format first (works if bucket has public access)
+        return f"https://{self.bucket_name}.s3.{region}.backblazeb2.com/{file_key}"
+
     def generate_presigned_url(self, file_key: str, expiration: int = 3600) -> str:
         """
         Generate a presigned URL for private bucket access
@@ -72,18 +123,91 @@ class B2Storage:
             raise HTTPException(status_code=503, detail="Storage service unavailable")
 
         try:
-            url = self.s3_client.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': self.bucket_name,
-                    'Key': file_key
-                },
-                ExpiresIn=expiration
-            )
+            with track_external("b2", "generate_presigned_url"):
+                url = self.s3_client.generate_presigned_url(
+                    'get_object',
+                    Params={
+                        'Bucket': self.bucket_name,
+                        'Key': file_key
+                    },
+                    ExpiresIn=expiration
+                )
             return url
         except ClientError as e:
-            print(f"Error generating presigned URL: {e}")
+            logger.error("Error generating presigned URL", extra={"error": str(e)})
             raise HTTPException(status_code=500, detail="Failed to generate download URL")
 
+    def download_fileobj(self, file_key: str, file_obj) -> None:
+        """
+        Download an object from the bucket into a writable file-like object
+        """
+        if not self.s3_client:
+            raise HTTPException(status_code=503, detail="Storage service unavailable")
+
+        with track_external("b2", "download_file"):
+            self.s3_client.download_fileobj(self.bucket_name, file_key, file_obj)
+
+    def open_object(self, file_key: str):
+        """
+        Open an object for streaming reads (returns a file-like StreamingBody)
+        """
+        if not self.s3_client:
+            raise HTTPException(status_code=503, detail="Storage service unavailable")
+
+        with track_external("b2", "get_object"):
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_key)
+        return response['Body']
+
+    def read_range(self, file_key: str, offset: int, length: int) -> bytes:
+        """
+        Read `length` bytes starting at `offset` with an HTTP Range request
+        """
+        if not self.s3_client:
+            raise HTTPException(status_code=503, detail="Storage service unavailable")
+
+        with track_external("b2", "get_object_range"):
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=file_key,
+                Range=f"bytes={offset}-{offset + length - 1}"
+            )
+        return response['Body'].read()
+
+    def list_objects_page(self, start_after: str = None, max_keys: int = 1000) -> tuple:
+        """
+        List one page of objects in key order, starting after `start_after`
+        Returns (objects, is_truncated) where objects are {Key, Size, LastModified}
+        """
+        if not self.s3_client:
+            raise HTTPException(status_code=503, detail="Storage service unavailable")
+
+        params = {'Bucket': self.bucket_name, 'MaxKeys': max_keys}
+        if start_after:
+            params['StartAfter'] = start_after
+
+        with track_external("b2", "list_objects"):
+            response = self.s3_client.list_objects_v2(**params)
+        return response.get('Contents', []), response.get('IsTruncated', False)
+
+    def delete_objects(self, file_keys: list) -> tuple:
+        """
+        Delete up to 1000 objects with a single DeleteObjects call
+        Returns (deleted_keys, errors) where errors is a list of {Key, Code, Message}
+        """
+        if not self.s3_client:
+            raise HTTPException(status_code=503, detail="Storage service unavailable")
+        if len(file_keys) > 1000:
+            raise ValueError("DeleteObjects accepts at most 1000 keys per request")
+        if not file_keys:
+            return [], []
+
+        with track_external("b2", "delete_objects"):
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key} for key in file_keys], 'Quiet': False}
+            )
+        deleted = [item['Key'] for item in response.get('Deleted', [])]
+        return deleted, response.get('Errors', [])
+
 # Global instance
 storage = B2Storage()
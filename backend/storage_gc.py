@@ -0,0 +1,302 @@
+"""
+Garbage collection degli oggetti B2 orfani
+Confronta il listing del bucket con documenti.url (e le serie temporali con
+valutazioni_esposizione.serie_key) ed elimina gli oggetti non
+più referenziati con DeleteObjects a lotti (max 1000 chiavi), con pausa tra
+i lotti e checkpoint in storage_gc_runs per riprendere dopo un'interruzione.
+
+Esegui: python storage_gc.py             (dry-run: solo report)
+        python storage_gc.py --execute   (elimina gli oggetti orfani)
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import asyncio
+import json
+import logging
+import os
+import time
+
+from psycopg2.extras import RealDictCursor
+
+import database
+from storage import storage
+from serie_temporali import SERIE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Chiavi per pagina di listing = chiavi per chiamata DeleteObjects (limite S3: 1000)
+GC_BATCH_SIZE = min(int(os.getenv("STORAGE_GC_BATCH_SIZE", "1000")), 1000)
+
+# Pausa tra un lotto e il successivo (secondi) per non saturare B2
+GC_BATCH_PAUSE = float(os.getenv("STORAGE_GC_BATCH_PAUSE", "1.0"))
+
+# Oggetti più recenti di così non vengono toccati: l'upload scrive su B2
+# prima di inserire la riga in documenti
+GC_GRACE_HOURS = float(os.getenv("STORAGE_GC_GRACE_HOURS", "24"))
+
+# Chiavi orfane conservate nel report di ogni esecuzione
+GC_ORPHAN_SAMPLE_SIZE = 1000
+
+# Lock advisory PostgreSQL: un solo reaper alla volta tra tutti i worker
+_GC_LOCK_KEY = 73_846_201
+
+_RESUMABLE_STATUSES = ("running", "paused", "failed")
+
+
+def is_gc_running(cursor) -> bool:
+    """True se un altro processo detiene il lock del reaper"""
+    cursor.execute("SELECT pg_try_advisory_lock(%s) AS acquired", (_GC_LOCK_KEY,))
+    row = cursor.fetchone()
+    acquired = row["acquired"] if isinstance(row, dict) else row[0]
+    if acquired:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (_GC_LOCK_KEY,))
+    return not acquired
+
+
+def start_run(conn, dry_run: bool = True) -> int:
+    """
+    Prepara un'esecuzione e ne restituisce l'id
+    Un'esecuzione reale riprende l'ultima interrotta (paused/failed) dal suo
+    checkpoint; il dry-run riparte sempre dall'inizio del bucket
+    """
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        run = None
+        if not dry_run:
+            cursor.execute("""
+                SELECT id FROM storage_gc_runs
+                WHERE dry_run = FALSE AND status = ANY(%s)
+                ORDER BY id DESC
+                LIMIT 1
+            """, (list(_RESUMABLE_STATUSES),))
+            run = cursor.fetchone()
+
+        if run:
+            cursor.execute("""
+                UPDATE storage_gc_runs
+                SET status = 'running', error = NULL, finished_at = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (run["id"],))
+            run_id = run["id"]
+        else:
+            cursor.execute(
+                "INSERT INTO storage_gc_runs (dry_run) VALUES (%s) RETURNING id",
+                (dry_run,)
+            )
+            run_id = cursor.fetchone()["id"]
+
+        conn.commit()
+        return run_id
+    finally:
+        cursor.close()
+
+
+def get_run(cursor, run_id: int) -> Optional[dict]:
+    """Stato e report di un'esecuzione"""
+    cursor.execute("SELECT * FROM storage_gc_runs WHERE id = %s", (run_id,))
+    return cursor.fetchone()
+
+
+def _referenced_keys(cursor, keys: list) -> set:
+    """
+    Sottoinsieme di `keys` ancora referenziato da documenti o da una serie
+    temporale (usa idx_documenti_file_key e idx_valutazioni_esposizione_serie_key)
+    """
+    if not keys:
+        return set()
+    cursor.execute("""
+        SELECT regexp_replace(url, '^.*/', '') AS file_key
+        FROM documenti
+        WHERE regexp_replace(url, '^.*/', '') = ANY(%s)
+        UNION
+        SELECT serie_key
+        FROM valutazioni_esposizione
+        WHERE serie_key = ANY(%s)
+    """, (keys, keys))
+    return {row["file_key"] for row in cursor.fetchall()}
+
+
+def _is_candidate(obj: dict, cutoff: datetime) -> bool:
+    # Solo oggetti caricati da upload_file (radice del bucket) e serie
+    # temporali; gli altri prefissi (es. "reports/") sono gestiti da altri moduli
+    chiave = obj["Key"]
+    gestito = '/' not in chiave or (chiave.startswith(SERIE_PREFIX) and '/' not in chiave[len(SERIE_PREFIX):])
+    return gestito and obj["LastModified"] < cutoff
+
+
+def run_storage_gc(run_id: int, max_batches: Optional[int] = None) -> Optional[dict]:
+    """
+    Esegue (o riprende) l'esecuzione `run_id` fino alla fine del bucket
+
+    Args:
+        run_id: Esecuzione creata da start_run()
+        max_batches: Numero massimo di lotti in questa chiamata; al limite
+                     l'esecuzione resta 'paused' e riprende dal checkpoint
+
+    Returns:
+        Il report finale dell'esecuzione
+    """
+    conn = database.connect(cursor_factory=RealDictCursor)
+    cursor = conn.cursor()
+    locked = False
+    try:
+        cursor.execute("SELECT pg_try_advisory_lock(%s) AS acquired", (_GC_LOCK_KEY,))
+        locked = cursor.fetchone()["acquired"]
+        if not locked:
+            cursor.execute("""
+                UPDATE storage_gc_runs
+                SET status = 'failed', error = 'Garbage collection già in esecuzione',
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (run_id,))
+            conn.commit()
+            logger.warning("Storage GC già in esecuzione", extra={"run_id": run_id})
+            return get_run(cursor, run_id)
+
+        run = get_run(cursor, run_id)
+        conn.commit()
+        if run is None:
+            raise ValueError(f"Esecuzione GC {run_id} inesistente")
+
+        dry_run = run["dry_run"]
+        last_key = run["last_key"]
+        sample_size = len(run["orphan_sample"] or [])
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=GC_GRACE_HOURS)
+        logger.info("Storage GC avviata", extra={"run_id": run_id, "dry_run": dry_run, "start_after": last_key})
+
+        batches = 0
+        status = "completed"
+        while True:
+            if max_batches is not None and batches >= max_batches:
+                status = "paused"
+                break
+
+            objects, truncated = storage.list_objects_page(last_key, GC_BATCH_SIZE)
+            if not objects:
+                break
+
+            candidates = [obj for obj in objects if _is_candidate(obj, cutoff)]
+            referenced = _referenced_keys(cursor, [obj["Key"] for obj in candidates])
+            orphans = [obj for obj in candidates if obj["Key"] not in referenced]
+
+            deleted, errors = [], []
+            if orphans and not dry_run:
+                deleted, errors = storage.delete_objects([obj["Key"] for obj in orphans])
+                for error in errors:
+                    logger.warning("Eliminazione oggetto fallita", extra={
+                        "run_id": run_id, "key": error.get("Key"), "code": error.get("Code"),
+                    })
+
+            sample = [obj["Key"] for obj in orphans[:max(GC_ORPHAN_SAMPLE_SIZE - sample_size, 0)]]
+            sample_size += len(sample)
+            last_key = objects[-1]["Key"]
+
+            # Checkpoint: contatori e ultima chiave nella stessa transazione
+            cursor.execute("""
+                UPDATE storage_gc_runs SET
+                    last_key = %s,
+                    scanned_objects = scanned_objects + %s,
+                    orphaned_objects = orphaned_objects + %s,
+                    orphaned_bytes = orphaned_bytes + %s,
+                    deleted_objects = deleted_objects + %s,
+                    failed_objects = failed_objects + %s,
+                    orphan_sample = orphan_sample || %s::jsonb,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (
+                last_key, len(objects), len(orphans), sum(obj.get("Size", 0) for obj in orphans),
+                len(deleted), len(errors), json.dumps(sample), run_id
+            ))
+            conn.commit()
+            batches += 1
+
+            if not truncated:
+                break
+            time.sleep(GC_BATCH_PAUSE)
+
+        cursor.execute("""
+            UPDATE storage_gc_runs
+            SET status = %s, updated_at = CURRENT_TIMESTAMP,
+                finished_at = CASE WHEN %s = 'completed' THEN CURRENT_TIMESTAMP END
+            WHERE id = %s
+        """, (status, status, run_id))
+        conn.commit()
+
+        report = get_run(cursor, run_id)
+        logger.info("Storage GC terminata", extra={
+            "run_id": run_id,
+            "status": status,
+            "scanned": report["scanned_objects"],
+            "orphaned": report["orphaned_objects"],
+            "deleted": report["deleted_objects"],
+        })
+        return report
+
+    except Exception as e:
+        conn.rollback()
+        logger.exception("Storage GC fallita", extra={"run_id": run_id})
+        cursor.execute("""
+            UPDATE storage_gc_runs
+            SET status = 'failed', error = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (str(e)[:1000], run_id))
+        conn.commit()
+        return get_run(cursor, run_id)
+    finally:
+        if locked:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (_GC_LOCK_KEY,))
+        cursor.close()
+        conn.close()
+
+
+def _run_scheduled():
+    conn = database.connect(cursor_factory=RealDictCursor)
+    try:
+        cursor = conn.cursor()
+        running = is_gc_running(cursor)
+        cursor.close()
+        if running:
+            logger.info("Storage GC periodica saltata: esecuzione già in corso")
+            return None
+        run_id = start_run(conn, dry_run=False)
+    finally:
+        conn.close()
+    return run_storage_gc(run_id)
+
+
+async def periodic_storage_gc(interval_hours: float):
+    """Task di background: esecuzione reale ogni `interval_hours` ore (nel threadpool)"""
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await asyncio.to_thread(_run_scheduled)
+        except Exception:
+            logger.exception("Errore nella garbage collection periodica")
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Garbage collection degli oggetti B2 orfani")
+    parser.add_argument("--execute", action="store_true", help="Elimina gli oggetti (default: dry-run)")
+    parser.add_argument("--max-batches", type=int, default=None, help="Lotti massimi in questa esecuzione")
+    args = parser.parse_args()
+
+    conn = database.connect(cursor_factory=RealDictCursor)
+    try:
+        run_id = start_run(conn, dry_run=not args.execute)
+    finally:
+        conn.close()
+
+    report = run_storage_gc(run_id, max_batches=args.max_batches)
+    print(f"Esecuzione #{report['id']} ({'dry-run' if report['dry_run'] else 'eliminazione'}): {report['status']}")
+    print(f"  Oggetti analizzati: {report['scanned_objects']}")
+    print(f"  Oggetti orfani:     {report['orphaned_objects']} ({report['orphaned_bytes'] / 1024 / 1024:.1f} MB)")
+    print(f"  Oggetti eliminati:  {report['deleted_objects']} (errori: {report['failed_objects']})")
+    if report["error"]:
+        print(f"  Errore: {report['error']}")
+    for key in report["orphan_sample"][:20]:
+        print(f"  - {key}")
@@ -9,6 +9,10 @@ import os
 from typing import Optional, Dict, Any
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from metrics import timed_external
+import logging
+
+logger = logging.getLogger(__name__)
 
 load_dotenv(override=False)  # Don't override system env vars from Dokploy
 
@@ -20,6 +24,7 @@ class StripeService:
     """Service class for Stripe operations"""
 
     @staticmethod
+    @timed_external("stripe")
     def create_customer(email: str, name: str, metadata: Optional[Dict[str, Any]] = None) -> stripe.Customer:
         """
         Create a new Stripe customer
@@ -40,10 +45,11 @@ class StripeService:
             )
             return customer
         except stripe.error.StripeError as e:
-            print(f"Stripe error creating customer: {e}")
+            logger.error("Stripe error creating customer", extra={"error": str(e)})
             raise
 
     @staticmethod
+    @timed_external("stripe")
     def create_checkout_session(
         customer_id: str,
         price_id: str,
@@ -91,10 +97,11 @@ class StripeService:
             )
             return session
         except stripe.error.StripeError as e:
-            print(f"Stripe error creating checkout session: {e}")
+            logger.error("Stripe error creating checkout session", extra={"error": str(e)})
             raise
 
     @staticmethod
+    @timed_external("stripe")
     def create_portal_session(customer_id: str, return_url: str) -> stripe.billing_portal.Session:
         """
         Create a Stripe Customer Portal session for managing subscription
@@ -113,10 +120,11 @@ class StripeService:
             )
             return session
         except stripe.error.StripeError as e:
-            print(f"Stripe error creating portal session: {e}")
+            logger.error("Stripe error creating portal session", extra={"error": str(e)})
             raise
 
     @staticmethod
+    @timed_external("stripe")
     def get_subscription(subscription_id: str) -> stripe.Subscription:
         """
         Retrieve a subscription from Stripe
@@ -131,10 +139,11 @@ class StripeService:
             subscription = stripe.Subscription.retrieve(subscription_id)
             return subscription
         except stripe.error.StripeError as e:
-            print(f"Stripe error retrieving subscription: {e}")
+            logger.error("Stripe error retrieving subscription", extra={"error": str(e)})
             raise
 
     @staticmethod
+    @timed_external("stripe")
     def cancel_subscription(subscription_id: str, at_period_end: bool = True) -> stripe.Subscription:
         """
         Cancel a subscription
@@ -156,10 +165,11 @@ class StripeService:
                 subscription = stripe.Subscription.delete(subscription_id)
             return subscription
         except stripe.error.StripeError as e:
-            print(f"Stripe error canceling subscription: {e}")
+            logger.error("Stripe error canceling subscription", extra={"error": str(e)})
             raise
 
     @staticmethod
+    @timed_external("stripe")
     def update_subscription(subscription_id: str, new_price_id: str) -> stripe.Subscription:
         """
         Update subscription to a different plan
@@ -183,7 +193,7 @@ class StripeService:
             )
             return subscription
         except stripe.error.StripeError as e:
-            print(f"Stripe error updating subscription: {e}")
+            logger.error("Stripe error updating subscription", extra={"error": str(e)})
             raise
 
     @staticmethod
@@ -204,13 +214,14 @@ class StripeService:
             )
             return event
         except ValueError as e:
-            print(f"Invalid payload: {e}")
+            logger.warning("Invalid webhook payload", extra={"error": str(e)})
             raise
         except stripe.error.SignatureVerificationError as e:
-            print(f"Invalid signature: {e}")
+            logger.warning("Invalid webhook signature", extra={"error": str(e)})
             raise
 
     @staticmethod
+    @timed_external("stripe")
     def list_prices_for_product(product_id: str) -> list:
         """
         List all prices for a product
@@ -225,10 +236,11 @@ class StripeService:
             prices = stripe.Price.list(product=product_id, active=True)
             return prices.data
         except stripe.error.StripeError as e:
-            print(f"Stripe error listing prices: {e}")
+            logger.error("Stripe error listing prices", extra={"error": str(e)})
             raise
 
     @staticmethod
+    @timed_external("stripe")
     def get_upcoming_invoice(customer_id: str, subscription_id: str) -> Optional[stripe.Invoice]:
         """
         Get the upcoming invoice for a subscription
@@ -247,10 +259,11 @@ class StripeService:
             )
             return invoice
         except stripe.error.StripeError as e:
-            print(f"Stripe error getting upcoming invoice: {e}")
+            logger.error("Stripe error getting upcoming invoice", extra={"error": str(e)})
             return None
 
     @staticmethod
+    @timed_external("stripe")
     def list_invoices(customer_id: str, limit: int = 10) -> list:
         """
         List invoices for a customer
@@ -266,7 +279,7 @@ class StripeService:
             invoices = stripe.Invoice.list(customer=customer_id, limit=limit)
             return invoices.data
         except stripe.error.StripeError as e:
-            print(f"Stripe error listing invoices: {e}")
+            logger.error("Stripe error listing invoices", extra={"error": str(e)})
             raise
 
 
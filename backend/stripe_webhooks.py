@@ -5,19 +5,23 @@ Processes Stripe webhook events to keep database in sync
 
 from __future__ import annotations
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
 from datetime import datetime
+import database
 from stripe_service import stripe_service, map_stripe_status_to_db
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/webhooks", tags=["webhooks"])
 
 def get_db_connection():
     """Get database connection"""
-    database_url = os.getenv("DATABASE_URL")
-    return psycopg2.connect(database_url)
+    return database.connect(cursor_factory=None)
 
 @router.post("/stripe")
 async def stripe_webhook(request: Request):
@@ -35,41 +39,24 @@ async def stripe_webhook(request: Request):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Webhook signature verification failed: {str(e)}")
 
-    print(f"📥 Received Stripe webhook: {event['type']}")
+    logger.info("Received Stripe webhook", extra={"event_type": event['type']})
 
     # Handle different event types
     event_type = event['type']
     event_data = event['data']['object']
 
     try:
-        if event_type == 'checkout.session.completed':
-            handle_checkout_session_completed(event_data)
-
-        elif event_type == 'customer.subscription.created':
-            handle_subscription_created(event_data)
-
-        elif event_type == 'customer.subscription.updated':
-            handle_subscription_updated(event_data)
-
-        elif event_type == 'customer.subscription.deleted':
-            handle_subscription_deleted(event_data)
-
-        elif event_type == 'invoice.paid':
-            handle_invoice_paid(event_data)
-
-        elif event_type == 'invoice.payment_failed':
-            handle_invoice_payment_failed(event_data)
-
-        elif event_type == 'customer.subscription.trial_will_end':
-            handle_trial_will_end(event_data)
-
+        handler = EVENT_HANDLERS.get(event_type)
+        if handler:
+            # Handlers use psycopg2 (blocking): run them in the threadpool
+            await run_in_threadpool(handler, event_data)
         else:
-            print(f"⚠️  Unhandled event type: {event_type}")
+            logger.warning("Unhandled Stripe event type", extra={"event_type": event_type})
 
         return {'success': True, 'event_type': event_type}
 
     except Exception as e:
-        print(f"❌ Error processing webhook: {e}")
+        logger.exception("Error processing webhook", extra={"event_type": event_type})
         raise HTTPException(status_code=500, detail=f"Error processing webhook: {str(e)}")
 
 
@@ -78,11 +65,11 @@ def handle_checkout_session_completed(session):
     Handle successful checkout session
     Create or update subscription in database
     """
-    print(f"✅ Checkout session completed: {session['id']}")
+    logger.info("Checkout session completed", extra={"session_id": session['id']})
 
     user_id = session['metadata'].get('user_id')
     if not user_id:
-        print("⚠️  No user_id in session metadata")
+        logger.warning("No user_id in session metadata", extra={"session_id": session['id']})
         return
 
     user_id = int(user_id)
@@ -103,7 +90,7 @@ def handle_checkout_session_completed(session):
         cursor.execute("SELECT id FROM subscription_plans WHERE name = %s", (plan_name,))
         plan = cursor.fetchone()
         if not plan:
-            print(f"⚠️  Plan not found: {plan_name}")
+            logger.warning("Plan not found", extra={"plan_name": plan_name})
             return
 
         plan_id = plan['id']
@@ -170,7 +157,7 @@ def handle_checkout_session_completed(session):
             ))
 
         conn.commit()
-        print(f"✅ Subscription created/updated for user {user_id}")
+        logger.info("Subscription created/updated", extra={"user_id": user_id})
 
     finally:
         cursor.close()
@@ -179,14 +166,14 @@ def handle_checkout_session_completed(session):
 
 def handle_subscription_created(subscription):
     """Handle subscription.created event"""
-    print(f"✅ Subscription created: {subscription['id']}")
+    logger.info("Subscription created", extra={"subscription_id": subscription['id']})
     # Usually handled in checkout.session.completed
     # But can also create here for subscriptions created via API
 
 
 def handle_subscription_updated(subscription):
     """Handle subscription.updated event"""
-    print(f"🔄 Subscription updated: {subscription['id']}")
+    logger.info("Subscription updated", extra={"subscription_id": subscription['id']})
 
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -212,7 +199,6 @@ def handle_subscription_updated(subscription):
         ))
 
         conn.commit()
-        print(f"✅ Subscription updated in database")
 
     finally:
         cursor.close()
@@ -221,7 +207,7 @@ def handle_subscription_updated(subscription):
 
 def handle_subscription_deleted(subscription):
     """Handle subscription.deleted event"""
-    print(f"❌ Subscription deleted: {subscription['id']}")
+    logger.info("Subscription deleted", extra={"subscription_id": subscription['id']})
 
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -237,7 +223,6 @@ def handle_subscription_deleted(subscription):
         """, (subscription['id'],))
 
         conn.commit()
-        print(f"✅ Subscription marked as canceled")
 
     finally:
         cursor.close()
@@ -246,7 +231,7 @@ def handle_subscription_deleted(subscription):
 
 def handle_invoice_paid(invoice):
     """Handle invoice.paid event"""
-    print(f"💰 Invoice paid: {invoice['id']}")
+    logger.info("Invoice paid", extra={"invoice_id": invoice['id']})
 
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -266,7 +251,7 @@ def handle_invoice_paid(invoice):
 
         subscription = cursor.fetchone()
         if not subscription:
-            print(f"⚠️  Subscription not found: {subscription_id}")
+            logger.warning("Subscription not found", extra={"subscription_id": subscription_id})
             return
 
         # Create invoice record
@@ -315,7 +300,6 @@ def handle_invoice_paid(invoice):
         ))
 
         conn.commit()
-        print(f"✅ Invoice recorded")
 
     finally:
         cursor.close()
@@ -324,7 +308,7 @@ def handle_invoice_paid(invoice):
 
 def handle_invoice_payment_failed(invoice):
     """Handle invoice.payment_failed event"""
-    print(f"❌ Invoice payment failed: {invoice['id']}")
+    logger.warning("Invoice payment failed", extra={"invoice_id": invoice['id']})
 
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -344,7 +328,6 @@ def handle_invoice_payment_failed(invoice):
         """, (subscription_id,))
 
         conn.commit()
-        print(f"✅ Subscription marked as past_due")
 
     finally:
         cursor.close()
@@ -353,10 +336,21 @@ def handle_invoice_payment_failed(invoice):
 
 def handle_trial_will_end(subscription):
     """Handle customer.subscription.trial_will_end event"""
-    print(f"⏰ Trial ending soon: {subscription['id']}")
+    logger.info("Trial ending soon", extra={"subscription_id": subscription['id']})
     # TODO: Send email notification to user
     pass
 
 
 # Export router
 __all__ = ['router']
+
+
+EVENT_HANDLERS = {
+    'checkout.session.completed': handle_checkout_session_completed,
+    'customer.subscription.created': handle_subscription_created,
+    'customer.subscription.updated': handle_subscription_updated,
+    'customer.subscription.deleted': handle_subscription_deleted,
+    'invoice.paid': handle_invoice_paid,
+    'invoice.payment_failed': handle_invoice_payment_failed,
+    'customer.subscription.trial_will_end': handle_trial_will_end,
+}
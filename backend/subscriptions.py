@@ -11,6 +11,7 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
 from datetime import datetime
+import database
 from stripe_service import stripe_service, map_stripe_status_to_db
 from auth import decode_access_token
 
@@ -68,8 +69,7 @@ class CancelSubscriptionRequest(BaseModel):
 
 def get_db_connection():
     """Get database connection"""
-    database_url = os.getenv("DATABASE_URL")
-    return psycopg2.connect(database_url)
+    return database.connect(cursor_factory=None)
 
 def get_current_user_id(authorization: str = Header(None)) -> int:
     """Extract user ID from authorization token"""
@@ -356,20 +356,26 @@ def get_subscription_usage(user_id: int = Depends(get_current_user_id)):
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
     try:
+        # Contatori e limiti dalla riga user_quotas (vedi quotas.py)
         cursor.execute("""
             SELECT
-                us.usage_valutazioni_esposizione_current,
-                us.usage_valutazioni_dpi_current,
-                us.usage_storage_mb_current,
-                sp.max_valutazioni_esposizione_month,
-                sp.max_valutazioni_dpi_month,
-                sp.storage_mb as max_storage_mb,
+                CASE WHEN q.periodo_inizio < date_trunc('month', CURRENT_DATE)
+                     THEN 0 ELSE q.usage_valutazioni_esposizione END AS usage_valutazioni_esposizione_current,
+                CASE WHEN q.periodo_inizio < date_trunc('month', CURRENT_DATE)
+                     THEN 0 ELSE q.usage_valutazioni_dpi END AS usage_valutazioni_dpi_current,
+                CEIL(q.usage_storage_bytes / 1048576.0)::int AS usage_storage_mb_current,
+                q.usage_aziende AS usage_aziende_current,
+                q.max_valutazioni_esposizione_month,
+                q.max_valutazioni_dpi_month,
+                q.max_aziende,
+                q.storage_mb as max_storage_mb,
                 us.current_period_start,
                 us.current_period_end
-            FROM user_subscriptions us
-            JOIN subscription_plans sp ON us.plan_id = sp.id
-            WHERE us.user_id = %s
-              AND us.status IN ('active', 'trial')
+            FROM user_quotas q
+            LEFT JOIN user_subscriptions us
+              ON us.user_id = q.user_id AND us.status IN ('active', 'trial')
+            WHERE q.user_id = %s
+              AND q.attiva
             LIMIT 1
         """, (user_id,))
 
@@ -380,8 +386,10 @@ def get_subscription_usage(user_id: int = Depends(get_current_user_id)):
                 'usage_valutazioni_esposizione_current': 0,
                 'usage_valutazioni_dpi_current': 0,
                 'usage_storage_mb_current': 0,
+                'usage_aziende_current': 0,
                 'max_valutazioni_esposizione_month': 3,
                 'max_valutazioni_dpi_month': 3,
+                'max_aziende': 1,
                 'max_storage_mb': 0,
                 'period_start': None,
                 'period_end': None
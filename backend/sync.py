@@ -0,0 +1,164 @@
+"""
+Sincronizzazione incrementale (GET /api/sync)
+Il token è l'xmin dello snapshot PostgreSQL al momento della lettura: tutte
+le transazioni con id inferiore sono già concluse e visibili, quindi le
+modifiche successive hanno sync_xid >= token. Una riga può tornare due volte
+(il client la riapplica), ma nessun commit concorrente viene perso.
+"""
+import asyncio
+import logging
+import os
+
+from psycopg2.extras import RealDictCursor
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Giorni di conservazione delle lapidi: token più vecchi richiedono since=0
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "90"))
+
+SYNC_RESOURCES = ("aziende", "esposizione", "dpi")
+
+_QUERIES = {
+    "aziende": """
+        SELECT id, ragione_sociale, partita_iva, codice_fiscale, indirizzo, citta,
+               cap, provincia, telefono, email, rappresentante_legale, created_at, updated_at
+        FROM aziende
+        WHERE user_id = %(user_id)s {filtro}
+        ORDER BY id
+    """,
+    "esposizione": """
+        SELECT v.id, v.azienda_id, v.mansione, v.reparto,
+               v.lex::text AS lex, v.lpicco::text AS lpicco, v.classe_rischio,
+               v.data_misura,
+               v.created_at, v.updated_at,
+               COALESCE((
+                   SELECT json_agg(json_build_object(
+                       'id', m.id, 'attivita', m.attivita, 'leq', m.leq::text,
+                       'durata', m.durata::text, 'lpicco', m.lpicco::text,
+                       'spettro_ottave', m.spettro_ottave
+                   ) ORDER BY m.ordine, m.id)
+                   FROM misurazioni m WHERE m.valutazione_id = v.id
+               ), '[]'::json) AS misurazioni
+        FROM valutazioni_esposizione v
+        WHERE v.user_id = %(user_id)s {filtro}
+        ORDER BY v.id
+    """,
+    "dpi": """
+        SELECT id, azienda_id, mansione, reparto, dpi_selezionato,
+               h::text AS h, m::text AS m, l::text AS l, lex_per_dpi::text AS lex_per_dpi,
+               pnr::text AS pnr, leff::text AS leff, protezione_adeguata, created_at, updated_at
+        FROM valutazioni_dpi
+        WHERE user_id = %(user_id)s {filtro}
+        ORDER BY id
+    """,
+}
+
+
+class TokenScaduto(Exception):
+    """Le lapidi successive al token sono già state eliminate"""
+
+
+def _formatta(risorsa: str, row: dict) -> dict:
+    """Stesso formato delle liste /api/esposizione e /api/dpi"""
+    if risorsa == "esposizione":
+        return {**row, "lex": row["lex"] or "0", "lpicco": row["lpicco"] or "0"}
+    if risorsa == "dpi":
+        return {
+            "id": row["id"],
+            "azienda_id": row["azienda_id"],
+            "mansione": row["mansione"],
+            "reparto": row["reparto"],
+            "dpi_selezionato": row["dpi_selezionato"],
+            "valori_hml": {"h": row["h"] or "0", "m": row["m"] or "0", "l": row["l"] or "0"},
+            "lex_per_dpi": row["lex_per_dpi"] or "0",
+            "pnr": row["pnr"],
+            "leff": row["leff"],
+            "protezione_adeguata": row["protezione_adeguata"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+    return row
+
+
+def load_changes(cursor, user_id: int, since: int = 0) -> dict:
+    """
+    Modifiche dell'utente successive a `since` (0 = elenco completo)
+
+    Returns:
+        {"token", "completo", <risorsa>: {"aggiornati": [...], "eliminati": [id, ...]}}
+
+    Raises:
+        TokenScaduto se since precede l'orizzonte delle lapidi eliminate
+    """
+    # Il token va letto prima dei dati: ciò che viene scritto nel frattempo
+    # ha sync_xid >= token e torna alla prossima sincronizzazione
+    cursor.execute("""
+        SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS token,
+               (SELECT purged_xid FROM sync_horizon) AS purged_xid
+    """)
+    row = cursor.fetchone()
+    token = row["token"]
+    if since and since < (row["purged_xid"] or 0):
+        raise TokenScaduto()
+
+    filtro = "AND sync_xid >= %(since)s" if since else ""
+    result = {"token": token, "completo": not since}
+    for risorsa in SYNC_RESOURCES:
+        cursor.execute(_QUERIES[risorsa].format(filtro=filtro), {"user_id": user_id, "since": since})
+        result[risorsa] = {
+            "aggiornati": [_formatta(risorsa, r) for r in cursor.fetchall()],
+            "eliminati": [],
+        }
+
+    if since:
+        # Un id ricreato dopo l'eliminazione non esiste: le sequenze non riusano gli id
+        cursor.execute("""
+            SELECT DISTINCT risorsa, record_id
+            FROM sync_tombstones
+            WHERE user_id = %s AND sync_xid >= %s
+            ORDER BY risorsa, record_id
+        """, (user_id, since))
+        for tombstone in cursor.fetchall():
+            result[tombstone["risorsa"]]["eliminati"].append(tombstone["record_id"])
+
+    return result
+
+
+def purge_tombstones(retention_days: int = SYNC_TOMBSTONE_RETENTION_DAYS) -> int:
+    """Elimina le lapidi scadute e alza l'orizzonte dei token validi"""
+    conn = database.connect(cursor_factory=RealDictCursor)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            WITH eliminate AS (
+                DELETE FROM sync_tombstones
+                WHERE deleted_at < NOW() - make_interval(days => %s)
+                RETURNING sync_xid
+            )
+            UPDATE sync_horizon
+            SET purged_xid = GREATEST(purged_xid, (SELECT MAX(sync_xid) + 1 FROM eliminate))
+            RETURNING (SELECT COUNT(*) FROM eliminate) AS eliminate
+        """, (retention_days,))
+        eliminate = cursor.fetchone()["eliminate"]
+        conn.commit()
+        if eliminate:
+            logger.info("Lapidi di sincronizzazione eliminate", extra={"count": eliminate})
+        return eliminate
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+async def periodic_tombstone_purge(interval_hours: float = 24):
+    """Task di background: pulizia delle lapidi ogni `interval_hours` ore (nel threadpool)"""
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await asyncio.to_thread(purge_tombstones)
+        except Exception:
+            logger.exception("Errore nella pulizia delle lapidi di sincronizzazione")
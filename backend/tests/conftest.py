@@ -0,0 +1,9 @@
+"""
+Configurazione comune dei test: i moduli del backend sono importati dalla
+cartella padre e main richiede SECRET_KEY all'import
+"""
+import os
+import sys
+
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
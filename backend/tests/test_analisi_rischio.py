@@ -0,0 +1,65 @@
+"""
+Query del quadro del rischio: colonne lette dallo schema reale (init_db.py e
+migrazioni) e righe aggregate trasformate nel riepilogo per azienda
+"""
+import glob
+import os
+import re
+
+import analisi_rischio
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _colonne_aziende() -> set:
+    with open(os.path.join(BACKEND, "init_db.py"), encoding="utf-8") as f:
+        sorgente = f.read()
+    tabella = re.search(r"CREATE TABLE IF NOT EXISTS aziende \((.*?)\n\);", sorgente, re.S).group(1)
+    colonne = {riga.split()[0] for riga in tabella.strip().splitlines()}
+    for percorso in [os.path.join(BACKEND, "init_db.py"), *glob.glob(os.path.join(BACKEND, "migrations", "*.sql"))]:
+        with open(percorso, encoding="utf-8") as f:
+            colonne |= set(re.findall(r"ALTER TABLE aziende ADD COLUMN (?:IF NOT EXISTS )?(\w+)", f.read(), re.I))
+    return colonne
+
+
+class FakeCursor:
+    def __init__(self, righe):
+        self.righe = righe
+        self.query = None
+
+    def execute(self, query, vars=None):
+        self.query = query
+
+    def fetchall(self):
+        return self.righe
+
+
+def _riga(**valori):
+    riga = {colonna: 0 for colonna in (
+        "n_esposizione", "n_minimo", "n_medio", "n_rilevante", "n_alto", "somma_lex", "somma_energia",
+        "n_dpi", "n_eccessiva", "n_buona", "n_ottimale", "n_accettabile", "n_insufficiente", "somma_leff",
+    )}
+    riga["lex_max"] = None
+    riga.update(valori)
+    return riga
+
+
+def test_analisi_utente_legge_colonne_esistenti():
+    cursor = FakeCursor([])
+    analisi_rischio.load_analisi_utente(cursor, 1)
+    usate = set(re.findall(r"\baz\.(\w+)", cursor.query))
+    assert usate and usate <= _colonne_aziende()
+
+
+def test_analisi_utente_riepilogo_per_azienda():
+    cursor = FakeCursor([
+        _riga(azienda_id=3, ragione_sociale="Acme Srl", n_esposizione=2, n_medio=1, n_alto=1,
+              somma_lex=170.0, somma_energia=2 * 10 ** 8.5, lex_max=88.0),
+        _riga(azienda_id=0, ragione_sociale=None, n_dpi=1, n_buona=1, somma_leff=67.0),
+        _riga(azienda_id=4, ragione_sociale="Vuota Spa"),
+    ])
+    aziende = analisi_rischio.load_analisi_utente(cursor, 1)
+    assert [(a["azienda_id"], a["ragione_sociale"]) for a in aziende] == [(3, "Acme Srl"), (None, None)]
+    assert aziende[0]["lex_medio"] == 85.0
+    assert aziende[0]["lex_medio_energetico"] == 85.0
+    assert aziende[1]["dpi"]["leff_medio"] == 67.0
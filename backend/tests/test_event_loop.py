@@ -0,0 +1,134 @@
+"""
+Accesso sincrono al database dall'event loop (ASYNC_BLOCKING_CHECK=raise)
+Un handler async def che apre una connessione o esegue una query deve far
+fallire il test; gli handler def dei documenti girano nel threadpool.
+"""
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import database
+import main
+import metrics
+
+
+class FakeCursor:
+    """Cursore senza database che applica lo stesso controllo dei cursori strumentati"""
+
+    def __init__(self):
+        self.rowcount = 0
+
+    def execute(self, query, vars=None):
+        database.check_not_on_event_loop()
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def cursor(self, *args, **kwargs):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def fake_get_db():
+    database.check_not_on_event_loop()
+    conn = FakeConnection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(database, "ASYNC_BLOCKING_CHECK", "raise")
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 1, "is_admin": False}
+    main.app.dependency_overrides[main.get_db] = fake_get_db
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def async_routes():
+    """Route async def usa e getta che fanno I/O sincrono sul database"""
+
+    async def apre_connessione():
+        database.connect()
+        return {}
+
+    async def esegue_query():
+        FakeCursor().execute("SELECT 1")
+        return {}
+
+    main.app.add_api_route("/_test/async-connect", apre_connessione)
+    main.app.add_api_route("/_test/async-query", esegue_query)
+    yield
+    main.app.router.routes = [
+        route for route in main.app.router.routes
+        if not getattr(route, "path", "").startswith("/_test/")
+    ]
+
+
+def test_check_non_solleva_fuori_dal_loop(monkeypatch):
+    monkeypatch.setattr(database, "ASYNC_BLOCKING_CHECK", "raise")
+    database.check_not_on_event_loop()
+
+
+def test_check_solleva_nel_loop(monkeypatch):
+    monkeypatch.setattr(database, "ASYNC_BLOCKING_CHECK", "raise")
+
+    async def nel_loop():
+        database.check_not_on_event_loop()
+
+    with pytest.raises(RuntimeError, match="event loop"):
+        asyncio.run(nel_loop())
+
+
+@pytest.mark.parametrize("path", ["/_test/async-connect", "/_test/async-query"])
+def test_handler_async_bloccante_fallisce(client, async_routes, path):
+    with pytest.raises(RuntimeError, match="event loop"):
+        client.get(path)
+
+
+@pytest.mark.parametrize("method, path, status", [
+    ("get", "/api/valutazioni/esposizione/1/documenti", 200),
+    ("delete", "/api/documenti/1", 404),
+    ("get", "/api/documenti/1/download", 404),
+])
+def test_handler_documenti_nel_threadpool(client, method, path, status):
+    response = getattr(client, method)(path)
+    assert response.status_code == status
+
+
+def test_monitor_registra_il_ritardo():
+    def lag_totale():
+        return REGISTRY.get_sample_value("event_loop_lag_seconds_sum") or 0.0
+
+    async def blocca_il_loop():
+        monitor = asyncio.create_task(metrics.monitor_event_loop(interval=0.05))
+        await asyncio.sleep(0.01)
+        time.sleep(0.3)
+        await asyncio.sleep(0.1)
+        monitor.cancel()
+
+    prima = lag_totale()
+    asyncio.run(blocca_il_loop())
+    assert lag_totale() - prima >= 0.2
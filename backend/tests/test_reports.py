@@ -0,0 +1,40 @@
+"""
+Rendering dei report con testo inserito dall'utente che somiglia a markup
+(reportlab interpreta i Paragraph come mini-HTML)
+"""
+import pytest
+
+import reports
+
+MARKUP = ["Reparto <b>A", "<font color=red>", "a </para> b", '<img src="/etc/passwd"/>', "R&D &amp; <>"]
+
+
+def _dati(tipo: str, testo: str) -> dict:
+    return {
+        "tipo": tipo,
+        "valutazione": {
+            "id": 1, "created_at": "2024-05-02T10:00:00", "mansione": testo, "reparto": testo,
+            "lex": "86.3", "lpicco": "131.0", "classe_rischio": testo,
+            "dpi_selezionato": testo, "h": "32", "m": "29", "l": "26",
+            "lex_per_dpi": "92.4", "pnr": "25.2", "leff": "67.2", "protezione_adeguata": testo,
+        },
+        "misurazioni": [{"attivita": testo, "leq": "86.3", "durata": "480", "lpicco": "131.0"}],
+        "azienda": {
+            "ragione_sociale": testo, "partita_iva": "12345678901", "codice_fiscale": testo,
+            "indirizzo": testo, "citta": testo, "cap": "00100", "provincia": "RM",
+            "rappresentante_legale": testo,
+        },
+    }
+
+
+@pytest.mark.parametrize("tipo", ["esposizione", "dpi"])
+@pytest.mark.parametrize("testo", MARKUP)
+def test_pdf_con_markup_nei_campi(tipo, testo):
+    pdf = reports.render_pdf(_dati(tipo, testo))
+    assert pdf.startswith(b"%PDF")
+
+
+@pytest.mark.parametrize("tipo", ["esposizione", "dpi"])
+def test_docx_con_markup_nei_campi(tipo):
+    from reports_docx import render_docx
+    assert render_docx(_dati(tipo, MARKUP[0])).startswith(b"PK")
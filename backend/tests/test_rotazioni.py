@@ -0,0 +1,69 @@
+"""
+Ricerca locale delle rotazioni: deve arrivare a un ottimo locale e fermarsi
+(senza ciclare su mosse a guadagno nullo né ricontrollare tutti i lavoratori)
+"""
+import time
+
+import numpy as np
+
+import rotazioni
+
+
+def _reparto(seed=0, lavoratori=300, attivita=12):
+    rng = np.random.default_rng(seed)
+    leq = rng.uniform(70, 100, attivita)
+    abilitato = rng.random((lavoratori, attivita)) < 0.5
+    turni = np.full(lavoratori, 480.0)
+    fabbisogno = np.full(attivita, lavoratori * 480 * 0.7 / attivita)
+    return leq, fabbisogno, turni, abilitato
+
+
+def test_ricerca_converge_a_ottimo_locale():
+    leq, fabbisogno, turni, abilitato = _reparto()
+    risultato = rotazioni.pianifica(leq, fabbisogno, turni, abilitato, tempo_max=60)
+    assert risultato["iterazioni"] < 10_000
+
+    # Ripartendo dalla soluzione nessuna mossa è migliorativa: un'iterazione
+    # per bloccare ogni lavoratore e una per uscire
+    energia = 15 / 480 * 10 ** (0.1 * leq)
+    capacita = np.full(len(turni), 32)
+    conteggi, iterazioni = rotazioni.migliora(
+        risultato["conteggi"], energia, capacita, abilitato, time.monotonic() + 60
+    )
+    assert np.array_equal(conteggi, risultato["conteggi"])
+    assert iterazioni == len(turni) + 1
+
+
+def test_fabbisogno_coperto_entro_i_turni():
+    leq, fabbisogno, turni, abilitato = _reparto(seed=1, lavoratori=40)
+    conteggi = rotazioni.pianifica(leq, fabbisogno, turni, abilitato, tempo_max=10)["conteggi"]
+    assert (conteggi.sum(axis=0) == np.ceil(fabbisogno / 15 - 1e-9)).all()
+    assert (conteggi.sum(axis=1) <= 32).all()
+    assert not (conteggi[~abilitato]).any()
+
+
+def _riempi_uno_alla_volta(energia_lav, residua, candidati, e, n):
+    energia_lav, residua = energia_lav.copy(), residua.copy()
+    k = np.zeros(len(energia_lav), dtype=np.int64)
+    for _ in range(n):
+        liberi = candidati & (residua > 0)
+        w = int(np.argmin(np.where(liberi, energia_lav, np.inf)))
+        k[w] += 1
+        residua[w] -= 1
+        energia_lav[w] += e
+    return k
+
+
+def test_riempimento_in_blocco_come_slot_per_slot():
+    rng = np.random.default_rng(7)
+    for caso in range(300):
+        lavoratori = int(rng.integers(1, 30))
+        energia_lav = rng.uniform(0, 1e9, lavoratori)
+        if caso % 4 == 0:
+            energia_lav = np.round(energia_lav, -8)     # pareggi
+        residua = rng.integers(0, 20, lavoratori)
+        candidati = rng.random(lavoratori) < 0.7
+        e = float(rng.choice([rng.uniform(1e5, 2e8), -rng.uniform(0, 3e6), 0.0], p=[0.7, 0.2, 0.1]))
+        n = int(rng.integers(0, residua[candidati].sum() + 1))
+        atteso = _riempi_uno_alla_volta(energia_lav, residua, candidati, e, n)
+        assert np.array_equal(rotazioni._riempi(energia_lav, residua, candidati, e, n), atteso), caso
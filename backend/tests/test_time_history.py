@@ -0,0 +1,99 @@
+"""
+Import delle time history: campioni fuori intervallo trattati come non validi,
+quota consumata prima del caricamento e serie rimossa se la scrittura fallisce
+"""
+import io
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+import time_history
+
+LOG = b"LAeq;LCpeak\n80;120\n1e6;130\ninf;140\n-80;125\nabc;121\n80;122\n"
+
+
+def test_campioni_fuori_intervallo_non_validi():
+    log = time_history.leggi_time_history(io.BytesIO(LOG))
+    assert log.non_validi == 4
+    [riga] = log.misurazioni()
+    assert riga["leq"] == 80.0 and riga["campioni"] == 2
+    leq, _ = log.serie()
+    assert np.isnan(leq[1:5]).all()
+
+
+class FakeCursor:
+    def __init__(self, errore_insert=False):
+        self.errore_insert = errore_insert
+        self.query = ""
+
+    def execute(self, query, vars=None):
+        self.query = query
+        if self.errore_insert and "UPDATE valutazioni_esposizione" in query:
+            raise RuntimeError("scrittura fallita")
+
+    def fetchone(self):
+        return {"serie_key": None}
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self, *args, **kwargs):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def ambiente(monkeypatch):
+    eventi = []
+    monkeypatch.setattr(main.serie_temporali, "carica", lambda contenuto: eventi.append("carica") or "serie/x.srt")
+    monkeypatch.setattr(main.storage, "delete_objects", lambda keys: eventi.append(("elimina", keys)))
+    monkeypatch.setattr(main, "execute_values", lambda *args, **kwargs: None)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 1, "is_admin": False}
+    yield eventi
+    main.app.dependency_overrides.clear()
+
+
+def _importa(conn):
+    main.app.dependency_overrides[main.get_db] = lambda: conn
+    return TestClient(main.app).post(
+        "/api/esposizione/1/time-history", files={"file": ("log.csv", LOG, "text/csv")}
+    )
+
+
+def test_quota_prima_del_caricamento(ambiente, monkeypatch):
+    def rifiuta(cursor, user_id, resource, quantity=1):
+        raise HTTPException(status_code=403, detail="Spazio esaurito")
+
+    monkeypatch.setattr(main, "consume_quota", rifiuta)
+    assert _importa(FakeConnection(FakeCursor())).status_code == 403
+    assert ambiente == []
+
+
+def test_serie_rimossa_se_la_scrittura_fallisce(ambiente, monkeypatch):
+    monkeypatch.setattr(main, "consume_quota", lambda *args, **kwargs: None)
+    conn = FakeConnection(FakeCursor(errore_insert=True))
+    assert _importa(conn).status_code == 500
+    assert ambiente == ["carica", ("elimina", ["serie/x.srt"])]
+    assert conn.commits == 0
+
+
+def test_import_riuscito_mantiene_la_serie(ambiente, monkeypatch):
+    monkeypatch.setattr(main, "consume_quota", lambda *args, **kwargs: None)
+    response = _importa(FakeConnection(FakeCursor()))
+    assert response.status_code == 200
+    assert response.json()["campioni_non_validi"] == 4
+    assert ambiente == ["carica"]
@@ -0,0 +1,61 @@
+"""
+Ricalcolo lato server con valori fuori intervallo: le scritture singole
+rispondono 422 prima del ricalcolo (10^(Leq/10) andrebbe in overflow)
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import verifica
+
+
+class NessunDatabase:
+    """Il controllo avviene prima di aprire un cursore"""
+
+    def cursor(self, *args, **kwargs):
+        raise AssertionError("Il database non deve essere usato")
+
+
+@pytest.fixture
+def client():
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 1, "is_admin": False}
+    main.app.dependency_overrides[main.get_db] = lambda: NessunDatabase()
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def _esposizione(leq="85.0", durata="480", lpicco="130"):
+    return {
+        "mansione": "Operatore", "reparto": "Produzione",
+        "misurazioni": [{"attivita": "Pressa", "leq": leq, "durata": durata, "lpicco": lpicco}],
+        "lex": "85.0", "lpicco": "130.0", "classe_rischio": "",
+    }
+
+
+def _dpi(lex_per_dpi="92.4"):
+    return {
+        "mansione": "Operatore", "reparto": "Produzione", "dpi_selezionato": "Inserti",
+        "valori_hml": {"h": "32", "m": "29", "l": "26"}, "lex_per_dpi": lex_per_dpi,
+    }
+
+
+def test_esposizione_ricalcolata():
+    misurazioni = [main.MisurazioneAPI(attivita="Pressa", leq="85.0", durata="480", lpicco="130")]
+    assert verifica.esposizione(misurazioni) == {
+        "lex": 85.0, "lpicco": 130.0, "classe_rischio": verifica.classe_rischio(85.0)
+    }
+
+
+@pytest.mark.parametrize("method, path", [("post", "/api/esposizione"), ("put", "/api/esposizione/1")])
+@pytest.mark.parametrize("campi", [{"leq": "4000"}, {"leq": "1e999"}, {"durata": "1e9"}, {"lpicco": "abc"}])
+def test_esposizione_fuori_intervallo(client, method, path, campi):
+    response = getattr(client, method)(path, json=_esposizione(**campi))
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("misurazioni[0].")
+
+
+@pytest.mark.parametrize("method, path", [("post", "/api/dpi"), ("put", "/api/dpi/1")])
+def test_dpi_fuori_intervallo(client, method, path):
+    response = getattr(client, method)(path, json=_dpi(lex_per_dpi="1e999"))
+    assert response.status_code == 422
+    assert response.json()["detail"] == "lex_per_dpi: valore fuori intervallo"
@@ -0,0 +1,237 @@
+"""
+Importazione delle time history di fonometri e dosimetri
+Il log esportato dallo strumento (CSV o testo, un campione per riga) è letto
+a blocchi di TIME_HISTORY_CHUNK_RIGHE righe: per ogni blocco l'energia, il
+numero di campioni e il Lpicco massimo di ogni attività sono accumulati con
+NumPy, quindi la memoria non dipende dalla lunghezza del turno (a parte la
+serie float32 destinata allo storage).
+
+Le attività sono prese, in ordine di priorità, dai segmenti passati dal
+client (secondi dall'inizio del log), da una colonna attività/marker del
+log, altrimenti l'intera registrazione è un'unica attività.
+"""
+from typing import List, Optional
+import csv
+import io
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+# Righe convertite in array a ogni passo
+TIME_HISTORY_CHUNK_RIGHE = int(os.getenv("TIME_HISTORY_CHUNK_RIGHE", "65536"))
+
+# Campioni massimi per log (a 1 s: circa 58 giorni)
+TIME_HISTORY_MAX_CAMPIONI = int(os.getenv("TIME_HISTORY_MAX_CAMPIONI", "5000000"))
+
+# Livelli plausibili in dB: fuori (o inf) il campione è non valido, come quelli non
+# numerici; i valori salvati restano nei limiti delle colonne DECIMAL(5,2)
+LIVELLO_MIN = -50.0
+LIVELLO_MAX = 200.0
+
+# Righe di intestazione dello strumento tollerate prima dei nomi delle colonne
+_MAX_RIGHE_PREAMBOLO = 50
+
+# Nomi di colonna normalizzati (minuscolo, solo lettere e cifre), per prefisso
+_COLONNE_LEQ = ("laeq", "leq", "lageq")
+_COLONNE_PICCO = ("lcpeak", "lcpk", "lcpicco", "lpicco", "lpeak", "lpk", "peak", "picco")
+_COLONNE_ATTIVITA = ("attivita", "marker", "evento", "activity", "event")
+
+ATTIVITA_NON_ASSEGNATA = "Non assegnato"
+ATTIVITA_UNICA = "Registrazione completa"
+
+_NON_ALFANUMERICO = re.compile(r"[^a-z0-9]")
+
+
+def _nome_colonna(nome: str) -> str:
+    nome = unicodedata.normalize("NFKD", nome)
+    return _NON_ALFANUMERICO.sub("", "".join(c for c in nome if not unicodedata.combining(c)).lower())
+
+
+def _trova(nomi: list, prefissi: tuple) -> Optional[int]:
+    for prefisso in prefissi:
+        for i, nome in enumerate(nomi):
+            if nome.startswith(prefisso):
+                return i
+    return None
+
+
+def _numeri(valori: list) -> np.ndarray:
+    """
+    Stringhe (anche con virgola decimale) -> livelli float64; i valori non
+    numerici o fuori da [LIVELLO_MIN, LIVELLO_MAX) diventano NaN
+    """
+    valori = [v.strip().replace(",", ".") for v in valori]
+    try:
+        numeri = np.array(valori, dtype=np.float64)
+    except ValueError:
+        numeri = np.full(len(valori), np.nan)
+        for i, valore in enumerate(valori):
+            try:
+                numeri[i] = float(valore)
+            except ValueError:
+                pass
+    with np.errstate(invalid="ignore"):
+        numeri[~((numeri >= LIVELLO_MIN) & (numeri < LIVELLO_MAX))] = np.nan
+    return numeri
+
+
+class TimeHistory:
+    """Accumulatori per attività e serie grezza di un log"""
+
+    def __init__(self, intervallo: float, con_picco: bool):
+        self.intervallo = intervallo
+        self.attivita = []          # codice -> nome, in ordine di prima comparsa
+        self._codici = {}
+        self.energia = np.zeros(0)
+        self.campioni = np.zeros(0, dtype=np.int64)
+        self.picco = np.zeros(0)
+        self.non_validi = 0
+        self.esclusi = 0
+        self._leq = []
+        self._picco = [] if con_picco else None
+
+    def codice(self, nome: str) -> int:
+        codice = self._codici.get(nome)
+        if codice is None:
+            codice = self._codici[nome] = len(self.attivita)
+            self.attivita.append(nome)
+            self.energia = np.append(self.energia, 0.0)
+            self.campioni = np.append(self.campioni, 0)
+            self.picco = np.append(self.picco, np.nan)
+        return codice
+
+    @property
+    def totale_campioni(self) -> int:
+        return sum(len(blocco) for blocco in self._leq)
+
+    def aggiungi(self, leq: np.ndarray, picco: Optional[np.ndarray], codici: np.ndarray):
+        """Un blocco di campioni; codice -1 = fuori dai segmenti"""
+        self._leq.append(leq.astype(np.float32))
+        if self._picco is not None:
+            self._picco.append(picco.astype(np.float32))
+
+        validi = ~np.isnan(leq)
+        self.non_validi += int(np.count_nonzero(~validi))
+        assegnati = codici >= 0
+        self.esclusi += int(np.count_nonzero(validi & ~assegnati))
+        usati = validi & assegnati
+
+        n = len(self.attivita)
+        self.energia += np.bincount(codici[usati], weights=10 ** (0.1 * leq[usati]), minlength=n)
+        self.campioni += np.bincount(codici[usati], minlength=n)
+        if picco is not None:
+            con_picco = assegnati & ~np.isnan(picco)
+            massimi = np.full(n, -np.inf)
+            np.maximum.at(massimi, codici[con_picco], picco[con_picco])
+            self.picco = np.fmax(self.picco, np.where(np.isinf(massimi), np.nan, massimi))
+
+    def serie(self) -> tuple:
+        """(leq, lpicco o None) dell'intero log in float32"""
+        leq = np.concatenate(self._leq) if self._leq else np.zeros(0, dtype=np.float32)
+        if self._picco is None:
+            return leq, None
+        return leq, (np.concatenate(self._picco) if self._picco else np.zeros(0, dtype=np.float32))
+
+    def misurazioni(self) -> List[dict]:
+        """Righe di misurazioni: Leq energetico, durata in minuti e Lpicco massimo per attività"""
+        righe = []
+        for codice, nome in enumerate(self.attivita):
+            campioni = int(self.campioni[codice])
+            if not campioni:
+                continue
+            picco = self.picco[codice]
+            righe.append({
+                "attivita": nome[:255],
+                "leq": round(float(10 * np.log10(self.energia[codice] / campioni)), 1),
+                "durata": round(campioni * self.intervallo / 60, 2),
+                "lpicco": None if np.isnan(picco) else round(float(picco), 1),
+                "campioni": campioni,
+            })
+        return righe
+
+
+def leggi_time_history(binary_file, intervallo: float = 1.0, segmenti: Optional[list] = None) -> TimeHistory:
+    """
+    Legge un log per campioni e ne accumula le attività
+
+    Args:
+        binary_file: File caricato (letto in streaming)
+        intervallo: Secondi tra due campioni
+        segmenti: [{"attivita", "inizio", "fine"}] in secondi dall'inizio del log;
+                  i campioni fuori dai segmenti sono esclusi
+
+    Raises:
+        ValueError: intestazione senza colonna Leq, log vuoto o troppo lungo
+    """
+    text = io.TextIOWrapper(binary_file, encoding="utf-8-sig", errors="replace", newline="")
+
+    # I log degli strumenti hanno spesso righe descrittive prima dell'intestazione
+    col_leq = None
+    for _ in range(_MAX_RIGHE_PREAMBOLO):
+        header = text.readline()
+        if not header:
+            break
+        delimiter = max(("\t", ";", ","), key=header.count)
+        nomi = [_nome_colonna(n) for n in next(csv.reader([header], delimiter=delimiter), [])]
+        col_leq = _trova(nomi, _COLONNE_LEQ)
+        if col_leq is not None:
+            break
+    if col_leq is None:
+        raise ValueError("Colonna Leq/LAeq non trovata nell'intestazione")
+
+    col_picco = _trova(nomi, _COLONNE_PICCO)
+    col_attivita = _trova(nomi, _COLONNE_ATTIVITA) if not segmenti else None
+    result = TimeHistory(intervallo, col_picco is not None)
+
+    if segmenti:
+        # Confini ordinati: il campione i cade nel segmento k se inizio_k <= t_i < fine_k
+        segmenti = sorted(segmenti, key=lambda s: s["inizio"])
+        inizi = np.array([s["inizio"] for s in segmenti], dtype=np.float64)
+        fini = np.array([s["fine"] for s in segmenti], dtype=np.float64)
+        if np.any(fini <= inizi) or np.any(inizi[1:] < fini[:-1]):
+            raise ValueError("Segmenti vuoti o sovrapposti")
+        codici_segmento = np.array([result.codice(s["attivita"]) for s in segmenti])
+    elif col_attivita is None:
+        codice_unico = result.codice(ATTIVITA_UNICA)
+
+    reader = csv.reader(text, delimiter=delimiter)
+    inizio_blocco = 0
+    while True:
+        righe = [r for _, r in zip(range(TIME_HISTORY_CHUNK_RIGHE), reader) if r and any(r)]
+        if not righe:
+            break
+        if inizio_blocco + len(righe) > TIME_HISTORY_MAX_CAMPIONI:
+            raise ValueError(f"Log troppo lungo (massimo {TIME_HISTORY_MAX_CAMPIONI} campioni)")
+
+        leq = _numeri([r[col_leq] if len(r) > col_leq else "" for r in righe])
+        picco = None
+        if col_picco is not None:
+            picco = _numeri([r[col_picco] if len(r) > col_picco else "" for r in righe])
+
+        if segmenti:
+            tempi = (inizio_blocco + np.arange(len(righe))) * intervallo
+            k = np.searchsorted(inizi, tempi, side="right") - 1
+            dentro = (k >= 0) & (tempi < fini[np.maximum(k, 0)])
+            codici = np.where(dentro, codici_segmento[np.maximum(k, 0)], -1)
+        elif col_attivita is not None:
+            # Poche etichette distinte per blocco: np.unique evita un lookup per riga
+            etichette = np.array([
+                (r[col_attivita].strip() if len(r) > col_attivita else "") or ATTIVITA_NON_ASSEGNATA
+                for r in righe
+            ])
+            distinte, prima, inverso = np.unique(etichette, return_index=True, return_inverse=True)
+            codici_distinte = np.empty(len(distinte), dtype=np.int64)
+            for i in np.argsort(prima):
+                codici_distinte[i] = result.codice(str(distinte[i]))
+            codici = codici_distinte[inverso]
+        else:
+            codici = np.full(len(righe), codice_unico)
+
+        result.aggiungi(leq, picco, codici)
+        inizio_blocco += len(righe)
+
+    if not inizio_blocco:
+        raise ValueError("Il log non contiene campioni")
+    return result
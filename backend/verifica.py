@@ -0,0 +1,179 @@
+"""
+Ricalcolo lato server dei risultati inviati dal client
+LEX, Lpicco e classe di rischio delle valutazioni esposizione, PNR, L'eff e
+protezione delle valutazioni DPI sono ricalcolati dai dati grezzi con le
+stesse regole di src/utils/noiseCalculations.ts (parseFloat compreso) e
+confrontati con quelli ricevuti.
+
+Una valutazione ha poche misurazioni: il ricalcolo è aritmetica scalare con
+il modulo math, senza allocare array (con NumPy il solo overhead delle
+chiamate supererebbe il calcolo). `python verifica.py` misura il costo.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+from typing import List, Optional
+import math
+import os
+import re
+
+from noise_calculations import PROTEZIONE_CLASSI, RISCHIO_CLASSI
+
+# correggi: salva i valori del server e segnala le differenze
+# rifiuta: scrittura respinta (422) se i valori non coincidono
+# segnala: salva i valori del client e segnala le differenze
+VERIFICA_CALCOLI = os.getenv("VERIFICA_CALCOLI", "correggi")
+
+# Il client arrotonda a 0.1 dB: differenze fino a mezzo decimale sono arrotondamenti
+TOLLERANZA_DB = 0.05 + 1e-9
+
+# Prefisso numerico letto da parseFloat
+_NUMERO = re.compile(r"\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)")
+
+_DECIMO = Decimal("0.1")
+
+# (limite, coefficienti H, M, L) delle fasce HML di calcolaAttenuazione
+_FASCE_HML = (
+    (80, -1 / 4, 1, -1 / 4),
+    (90, -1 / 2, 1, -1 / 8),
+    (95, -1 / 4, 1, 0),
+    (100, 0, 1, 0),
+    (105, 1 / 4, 1, 0),
+    (110, 1 / 2, 1, 1 / 4),
+    (math.inf, 3 / 4, 1, 1 / 2),
+)
+
+
+def parse_float(valore) -> float:
+    """parseFloat di JavaScript: prefisso numerico della stringa, NaN se assente"""
+    if valore is None:
+        return math.nan
+    # Caso comune (stringa già numerica): float() in C, senza regex
+    if "_" not in valore:
+        try:
+            numero = float(valore)
+            if math.isfinite(numero):
+                return numero
+        except ValueError:
+            pass
+    trovato = _NUMERO.match(valore)
+    return float(trovato.group(1)) if trovato else math.nan
+
+
+def to_fixed(valore: float) -> float:
+    """toFixed(1) di JavaScript: metà arrotondate lontano dallo zero sul valore binario esatto"""
+    return float(Decimal(valore).quantize(_DECIMO, rounding=ROUND_HALF_UP))
+
+
+def classe_rischio(lex: float) -> str:
+    """getClasseRischio"""
+    if lex < 80:
+        return RISCHIO_CLASSI[0]
+    if lex < 85:
+        return RISCHIO_CLASSI[1]
+    if lex < 87:
+        return RISCHIO_CLASSI[2]
+    return RISCHIO_CLASSI[3]
+
+
+def esposizione(misurazioni) -> dict:
+    """
+    calcolaLEX, getLpiccoMax e getClasseRischio sulle misurazioni ricevute
+
+    Args:
+        misurazioni: oggetti con attributi leq, durata, lpicco (stringhe)
+    """
+    somma = 0.0
+    lpicco = -math.inf
+    for mis in misurazioni:
+        leq = parse_float(mis.leq)
+        durata = parse_float(mis.durata)
+        if leq == leq and durata == durata and durata > 0:
+            somma += 10 ** (leq / 10) * durata
+        picco = parse_float(mis.lpicco)
+        if picco > lpicco:
+            lpicco = picco
+    lex = to_fixed(10 * math.log10(somma / 480)) if somma > 0 else 0.0
+    return {
+        "lex": lex,
+        "lpicco": to_fixed(lpicco) if lpicco > -math.inf else 0.0,
+        "classe_rischio": classe_rischio(lex),
+    }
+
+
+def dpi(lex_per_dpi: Optional[str], h: str, m: str, l: str) -> Optional[dict]:
+    """
+    calcolaAttenuazione; None se lex_per_dpi non è un numero (il client
+    userebbe il LEX della valutazione, che qui non è disponibile)
+    """
+    lex = parse_float(lex_per_dpi)
+    if lex != lex:
+        return None
+    valori = [parse_float(v) for v in (h, m, l)]
+    h, m, l = [v if v == v else 0.0 for v in valori]
+    if lex == 0 or (h == 0 and m == 0 and l == 0):
+        return {"pnr": 0.0, "leff": 0.0, "protezione_adeguata": ""}
+
+    for limite, ch, cm, cl in _FASCE_HML:
+        if lex <= limite:
+            pnr = ch * h + cm * m + cl * l
+            break
+    leff = lex - pnr
+    if leff < 65:
+        protezione = PROTEZIONE_CLASSI[0]
+    elif leff < 70:
+        protezione = PROTEZIONE_CLASSI[1]
+    elif leff <= 80:
+        protezione = PROTEZIONE_CLASSI[2]
+    elif leff <= 85:
+        protezione = PROTEZIONE_CLASSI[3]
+    else:
+        protezione = PROTEZIONE_CLASSI[4]
+    return {"pnr": to_fixed(pnr), "leff": to_fixed(leff), "protezione_adeguata": protezione}
+
+
+def discrepanze(inviati: dict, calcolati: dict) -> List[dict]:
+    """
+    Campi in cui il valore del client differisce da quello ricalcolato
+    I valori numerici sono confrontati con TOLLERANZA_DB, i testi esattamente;
+    un campo non inviato (None) non è una discrepanza
+    """
+    differenze = []
+    for campo, calcolato in calcolati.items():
+        inviato = inviati.get(campo)
+        if inviato is None:
+            continue
+        if isinstance(calcolato, float):
+            numero = parse_float(inviato)
+            uguale = numero == numero and abs(numero - calcolato) <= TOLLERANZA_DB
+        else:
+            uguale = inviato.strip() == calcolato
+        if not uguale:
+            differenze.append({"campo": campo, "inviato": inviato, "calcolato": calcolato})
+    return differenze
+
+
+def formatta(calcolati: dict) -> dict:
+    """Valori ricalcolati nel formato stringa dei modelli (toFixed(1))"""
+    return {campo: f"{valore:.1f}" if isinstance(valore, float) else valore for campo, valore in calcolati.items()}
+
+
+if __name__ == "__main__":
+    import timeit
+    from types import SimpleNamespace
+
+    def _misura(n):
+        return [SimpleNamespace(leq=f"{75 + i % 20}.{i % 10}", durata=f"{480 / n:.1f}", lpicco=f"{120 + i % 15}")
+                for i in range(n)]
+
+    print("Ricalcolo lato server (microsecondi per valutazione)")
+    for n in (1, 5, 10, 50):
+        misurazioni = _misura(n)
+        calcolati = esposizione(misurazioni)
+        inviati = formatta(calcolati)
+        ripetizioni, tempo = timeit.Timer(
+            lambda: discrepanze(inviati, esposizione(misurazioni))
+        ).autorange()
+        print(f"  esposizione, {n:>2} misurazioni: {tempo / ripetizioni * 1e6:6.2f} µs")
+    calcolati = dpi("92.4", "32", "29", "26")
+    inviati = formatta(calcolati)
+    ripetizioni, tempo = timeit.Timer(lambda: discrepanze(inviati, dpi("92.4", "32", "29", "26"))).autorange()
+    print(f"  DPI (HML):                   {tempo / ripetizioni * 1e6:6.2f} µs")
@@ -23,6 +23,7 @@ import {
   TableRow,
 } from '@/components/ui/table';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 
 interface AdminUser {
   id: number;
@@ -36,6 +37,26 @@ interface AdminUser {
   num_valutazioni_dpi: number;
 }
 
+interface AdminStats {
+  num_utenti: number;
+  num_admin: number;
+  num_aziende: number;
+}
+
+// Ordinamenti della lista utenti (parametri sort/order di GET /api/admin/users)
+const ORDINAMENTI: Record<string, { label: string; sort: string; order: 'asc' | 'desc' }> = {
+  recenti: { label: 'Registrati di recente', sort: 'created_at', order: 'desc' },
+  meno_recenti: { label: 'Registrati da più tempo', sort: 'created_at', order: 'asc' },
+  accesso: { label: 'Ultimo accesso', sort: 'last_login', order: 'desc' },
+  nome: { label: 'Nome (A-Z)', sort: 'nome', order: 'asc' },
+  email: { label: 'Email (A-Z)', sort: 'email', order: 'asc' },
+  aziende: { label: 'Più aziende', sort: 'num_aziende', order: 'desc' },
+  esposizione: { label: 'Più valutazioni esposizione', sort: 'num_valutazioni_esposizione', order: 'desc' },
+  dpi: { label: 'Più valutazioni DPI', sort: 'num_valutazioni_dpi', order: 'desc' },
+};
+
+const PAGE_SIZE = 100;
+
 const API_BASE_URL = import.meta.env.VITE_API_URL ||
   (import.meta.env.MODE === 'production' ? '' : 'http://72.61.189.136');
 
@@ -43,7 +64,12 @@ const Admin = () => {
   const { user, token, isAdmin } = useAuth();
   const navigate = useNavigate();
   const [users, setUsers] = useState<AdminUser[]>([]);
+  const [stats, setStats] = useState<AdminStats | null>(null);
+  const [totalUsers, setTotalUsers] = useState(0);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [ordinamento, setOrdinamento] = useState('recenti');
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [deleteConfirm, setDeleteConfirm] = useState<AdminUser | null>(null);
   const [deleting, setDeleting] = useState(false);
 
@@ -59,25 +85,51 @@ const Admin = () => {
     }
   }, [isAdmin, navigate]);
 
-  // Carica lista utenti
+  // Carica lista utenti (prima pagina) e totali
   useEffect(() => {
     if (isAdmin) {
       loadUsers();
+      loadStats();
     }
-  }, [isAdmin]);
+  }, [isAdmin, ordinamento]);
 
-  const loadUsers = async () => {
-    setLoading(true);
+  const loadStats = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/api/admin/users`, {
+      const response = await fetch(`${API_BASE_URL}/api/admin/stats`, {
+        headers: {
+          'Authorization': `Bearer ${token}`,
+        },
+      });
+      if (response.ok) {
+        setStats(await response.json());
+      }
+    } catch (error) {
+      // Le card restano senza totali; la lista segnala già gli errori di connessione
+    }
+  };
+
+  // Senza cursore ricarica dalla prima pagina, altrimenti accoda la pagina successiva
+  const loadUsers = async (after?: string) => {
+    const { sort, order } = ORDINAMENTI[ordinamento];
+    const params = new URLSearchParams({ sort, order, page_size: String(PAGE_SIZE) });
+    if (after) {
+      params.set('after', after);
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/admin/users?${params}`, {
         headers: {
           'Authorization': `Bearer ${token}`,
         },
       });
 
       if (response.ok) {
-        const data = await response.json();
-        setUsers(data);
+        const data: AdminUser[] = await response.json();
+        setUsers(prev => (after ? [...prev, ...data] : data));
+        setNextCursor(response.headers.get('X-Next-Cursor'));
+        setTotalUsers(Number(response.headers.get('X-Total-Count') ?? data.length));
       } else {
         const error = await response.json();
         toast({
@@ -94,6 +146,7 @@ const Admin = () => {
       });
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -114,6 +167,7 @@ const Admin = () => {
           description: `${data.deleted_user.nome} (${data.deleted_user.email}) è stato eliminato con successo`,
         });
         loadUsers();
+        loadStats();
         setDeleteConfirm(null);
       } else {
         const error = await response.json();
@@ -178,32 +232,42 @@ const Admin = () => {
           <Card>
             <CardHeader className="pb-3">
               <CardDescription>Totale Utenti</CardDescription>
-              <CardTitle className="text-3xl">{users.length}</CardTitle>
+              <CardTitle className="text-3xl">{stats?.num_utenti ?? totalUsers}</CardTitle>
             </CardHeader>
           </Card>
           <Card>
             <CardHeader className="pb-3">
               <CardDescription>Amministratori</CardDescription>
-              <CardTitle className="text-3xl">{users.filter(u => u.is_admin).length}</CardTitle>
+              <CardTitle className="text-3xl">{stats?.num_admin ?? '-'}</CardTitle>
             </CardHeader>
           </Card>
           <Card>
             <CardHeader className="pb-3">
               <CardDescription>Aziende Totali</CardDescription>
-              <CardTitle className="text-3xl">
-                {users.reduce((sum, u) => sum + u.num_aziende, 0)}
-              </CardTitle>
+              <CardTitle className="text-3xl">{stats?.num_aziende ?? '-'}</CardTitle>
             </CardHeader>
           </Card>
         </div>
 
         {/* Users Table */}
         <Card>
-          <CardHeader>
-            <CardTitle>Utenti Registrati</CardTitle>
-            <CardDescription>
-              Lista completa degli utenti e dei loro dati
-            </CardDescription>
+          <CardHeader className="flex flex-col md:flex-row md:items-center md:justify-between gap-4">
+            <div>
+              <CardTitle>Utenti Registrati</CardTitle>
+              <CardDescription>
+                {users.length} di {totalUsers} utenti visualizzati
+              </CardDescription>
+            </div>
+            <Select value={ordinamento} onValueChange={setOrdinamento}>
+              <SelectTrigger className="w-[250px]">
+                <SelectValue />
+              </SelectTrigger>
+              <SelectContent>
+                {Object.entries(ORDINAMENTI).map(([key, { label }]) => (
+                  <SelectItem key={key} value={key}>{label}</SelectItem>
+                ))}
+              </SelectContent>
+            </Select>
           </CardHeader>
           <CardContent>
             {loading ? (
@@ -274,6 +338,17 @@ const Admin = () => {
                     ))}
                   </TableBody>
                 </Table>
+                {nextCursor && (
+                  <div className="flex justify-center pt-4">
+                    <Button
+                      variant="outline"
+                      onClick={() => loadUsers(nextCursor)}
+                      disabled={loadingMore}
+                    >
+                      {loadingMore ? 'Caricamento...' : `Carica altri utenti (${totalUsers - users.length} rimanenti)`}
+                    </Button>
+                  </div>
+                )}
               </div>
             )}
           </CardContent>